@@ -0,0 +1,114 @@
+"""
+Compact session representation of the shopping bag.
+
+The session holds {'v': BAG_SCHEMA, 'items': {item_id: quantity}}. An
+item id is the product's primary key, followed by the sorted ids of any
+attachments, joined by dashes: '12' or '12-1-4'. Prices, names, SKUs
+and images are not stored; they are looked up in the catalogue when the
+bag is priced or rendered.
+
+Bags stored by older releases, keyed by product id or by SKU and colour
+with a dict of display data per line, are upgraded the first time they
+are read.
+"""
+from products.attachments import attachment_catalogue
+from products.models import Product
+
+# Bump when the session layout changes, and upgrade older bags in
+# get_session_bag
+BAG_SCHEMA = 2
+
+
+def get_item_id(product_id, attachments=()):
+    """Bag item id for a product with the given attachment SKUs"""
+    attachment_ids = sorted({
+        attachment_id for attachment_id in
+        (attachment_catalogue.get_id(sku) for sku in attachments)
+        if attachment_id is not None
+    })
+    return '-'.join(str(part) for part in [product_id, *attachment_ids])
+
+
+def parse_item_id(item_id):
+    """
+    Return (product_id, attachment SKUs) for a bag item id. Raises
+    ValueError if the id is malformed.
+    """
+    product_id, *attachment_ids = (int(part) for part in item_id.split('-'))
+    attachments = [
+        sku for sku in
+        (attachment_catalogue.get_sku(attachment_id)
+         for attachment_id in attachment_ids)
+        if sku is not None
+    ]
+    return product_id, attachments
+
+
+def expand_bag(items):
+    """
+    Decode bag items into {item_id: line}, where each line has the
+    product_id, quantity and attachment SKUs. Malformed ids are skipped.
+    """
+    lines = {}
+    for item_id, quantity in items.items():
+        try:
+            product_id, attachments = parse_item_id(item_id)
+        except ValueError:
+            continue
+        lines[item_id] = {
+            'product_id': product_id,
+            'quantity': quantity,
+            'attachments': attachments,
+        }
+    return lines
+
+
+def upgrade_legacy_bag(bag):
+    """Convert a bag stored before BAG_SCHEMA 2 to compact items"""
+    product_ids = set()
+    skus = set()
+    for item_id, item_data in bag.items():
+        if not isinstance(item_data, dict):
+            continue
+        if item_id.isdigit():
+            product_ids.add(int(item_id))
+        elif item_data.get('sku'):
+            skus.add(item_data['sku'])
+
+    pks_by_sku = dict(
+        Product.objects.filter(sku__in=skus).values_list('sku', 'pk')
+    ) if skus else {}
+
+    items = {}
+    for item_id, item_data in bag.items():
+        if not isinstance(item_data, dict):
+            continue
+        if item_id.isdigit():
+            product_id = int(item_id)
+        else:
+            product_id = pks_by_sku.get(item_data.get('sku'))
+            if product_id is None:
+                continue
+        new_id = get_item_id(product_id, item_data.get('attachments', []))
+        items[new_id] = items.get(new_id, 0) + item_data.get('quantity', 0)
+    return items
+
+
+def get_session_bag(session):
+    """
+    Return the session bag's items as {item_id: quantity}, upgrading a
+    bag stored in an older layout in place.
+    """
+    bag = session.get('bag')
+    if not bag:
+        return {}
+    if bag.get('v') == BAG_SCHEMA:
+        return bag['items']
+    items = upgrade_legacy_bag(bag)
+    save_session_bag(session, items)
+    return items
+
+
+def save_session_bag(session, items):
+    """Store bag items in the session in the current layout"""
+    session['bag'] = {'v': BAG_SCHEMA, 'items': items}
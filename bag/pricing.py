@@ -0,0 +1,111 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from products.models import Product
+from products.attachments import attachment_catalogue
+
+CENT = Decimal('0.01')
+LOYALTY_POINT_VALUE = Decimal('0.1')
+
+
+def get_unit_price(product, attachments=()):
+    """Current price of one product with the given attachment SKUs"""
+    return product.price + attachment_catalogue.get_total_price(attachments)
+
+
+def calculate_delivery(total):
+    """
+    Return (delivery, free_delivery_delta) for an order subtotal.
+    Delivery is a percentage of the subtotal below the free delivery
+    threshold, rounded to the cent.
+    """
+    threshold = Decimal(str(settings.FREE_DELIVERY_THRESHOLD))
+    if total >= threshold:
+        return Decimal('0.00'), Decimal('0.00')
+    delivery = (
+        total * Decimal(str(settings.STANDARD_DELIVERY_PERCENTAGE)) / 100
+    ).quantize(CENT, rounding=ROUND_HALF_UP)
+    return delivery, threshold - total
+
+
+def calculate_loyalty_discount(loyalty_points_used):
+    """Discount given for redeeming a number of loyalty points"""
+    return Decimal(loyalty_points_used or 0) * LOYALTY_POINT_VALUE
+
+
+def calculate_loyalty_points_earned(grand_total):
+    """Loyalty points earned for an order's grand total"""
+    return int(grand_total // 10)
+
+
+def resolve_bag_products(bag):
+    """
+    Load the products for a bag keyed by SKU, as sent in Stripe
+    metadata, in one query and return them keyed by bag item id.
+    """
+    skus = {item_data.get('sku') for item_data in bag.values()}
+    products = {
+        product.sku: product
+        for product in Product.objects.filter(sku__in=skus)
+    }
+    return {
+        item_id: products[item_data.get('sku')]
+        for item_id, item_data in bag.items()
+        if item_data.get('sku') in products
+    }
+
+
+def price_bag(bag, products, loyalty_points_used=0):
+    """
+    Price a shopping bag. This is the single source of truth for bag,
+    checkout, Stripe and order totals.
+
+    `bag` maps item ids to session bag lines and `products` maps the
+    same item ids to their already-resolved products; lines without a
+    product are skipped. Prices always come from the catalogue, never
+    from the price stored in the session.
+    """
+    lines = []
+    total = Decimal('0.00')
+    product_count = 0
+
+    for item_id, item_data in bag.items():
+        product = products.get(item_id)
+        if product is None:
+            continue
+        quantity = item_data.get('quantity', 0)
+        attachments = item_data.get('attachments', [])
+        unit_price = get_unit_price(product, attachments)
+        line_total = unit_price * quantity
+        total += line_total
+        product_count += quantity
+        lines.append({
+            'item_id': item_id,
+            'product': product,
+            'quantity': quantity,
+            'attachments': attachments,
+            'unit_price': unit_price,
+            'line_total': line_total,
+        })
+
+    delivery, free_delivery_delta = calculate_delivery(total)
+    loyalty_discount = calculate_loyalty_discount(loyalty_points_used)
+    grand_total = max(total + delivery - loyalty_discount, Decimal('0.00'))
+
+    return {
+        'lines': lines,
+        'product_count': product_count,
+        'total': total,
+        'delivery': delivery,
+        'free_delivery_delta': free_delivery_delta,
+        'loyalty_points_used': loyalty_points_used or 0,
+        'loyalty_discount': loyalty_discount,
+        'grand_total': grand_total,
+        'loyalty_points_earned': calculate_loyalty_points_earned(grand_total),
+    }
+
+
+def get_stripe_amount(grand_total):
+    """Grand total in the smallest currency unit, as Stripe expects"""
+    return int(
+        (grand_total * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    )
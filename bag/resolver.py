@@ -0,0 +1,223 @@
+from decimal import Decimal
+from django.utils.functional import cached_property
+from products.attachments import attachment_catalogue
+from products.catalogue import get_price_version, get_products
+from products.models import Product
+from profiles.models import UserProfile
+from .encoding import expand_bag, get_session_bag
+from .pricing import price_bag
+
+# Bump when the snapshot layout changes so stored snapshots are rebuilt
+SNAPSHOT_SCHEMA = 3
+SNAPSHOT_TOTAL_KEYS = (
+    'total', 'delivery', 'free_delivery_delta', 'grand_total',
+    'loyalty_points_used', 'loyalty_discount',
+)
+
+
+def bump_bag_version(request):
+    """
+    Mark the session bag as changed so the computed snapshot is rebuilt
+    the next time it is read. Call this from every view that mutates
+    request.session['bag'].
+    """
+    request.session['bag_version'] = request.session.get('bag_version', 0) + 1
+    request.__dict__.pop('_bag_resolver', None)
+
+
+class BagResolver:
+    """
+    Resolve the session bag against the product catalogue.
+
+    Totals are kept in a versioned snapshot stored alongside
+    request.session['bag'] and only recomputed when the bag version,
+    the applied loyalty points or the catalogue price version change.
+    Products are only looked up when the bag lines themselves are read,
+    and everything is memoized for the rest of the request.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.session = request.session
+        self.bag = expand_bag(get_session_bag(request.session))
+
+    @cached_property
+    def products(self):
+        """
+        Load every product referenced by the bag from the catalogue
+        cache, or in a single query, and return them keyed by primary key.
+        """
+        product_ids = {line['product_id'] for line in self.bag.values()}
+        if not product_ids:
+            return {}
+        return {
+            str(pk): product for pk, product in
+            get_products(product_ids).items()
+        }
+
+    def get_product(self, line):
+        """Return the resolved product for a bag line, or None"""
+        return self.products.get(str(line['product_id']))
+
+    @cached_property
+    def lines(self):
+        """
+        Bag lines keyed by item id with the SKU, quantity and attachment
+        SKUs needed to create an order. Lines whose product no longer
+        exists are left out.
+        """
+        lines = {}
+        for item_id, line in self.bag.items():
+            product = self.get_product(line)
+            if product is None:
+                continue
+            lines[item_id] = {
+                'quantity': line['quantity'],
+                'sku': product.sku,
+                'attachments': line['attachments'],
+            }
+        return lines
+
+    @cached_property
+    def pricing(self):
+        """
+        The bag priced, as price_bag returns it, from product rows read
+        from the database rather than the catalogue cache. Checkout and
+        Stripe amounts use this, so what is charged never depends on a
+        cached price. Read it after setting the session's loyalty points.
+        """
+        products = Product.objects.in_bulk(
+            {line['product_id'] for line in self.bag.values()}
+        )
+        return price_bag(
+            self.bag,
+            {
+                item_id: products[line['product_id']]
+                for item_id, line in self.bag.items()
+                if line['product_id'] in products
+            },
+            self.session.get('loyalty_points', 0),
+        )
+
+    @cached_property
+    def user_loyalty_points(self):
+        """Loyalty points available to the current user"""
+        if not self.request.user.is_authenticated:
+            return 0
+        try:
+            user_profile = UserProfile.objects.get(user=self.request.user)
+            return user_profile.loyalty_points
+        except UserProfile.DoesNotExist:
+            return 0
+
+    def _snapshot_is_current(self, snapshot):
+        return (
+            isinstance(snapshot, dict)
+            and snapshot.get('schema') == SNAPSHOT_SCHEMA
+            and snapshot.get('version') == self.session.get('bag_version', 0)
+            and snapshot.get('loyalty_points') ==
+            self.session.get('loyalty_points')
+            and snapshot.get('price_version') == get_price_version()
+        )
+
+    def _build_snapshot(self):
+        """Price the bag and record what the result was computed from"""
+        products = {}
+        for item_id, line in self.bag.items():
+            product = self.get_product(line)
+            if product is not None:
+                products[item_id] = product
+
+        pricing = price_bag(
+            self.bag, products, self.session.get('loyalty_points', 0)
+        )
+
+        lines = [
+            {
+                'item_id': line['item_id'],
+                'product_id': line['product'].pk,
+                'quantity': line['quantity'],
+                # Convert attachment SKUs to human-readable names
+                'attachments': attachment_catalogue.get_names(
+                    line['attachments']
+                ),
+                'price': str(line['unit_price']),
+                'line_total': str(line['line_total']),
+            }
+            for line in pricing['lines']
+        ]
+
+        snapshot = {
+            'schema': SNAPSHOT_SCHEMA,
+            'version': self.session.get('bag_version', 0),
+            'loyalty_points': self.session.get('loyalty_points'),
+            'price_version': get_price_version(),
+            'lines': lines,
+            'product_count': pricing['product_count'],
+            'loyalty_points_earned': pricing['loyalty_points_earned'],
+        }
+        for key in SNAPSHOT_TOTAL_KEYS:
+            snapshot[key] = str(pricing[key])
+        return snapshot
+
+    @cached_property
+    def snapshot(self):
+        """
+        Return the computed bag, rebuilding and storing it in the
+        session only when the stored snapshot is stale.
+        """
+        if not self.bag:
+            return None
+        snapshot = self.session.get('bag_snapshot')
+        if not self._snapshot_is_current(snapshot):
+            snapshot = self._build_snapshot()
+            self.session['bag_snapshot'] = snapshot
+        return snapshot
+
+    @cached_property
+    def contents(self):
+        """Bag totals, read from the snapshot without touching products"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            contents = {key: Decimal(0) for key in SNAPSHOT_TOTAL_KEYS}
+            contents['product_count'] = 0
+            contents['loyalty_points_earned'] = 0
+            return contents
+
+        contents = {
+            key: Decimal(snapshot[key]) for key in SNAPSHOT_TOTAL_KEYS
+        }
+        contents['product_count'] = snapshot['product_count']
+        contents['loyalty_points_earned'] = snapshot['loyalty_points_earned']
+        return contents
+
+    @cached_property
+    def bag_items(self):
+        """Bag lines with their products attached for rendering"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return []
+
+        bag_items = []
+        for line in snapshot['lines']:
+            product = self.products.get(str(line['product_id']))
+            if product is None:
+                continue
+            bag_items.append({
+                'item_id': line['item_id'],
+                'quantity': line['quantity'],
+                'product': product,
+                'attachments': line['attachments'],
+                'price': Decimal(line['price']),
+                'line_total': Decimal(line['line_total']),
+            })
+        return bag_items
+
+
+def get_bag_resolver(request):
+    """Return the bag resolver for this request, creating it on first use"""
+    resolver = getattr(request, '_bag_resolver', None)
+    if resolver is None:
+        resolver = BagResolver(request)
+        request._bag_resolver = resolver
+    return resolver
@@ -0,0 +1,319 @@
+from decimal import Decimal
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
+from products.catalogue import VersionTokens
+from products.models import Category, Product
+from utils.sessions import SessionStore
+from .contexts import bag_contents
+from .encoding import (
+    BAG_SCHEMA, expand_bag, get_item_id, get_session_bag, parse_item_id,
+    save_session_bag,
+)
+from .pricing import (
+    calculate_delivery, get_stripe_amount, price_bag, resolve_bag_products,
+)
+from .resolver import BagResolver, bump_bag_version
+
+
+def make_request(items=None):
+    """A GET request with a session holding the given bag items"""
+    request = RequestFactory().get('/')
+    request.user = AnonymousUser()
+    request.session = SessionStore()
+    if items is not None:
+        save_session_bag(request.session, items)
+    return request
+
+
+def count_product_queries(queries):
+    return sum('"products_product"' in query['sql'] for query in queries)
+
+
+class BagTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='drones')
+        cls.products = [
+            Product.objects.create(
+                category=cls.category,
+                sku=f'drone-{number}',
+                name=f'Drone {number}',
+                description='A drone',
+                price=Decimal('50.00') * number,
+            )
+            for number in range(1, 4)
+        ]
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        # Forget version tokens read in earlier, rolled back, tests
+        patcher = mock.patch('products.catalogue._versions', VersionTokens())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class BagContentsTests(BagTestCase):
+
+    def test_context_is_lazy(self):
+        request = make_request({
+            get_item_id(product.pk): 1 for product in self.products
+        })
+        with self.assertNumQueries(0):
+            bag_contents(request)
+
+    def test_bag_items_load_products_in_one_query(self):
+        request = make_request({
+            get_item_id(product.pk): 2 for product in self.products
+        })
+        context = bag_contents(request)
+        with CaptureQueriesContext(connection) as queries:
+            bag_items = context['bag_items']()
+            grand_total = context['grand_total']()
+
+        self.assertEqual(count_product_queries(queries.captured_queries), 1)
+        self.assertEqual(
+            [item['product'] for item in bag_items], self.products
+        )
+        # 2 x (50 + 100 + 150), with free delivery
+        self.assertEqual(grand_total, Decimal('600.00'))
+
+    def test_lines_for_missing_products_are_skipped(self):
+        request = make_request({
+            get_item_id(self.products[0].pk): 1,
+            get_item_id(999999): 3,
+        })
+        context = bag_contents(request)
+
+        self.assertEqual(
+            [item['product'] for item in context['bag_items']()],
+            [self.products[0]],
+        )
+        self.assertEqual(context['product_count'](), 1)
+        self.assertEqual(context['total'](), Decimal('50.00'))
+
+    def test_empty_bag(self):
+        context = bag_contents(make_request())
+
+        self.assertEqual(context['bag_items'](), [])
+        self.assertEqual(context['grand_total'](), Decimal(0))
+
+
+class BagSnapshotTests(BagTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.request = make_request({get_item_id(self.products[0].pk): 2})
+        self.snapshot = BagResolver(self.request).snapshot
+
+    def test_snapshot_is_reused_without_product_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            snapshot = BagResolver(self.request).snapshot
+
+        self.assertIs(snapshot, self.snapshot)
+        self.assertEqual(count_product_queries(queries.captured_queries), 0)
+
+    def test_snapshot_is_reused_by_another_process(self):
+        # A process with no version tokens read yet gets the same
+        # tokens from the database and keeps the stored snapshot
+        with mock.patch('products.catalogue._versions', VersionTokens()):
+            snapshot = BagResolver(self.request).snapshot
+
+        self.assertIs(snapshot, self.snapshot)
+
+    def test_price_change_rebuilds_snapshot(self):
+        product = Product.objects.get(pk=self.products[0].pk)
+        product.price = Decimal('80.00')
+        product.save()
+
+        with mock.patch('products.catalogue._versions', VersionTokens()):
+            contents = BagResolver(self.request).contents
+
+        self.assertEqual(contents['total'], Decimal('160.00'))
+
+    def test_bag_change_rebuilds_snapshot(self):
+        save_session_bag(self.request.session, {
+            get_item_id(self.products[0].pk): 2,
+            get_item_id(self.products[1].pk): 1,
+        })
+        bump_bag_version(self.request)
+        contents = BagResolver(self.request).contents
+
+        self.assertEqual(contents['total'], Decimal('200.00'))
+        self.assertEqual(contents['product_count'], 3)
+
+    def test_loyalty_points_rebuild_snapshot(self):
+        self.request.session['loyalty_points'] = 50
+        contents = BagResolver(self.request).contents
+
+        self.assertEqual(contents['loyalty_discount'], Decimal('5.0'))
+        # 100 + 10 delivery - 5 discount
+        self.assertEqual(contents['grand_total'], Decimal('105.00'))
+
+
+class PricingTests(BagTestCase):
+
+    def bag(self, *lines):
+        return {
+            get_item_id(product.pk): {
+                'quantity': quantity,
+                'sku': product.sku,
+                'attachments': attachments,
+            }
+            for product, quantity, attachments in lines
+        }
+
+    def test_delivery_is_free_from_the_threshold(self):
+        self.assertEqual(
+            calculate_delivery(Decimal('199.99')),
+            (Decimal('20.00'), Decimal('0.01')),
+        )
+        self.assertEqual(
+            calculate_delivery(Decimal('200.00')),
+            (Decimal('0.00'), Decimal('0.00')),
+        )
+        # Half a cent rounds up
+        self.assertEqual(
+            calculate_delivery(Decimal('0.05'))[0], Decimal('0.01')
+        )
+
+    def test_lines_include_attachments(self):
+        bag = self.bag(
+            (self.products[0], 2, ['att-camera', 'att-carry-case']),
+            (self.products[1], 1, []),
+        )
+        pricing = price_bag(bag, resolve_bag_products(bag))
+
+        self.assertEqual(
+            [line['unit_price'] for line in pricing['lines']],
+            # 50 + 299 + 49, and 100
+            [Decimal('398.00'), Decimal('100.00')],
+        )
+        self.assertEqual(pricing['total'], Decimal('896.00'))
+        self.assertEqual(pricing['product_count'], 3)
+        self.assertEqual(pricing['grand_total'], Decimal('896.00'))
+        self.assertEqual(pricing['loyalty_points_earned'], 89)
+
+    def test_session_prices_are_ignored(self):
+        bag = self.bag((self.products[0], 1, []))
+        bag[get_item_id(self.products[0].pk)]['price'] = '0.01'
+        pricing = price_bag(bag, resolve_bag_products(bag))
+
+        self.assertEqual(pricing['total'], Decimal('50.00'))
+
+    def test_discount_never_takes_the_total_below_zero(self):
+        bag = self.bag((self.products[0], 1, []))
+        pricing = price_bag(bag, resolve_bag_products(bag), 10000)
+
+        self.assertEqual(pricing['loyalty_discount'], Decimal('1000.0'))
+        self.assertEqual(pricing['grand_total'], Decimal('0.00'))
+        self.assertEqual(pricing['loyalty_points_earned'], 0)
+
+    def test_lines_for_unknown_skus_are_skipped(self):
+        bag = self.bag((self.products[0], 1, []))
+        bag['999'] = {'quantity': 1, 'sku': 'retired-drone'}
+        pricing = price_bag(bag, resolve_bag_products(bag))
+
+        self.assertEqual(len(pricing['lines']), 1)
+        self.assertEqual(pricing['total'], Decimal('50.00'))
+
+    def test_stripe_amounts_are_rounded_cents(self):
+        self.assertEqual(get_stripe_amount(Decimal('12.345')), 1235)
+        self.assertEqual(get_stripe_amount(Decimal('0.00')), 0)
+
+    def test_orders_are_stored_at_the_bag_price(self):
+        from checkout.models import Order
+
+        bag = self.bag(
+            (self.products[0], 1, ['att-extra-battery']),
+            (self.products[2], 3, []),
+        )
+        pricing = price_bag(bag, resolve_bag_products(bag), 40)
+        order = Order.objects.create(
+            full_name='Ada Pilot', email='ada@example.com',
+            phone_number='0123456789', country='IE',
+            town_or_city='Dublin', street_address1='1 Runway Road',
+            loyalty_points_used=40,
+        )
+        order.create_line_items(bag)
+        order.refresh_from_db()
+
+        self.assertEqual(order.order_total, pricing['total'])
+        self.assertEqual(order.delivery_cost, pricing['delivery'])
+        self.assertEqual(order.grand_total, pricing['grand_total'])
+        self.assertEqual(
+            order.loyalty_points, pricing['loyalty_points_earned']
+        )
+
+
+class BagEncodingTests(BagTestCase):
+
+    def test_item_ids_ignore_attachment_order_and_unknown_skus(self):
+        product = self.products[0]
+        item_id = get_item_id(
+            product.pk, ['att-vr-goggles', 'att-camera', 'att-unknown']
+        )
+
+        self.assertEqual(
+            item_id, get_item_id(product.pk, ['att-camera', 'att-vr-goggles'])
+        )
+        self.assertTrue(item_id.startswith(f'{product.pk}-1-'))
+        self.assertEqual(get_item_id(product.pk), str(product.pk))
+
+    def test_item_ids_round_trip(self):
+        item_id = get_item_id(7, ['att-vr-goggles', 'att-camera'])
+
+        self.assertEqual(
+            parse_item_id(item_id), (7, ['att-camera', 'att-vr-goggles'])
+        )
+
+    def test_malformed_item_ids_are_skipped(self):
+        lines = expand_bag({'3': 2, 'drone': 1, '4-x': 1})
+
+        self.assertEqual(
+            lines,
+            {'3': {'product_id': 3, 'quantity': 2, 'attachments': []}},
+        )
+
+    def test_session_bag_is_stored_compactly(self):
+        request = make_request({'3-1': 2})
+
+        self.assertEqual(
+            request.session['bag'], {'v': BAG_SCHEMA, 'items': {'3-1': 2}}
+        )
+        self.assertEqual(get_session_bag(request.session), {'3-1': 2})
+        self.assertEqual(get_session_bag(make_request().session), {})
+
+    def test_legacy_bag_is_upgraded_once(self):
+        first, second, _ = self.products
+        request = make_request()
+        request.session['bag'] = {
+            str(first.pk): {
+                'quantity': 2, 'price': '50.00', 'name': first.name,
+            },
+            'drone-2_red': {
+                'sku': 'drone-2', 'quantity': 1,
+                'attachments': ['att-camera'],
+            },
+            'drone-2_blue': {
+                'sku': 'drone-2', 'quantity': 2,
+                'attachments': ['att-camera'],
+            },
+            'retired_red': {'sku': 'retired', 'quantity': 1},
+            'stray': 3,
+        }
+
+        items = get_session_bag(request.session)
+
+        camera_item = get_item_id(second.pk, ['att-camera'])
+        self.assertEqual(items, {str(first.pk): 2, camera_item: 3})
+        self.assertEqual(
+            request.session['bag'], {'v': BAG_SCHEMA, 'items': items}
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(get_session_bag(request.session), items)
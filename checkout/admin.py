@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderLineItem
+from .models import Order, OrderLineItem, WebhookEvent
 
 
 class OrderLineItemAdminInline(admin.TabularInline):
@@ -25,7 +25,8 @@ class OrderAdmin(admin.ModelAdmin):
     readonly_fields = ('order_number', 'date',
                        'delivery_cost', 'order_total',
                        'grand_total', 'loyalty_points_used',
-                       'loyalty_points_earned', 'original_bag', 'stripe_pid')
+                       'loyalty_points_earned', 'original_bag', 'stripe_pid',
+                       'loyalty_points_applied', 'confirmation_email_sent')
 
     fields = ('order_number', 'user_profile', 'date', 'full_name',
               'email', 'phone_number', 'country',
@@ -33,7 +34,8 @@ class OrderAdmin(admin.ModelAdmin):
               'street_address2', 'county', 'delivery_cost',
               'order_total', 'grand_total',
               'loyalty_points_used', 'loyalty_points_earned',
-              'original_bag', 'stripe_pid')
+              'original_bag', 'stripe_pid',
+              'loyalty_points_applied', 'confirmation_email_sent')
 
     list_display = ('order_number', 'date', 'full_name',
                     'order_total', 'delivery_cost', 'grand_total',
@@ -48,3 +50,16 @@ class OrderAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Order, OrderAdmin)
+
+
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('stripe_event_id', 'event_type', 'status',
+                    'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'event_type')
+    search_fields = ('stripe_event_id',)
+    readonly_fields = ('stripe_event_id', 'event_type', 'payload',
+                       'received_at', 'processed_at', 'last_error')
+    ordering = ('-received_at',)
+
+
+admin.site.register(WebhookEvent, WebhookEventAdmin)
@@ -0,0 +1,89 @@
+import hashlib
+from django.conf import settings
+from products.attachments import attachment_catalogue
+from notifications.outbox import queue_mail
+from notifications.rendering import build_context, render_email
+
+CONFIRMATION_TEMPLATES = {
+    'html_template': (
+        'checkout/confirmation_emails/confirmation_email_body.html'
+    ),
+    'text_template': (
+        'checkout/confirmation_emails/confirmation_email_body.txt'
+    ),
+    'subject_template': (
+        'checkout/confirmation_emails/confirmation_email_subject.txt'
+    ),
+}
+
+
+def get_attachment_details(attachment_skus):
+    """Friendly names and prices for a list of attachment SKUs"""
+    attachment_details = []
+    for sku in attachment_skus:
+        attachment = attachment_catalogue.get(sku)
+        if attachment:
+            attachment_details.append(
+                f"{attachment['name']} (${attachment['price']})"
+            )
+    return ", ".join(attachment_details)
+
+
+def get_order_fingerprint(order):
+    """Fingerprint of every field of an order, for caching its e-mails"""
+    values = '|'.join(
+        str(getattr(order, field.attname))
+        for field in order._meta.concrete_fields
+    )
+    return hashlib.sha256(values.encode()).hexdigest()
+
+
+def build_confirmation_context(order):
+    """Context for an order's confirmation e-mail"""
+    lineitems = order.lineitems.select_related('product')
+    return build_context(
+        order=order,
+        contact_email=settings.DEFAULT_FROM_EMAIL,
+        loyalty_points_earned=order.loyalty_points,
+        loyalty_points_used=order.loyalty_points_used,
+        discount_applied=f"${order.discount_applied:.2f}",
+        unsubscribe_url=(
+            f"{settings.SITE_URL}/profiles/unsubscribe/{order.email}/"
+        ),
+        lineitems=[
+            {
+                'product_name': item.product.name,
+                'quantity': item.quantity,
+                'attachments': get_attachment_details(
+                    item.attachments.split(',')
+                ) if item.attachments else '',
+                'lineitem_total': item.lineitem_total,
+            }
+            for item in lineitems
+        ],
+    )
+
+
+def render_confirmation_email(order):
+    """
+    Render an order's confirmation e-mail. The result is cached until
+    the order or the templates change, so resending it is cheap.
+    """
+    return render_email(
+        context=lambda: build_confirmation_context(order),
+        cache_key=(
+            f'order-confirmation:{order.pk}:{get_order_fingerprint(order)}'
+        ),
+        **CONFIRMATION_TEMPLATES,
+    )
+
+
+def queue_confirmation_email(order):
+    """Queue an order's confirmation e-mail for sending"""
+    email = render_confirmation_email(order)
+    return queue_mail(
+        email.subject,
+        email.body,
+        [order.email],
+        html_message=email.html_body,
+    )
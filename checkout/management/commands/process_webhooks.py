@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from checkout.webhook_inbox import process_due_events
+
+
+class Command(BaseCommand):
+    help = (
+        'Process Stripe webhook events queued by the webhook endpoint, '
+        'retrying failures with exponential backoff'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the events that are currently due, then exit',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=20,
+            help='Number of events claimed per batch',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help='Seconds to wait when no events are due',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed, failed = process_due_events(options['batch_size'])
+            if processed or failed:
+                self.stdout.write(
+                    f'Processed {processed} events, {failed} failed.'
+                )
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
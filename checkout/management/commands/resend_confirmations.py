@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from checkout.emails import queue_confirmation_email
+from checkout.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Queue the confirmation e-mails of orders to be sent again'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'order_numbers', nargs='*',
+            help='Order numbers to resend confirmations for',
+        )
+        parser.add_argument(
+            '--since',
+            help='Resend confirmations for orders placed on or after '
+                 'this date (YYYY-MM-DD)',
+        )
+
+    def handle(self, *args, **options):
+        if not options['order_numbers'] and not options['since']:
+            raise CommandError('Give order numbers or --since.')
+
+        orders = Order.objects.order_by('date')
+        if options['order_numbers']:
+            orders = orders.filter(order_number__in=options['order_numbers'])
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('--since must be a YYYY-MM-DD date.')
+            orders = orders.filter(date__date__gte=since)
+
+        queued = 0
+        for order in orders.iterator():
+            queue_confirmation_email(order)
+            queued += 1
+        self.stdout.write(f'Queued {queued} confirmation e-mails.')
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def mark_existing_orders_processed(apps, schema_editor):
+    # Orders placed before the flags existed have already been handled
+    Order = apps.get_model('checkout', 'Order')
+    Order.objects.update(
+        loyalty_points_applied=True, confirmation_email_sent=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0005_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='confirmation_email_sent',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='loyalty_points_applied',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ProcessedStripeEvent',
+            fields=[
+                ('event_id', models.CharField(max_length=254, primary_key=True, serialize=False)),
+                ('event_type', models.CharField(max_length=100)),
+                ('processed_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stripe_events', to='checkout.order')),
+            ],
+        ),
+        migrations.RunPython(
+            mark_existing_orders_processed, migrations.RunPython.noop
+        ),
+    ]
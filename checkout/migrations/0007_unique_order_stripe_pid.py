@@ -0,0 +1,53 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:46
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def clean_stripe_pids(apps, schema_editor):
+    """
+    Prepare stripe_pid for its unique constraint: blank values become
+    NULL, and where a payment produced duplicate orders every order but
+    the first gets a suffixed pid so it is kept for review. Each renamed
+    order is logged so it can be checked by hand.
+    """
+    Order = apps.get_model('checkout', 'Order')
+    Order.objects.filter(stripe_pid='').update(stripe_pid=None)
+
+    seen = set()
+    orders = Order.objects.exclude(stripe_pid=None).order_by('date', 'pk')
+    for order in orders.only('pk', 'order_number', 'stripe_pid'):
+        if order.stripe_pid in seen:
+            new_pid = f'{order.stripe_pid}-duplicate-{order.pk}'
+            Order.objects.filter(pk=order.pk).update(stripe_pid=new_pid)
+            logger.warning(
+                'Order %s shared stripe_pid %s with an earlier order and '
+                'was renamed to %s. Check it for a double charge.',
+                order.order_number, order.stripe_pid, new_pid,
+            )
+        else:
+            seen.add(order.stripe_pid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0006_processed_stripe_events'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='stripe_pid',
+            field=models.CharField(blank=True, max_length=254, null=True),
+        ),
+        migrations.RunPython(clean_stripe_pids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='stripe_pid',
+            field=models.CharField(blank=True, max_length=254, null=True, unique=True),
+        ),
+    ]
@@ -1,12 +1,17 @@
 import uuid
 from django.db import models
 from django.db.models import Sum
-from django.conf import settings
+from django.utils import timezone
 from decimal import Decimal
 from django_countries.fields import CountryField
 from products.models import Product
 from profiles.models import UserProfile
-from products.constants import ATTACHMENTS
+from products.attachments import attachment_catalogue
+from bag.pricing import (
+    calculate_delivery,
+    calculate_loyalty_discount,
+    calculate_loyalty_points_earned,
+)
 
 
 class Order(models.Model):
@@ -39,12 +44,15 @@ class Order(models.Model):
     )
     original_bag = models.TextField(null=False, blank=False, default='')
     stripe_pid = models.CharField(
-        max_length=254, null=False, blank=False, default=''
+        max_length=254, null=True, blank=True, unique=True
     )
     loyalty_points = models.IntegerField(null=False, blank=False, default=0)
     loyalty_points_used = models.IntegerField(
         null=False, blank=False, default=0
     )
+    # Processing state, so webhook retries never repeat side effects
+    loyalty_points_applied = models.BooleanField(default=False)
+    confirmation_email_sent = models.BooleanField(default=False)
 
     def _generate_order_number(self):
         """
@@ -54,7 +62,7 @@ class Order(models.Model):
 
     def loyalty_points_earned(self):
         """Calculate loyalty points based on the grand total."""
-        return int(self.grand_total // 10)
+        return calculate_loyalty_points_earned(self.grand_total)
 
     loyalty_points_earned.short_description = 'Loyalty Points Earned'
 
@@ -66,32 +74,63 @@ class Order(models.Model):
         # Reset totals before recalculating
         self.order_total = self.lineitems.aggregate(
             Sum('lineitem_total')
-        )['lineitem_total__sum'] or 0
-        self.delivery_cost = 0
+        )['lineitem_total__sum'] or Decimal('0.00')
 
         # Recalculate delivery costs
-        if self.order_total < settings.FREE_DELIVERY_THRESHOLD:
-            self.delivery_cost = (
-                self.order_total * settings.STANDARD_DELIVERY_PERCENTAGE / 100
-            )
-
-        # Calculate grand total before applying loyalty points
-        self.grand_total = self.order_total + self.delivery_cost
+        self.delivery_cost, _ = calculate_delivery(self.order_total)
 
-        # Deduct loyalty points discount
-        discount = Decimal(loyalty_points_used) * Decimal('0.1')
+        # Calculate grand total, deducting the loyalty points discount
+        discount = calculate_loyalty_discount(loyalty_points_used)
         self.discount_applied = discount
         self.grand_total = max(
-            self.grand_total - discount, Decimal('0.00')
+            self.order_total + self.delivery_cost - discount,
+            Decimal('0.00')
         )
 
         # Update loyalty points earned
-        self.loyalty_points = int(self.grand_total // 10)
+        self.loyalty_points = calculate_loyalty_points_earned(
+            self.grand_total
+        )
 
         # Save applied loyalty points for future reference
         self.loyalty_points_used = loyalty_points_used
         self.save()
 
+    def create_line_items(self, bag):
+        """
+        Create this order's line items from a shopping bag and update the
+        order total once they are all in place.
+
+        The bag's products are fetched in one query and the line items
+        are inserted with a single bulk_create, which skips the per-item
+        save() and post_save total recalculation. Raises
+        Product.DoesNotExist if a bag SKU is no longer in the catalogue.
+        """
+        skus = {item_data['sku'] for item_data in bag.values()}
+        products = {
+            product.sku: product
+            for product in Product.objects.filter(sku__in=skus)
+        }
+
+        line_items = []
+        for item_data in bag.values():
+            product = products.get(item_data['sku'])
+            if product is None:
+                raise Product.DoesNotExist(
+                    f"No product with SKU {item_data['sku']}"
+                )
+            line_item = OrderLineItem(
+                order=self,
+                product=product,
+                quantity=item_data.get('quantity', 0),
+                attachments=','.join(item_data.get('attachments', [])),
+            )
+            line_item.lineitem_total = line_item.calculate_lineitem_total()
+            line_items.append(line_item)
+
+        OrderLineItem.objects.bulk_create(line_items)
+        self.update_total(loyalty_points_used=self.loyalty_points_used)
+
     def save(self, *args, **kwargs):
         """
         Override the original save method to set the order number
@@ -125,44 +164,95 @@ class OrderLineItem(models.Model):
         Calculate the total price of the attachments.
         The 'attachments' field contains a list of attachment SKUs.
         """
-        total_attachment_price = Decimal(0)
-        if self.attachments:
-            attachment_skus = self.attachments.split(',')
-            for attachment_sku in attachment_skus:
-                for attachment in ATTACHMENTS:
-                    if attachment['sku'] == attachment_sku:
-                        total_attachment_price += Decimal(
-                            attachment['price']
-                        )
-        return total_attachment_price
+        if not self.attachments:
+            return Decimal(0)
+        return attachment_catalogue.get_total_price(
+            self.attachments.split(',')
+        )
 
-    def save(self, *args, **kwargs):
+    def calculate_lineitem_total(self):
         """
-        Override the original save method to set the lineitem total
-        and update the order total.
+        Calculate the total for this line, including attachments.
         """
-        self.lineitem_total = self.product.price * self.quantity
-
-        attachment_total = self.get_attachment_price()
-        self.lineitem_total += attachment_total * self.quantity
+        unit_price = self.product.price + self.get_attachment_price()
+        return unit_price * self.quantity
 
+    def save(self, *args, **kwargs):
+        """
+        Override the original save method to set the lineitem total.
+        The order total is updated by the post_save signal.
+        """
+        self.lineitem_total = self.calculate_lineitem_total()
         super().save(*args, **kwargs)
-        self.order.update_total(
-            loyalty_points_used=self.order.loyalty_points_used
-        )
 
     def get_readable_attachments(self):
         """
         Return a human-readable list of attachment names.
         """
-        attachment_names = []
-        if self.attachments:
-            attachment_skus = self.attachments.split(',')
-            for sku in attachment_skus:
-                for attachment in ATTACHMENTS:
-                    if attachment['sku'] == sku:
-                        attachment_names.append(attachment['name'])
-        return ', '.join(attachment_names)
+        if not self.attachments:
+            return ''
+        attachments = (
+            attachment_catalogue.get(sku)
+            for sku in self.attachments.split(',')
+        )
+        return ', '.join(
+            attachment['name'] for attachment in attachments if attachment
+        )
 
     def __str__(self):
         return f'SKU {self.product.sku} on order {self.order.order_number}'
+
+
+class WebhookEvent(models.Model):
+    """
+    A Stripe webhook event received by the endpoint and waiting to be
+    handled by the process_webhooks worker.
+    """
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSED, 'Processed'),
+        (FAILED, 'Failed'),
+    ]
+
+    stripe_event_id = models.CharField(max_length=254, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.TextField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['status', 'next_attempt_at'],
+                name='webhookevent_due_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.event_type} ({self.stripe_event_id})'
+
+
+class ProcessedStripeEvent(models.Model):
+    """
+    Ledger of Stripe events that have been fully handled. Redelivered
+    events are recognised with a single primary key lookup.
+    """
+    event_id = models.CharField(max_length=254, primary_key=True)
+    event_type = models.CharField(max_length=100)
+    order = models.ForeignKey(
+        Order, null=True, blank=True,
+        on_delete=models.SET_NULL, related_name='stripe_events'
+    )
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.event_type} ({self.event_id})'
@@ -0,0 +1,38 @@
+from django.db import IntegrityError, transaction
+from .models import Order
+
+
+def upsert_order(stripe_pid, defaults, bag, update=None):
+    """
+    Return (order, created) for a PaymentIntent, creating the order with
+    `defaults` and line items from `bag` if it doesn't exist yet, or
+    applying `update` to the one that does.
+
+    The checkout view and the Stripe webhook both call this. The order
+    row is locked while it is updated, and stripe_pid is unique, so when
+    both race to create the same order one insert fails and that caller
+    falls back to updating the winner's row. Either way there is exactly
+    one order with one set of line items. Raises Product.DoesNotExist,
+    with nothing saved, if the bag references a missing product.
+    """
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                order = Order.objects.select_for_update().filter(
+                    stripe_pid=stripe_pid
+                ).first()
+                if order is None:
+                    order = Order(stripe_pid=stripe_pid, **defaults)
+                    order.save()
+                    order.create_line_items(bag)
+                    return order, True
+
+                if update:
+                    for field, value in update.items():
+                        setattr(order, field, value)
+                    order.save(update_fields=list(update))
+                return order, False
+        except IntegrityError:
+            # Another request created the order first; lock and update it
+            if attempt:
+                raise
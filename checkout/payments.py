@@ -0,0 +1,108 @@
+import hashlib
+import json
+import stripe
+from django.conf import settings
+from .models import Order
+
+PAYMENT_INTENT_SESSION_KEY = 'checkout_payment_intent'
+# Stripe limits each metadata value to 500 characters
+METADATA_VALUE_LIMIT = 500
+
+
+def get_bag_hash(bag):
+    """Fingerprint of the bag's contents"""
+    return hashlib.sha256(
+        json.dumps(bag, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def get_bag_metadata(bag):
+    """
+    Condense the bag to the SKUs, quantities and attachments needed to
+    rebuild the order, dropping lines until it fits Stripe's metadata
+    limit.
+    """
+    condensed_bag = {}
+    for item_id, item_data in bag.items():
+        line = {
+            'quantity': item_data.get('quantity'),
+            'sku': item_data.get('sku', 'N/A'),
+        }
+        if item_data.get('attachments'):
+            line['attachments'] = item_data['attachments']
+        condensed_bag[item_id] = line
+
+    bag_metadata = json.dumps(condensed_bag)
+    while len(bag_metadata) > METADATA_VALUE_LIMIT and condensed_bag:
+        condensed_bag.pop(next(iter(condensed_bag)))
+        bag_metadata = json.dumps(condensed_bag)
+    return bag_metadata
+
+
+def is_intent_consumed(intent_id):
+    """
+    Whether an order has been placed with the PaymentIntent. The
+    payment_intent.succeeded webhook and checkout both record the
+    intent on the order, so this needs no call to Stripe.
+    """
+    return Order.objects.filter(stripe_pid=intent_id).exists()
+
+
+def get_checkout_client_secret(request, amount, metadata):
+    """
+    Return the client secret of the PaymentIntent for this session's
+    checkout.
+
+    The intent is cached in the session alongside the amount and bag it
+    was created for. Reloading the checkout page reuses it without
+    calling Stripe, unless an order has been placed with it. If the
+    bag or amount has changed, the intent is updated with a modify
+    call. A new intent is created when none is cached, or when the
+    cached one has been used or can no longer be modified.
+    """
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    bag_hash = get_bag_hash(request.session.get('bag', {}))
+    cached = request.session.get(PAYMENT_INTENT_SESSION_KEY)
+
+    intent = None
+    if cached and not is_intent_consumed(cached['id']):
+        if cached['amount'] == amount and cached['bag_hash'] == bag_hash:
+            return cached['client_secret']
+        try:
+            intent = stripe.PaymentIntent.modify(
+                cached['id'], amount=amount, metadata=metadata
+            )
+        except stripe.error.InvalidRequestError:
+            # Missing, paid, processing or cancelled; start a new one
+            intent = None
+
+    if intent is None:
+        intent = stripe.PaymentIntent.create(
+            amount=amount,
+            currency=settings.STRIPE_CURRENCY,
+            payment_method_types=['card'],
+            capture_method='automatic',
+            confirm=False,
+            metadata=metadata,
+        )
+
+    request.session[PAYMENT_INTENT_SESSION_KEY] = {
+        'id': intent.id,
+        'client_secret': intent.client_secret,
+        'amount': amount,
+        'bag_hash': bag_hash,
+    }
+    return intent.client_secret
+
+
+def update_cached_intent_amount(request, intent_id, amount):
+    """Record a new amount set directly on the session's cached intent"""
+    cached = request.session.get(PAYMENT_INTENT_SESSION_KEY)
+    if cached and cached['id'] == intent_id:
+        cached['amount'] = amount
+        request.session[PAYMENT_INTENT_SESSION_KEY] = cached
+
+
+def forget_payment_intent(request):
+    """Stop reusing the session's PaymentIntent once checkout completes"""
+    request.session.pop(PAYMENT_INTENT_SESSION_KEY, None)
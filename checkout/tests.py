@@ -0,0 +1,533 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+import stripe
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from bag.encoding import get_item_id, save_session_bag
+from products.catalogue import VersionTokens, get_product
+from products.models import Category, Product
+from products.tests import LOCAL_CACHES
+from utils.sessions import SessionStore
+from notifications.models import OutboundEmail
+from .emails import queue_confirmation_email, render_confirmation_email
+from .models import Order, ProcessedStripeEvent, WebhookEvent
+from .orders import upsert_order
+from .payments import (
+    PAYMENT_INTENT_SESSION_KEY, get_checkout_client_secret,
+)
+from .webhook_inbox import (
+    MAX_ATTEMPTS, dispatch_event, get_retry_delay, process_due_events,
+)
+
+ORDER_DETAILS = {
+    'full_name': 'Ada Pilot',
+    'email': 'ada@example.com',
+    'phone_number': '0123456789',
+    'country': 'IE',
+    'postcode': 'D01',
+    'town_or_city': 'Dublin',
+    'street_address1': '1 Runway Road',
+    'street_address2': '',
+    'county': '',
+}
+
+
+class CheckoutTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='drones')
+        cls.products = [
+            Product.objects.create(
+                category=category,
+                sku=f'drone-{number}',
+                name=f'Drone {number}',
+                description='A drone',
+                price=Decimal('25.00') * number,
+            )
+            for number in range(1, 11)
+        ]
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        patcher = mock.patch('products.catalogue._versions', VersionTokens())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fill_bag(self, session, products, quantity=1):
+        save_session_bag(session, {
+            get_item_id(product.pk): quantity for product in products
+        })
+
+    def make_bag(self, products, quantity=1, attachments=()):
+        return {
+            str(product.pk): {
+                'quantity': quantity,
+                'sku': product.sku,
+                'attachments': list(attachments),
+            }
+            for product in products
+        }
+
+
+class CreateLineItemsTests(CheckoutTestCase):
+
+    def count_queries(self, bag):
+        order = Order.objects.create(**ORDER_DETAILS)
+        with CaptureQueriesContext(connection) as queries:
+            order.create_line_items(bag)
+        return len(queries.captured_queries)
+
+    def test_query_count_does_not_grow_with_the_bag(self):
+        self.assertEqual(
+            self.count_queries(self.make_bag(self.products[:2])),
+            self.count_queries(self.make_bag(self.products)),
+        )
+
+    def test_lines_and_totals(self):
+        order = Order.objects.create(**ORDER_DETAILS)
+        order.create_line_items(self.make_bag(
+            self.products[:2], quantity=2, attachments=['att-carry-case'],
+        ))
+
+        order.refresh_from_db()
+        self.assertEqual(
+            sorted(order.lineitems.values_list('lineitem_total', flat=True)),
+            # 2 x (25 + 49) and 2 x (50 + 49)
+            [Decimal('148.00'), Decimal('198.00')],
+        )
+        self.assertEqual(order.order_total, Decimal('346.00'))
+        self.assertEqual(order.delivery_cost, Decimal('0.00'))
+        self.assertEqual(order.grand_total, Decimal('346.00'))
+        self.assertEqual(order.loyalty_points, 34)
+
+    def test_loyalty_discount_is_applied_to_the_total(self):
+        order = Order.objects.create(
+            **ORDER_DETAILS, loyalty_points_used=100
+        )
+        order.create_line_items(self.make_bag(self.products[:1]))
+
+        order.refresh_from_db()
+        # 25 + 2.50 delivery - 10 discount
+        self.assertEqual(order.grand_total, Decimal('17.50'))
+        self.assertEqual(order.discount_applied, Decimal('10.00'))
+
+    def test_missing_product_raises_before_any_line_is_saved(self):
+        order = Order.objects.create(**ORDER_DETAILS)
+        bag = self.make_bag(self.products[:2])
+        bag['999'] = {'quantity': 1, 'sku': 'retired-drone'}
+
+        with self.assertRaises(Product.DoesNotExist):
+            order.create_line_items(bag)
+        self.assertFalse(order.lineitems.exists())
+
+
+def make_intent(intent_id='pi_1', status='requires_payment_method'):
+    return mock.Mock(
+        id=intent_id, client_secret=f'{intent_id}_secret_x', status=status
+    )
+
+
+@mock.patch('stripe.PaymentIntent.create')
+@mock.patch('stripe.PaymentIntent.modify')
+class CheckoutClientSecretTests(CheckoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.request = RequestFactory().get('/')
+        self.request.user = AnonymousUser()
+        self.request.session = SessionStore()
+        self.fill_bag(self.request.session, self.products[:1])
+
+    def get_secret(self, amount=2750):
+        return get_checkout_client_secret(self.request, amount, metadata={})
+
+    def test_first_load_creates_an_intent(self, modify, create):
+        create.return_value = make_intent()
+
+        self.assertEqual(self.get_secret(), 'pi_1_secret_x')
+        self.assertEqual(
+            self.request.session[PAYMENT_INTENT_SESSION_KEY]['amount'], 2750
+        )
+
+    @mock.patch('stripe.PaymentIntent.retrieve')
+    def test_reloads_reuse_the_intent_without_calling_stripe(
+            self, retrieve, modify, create):
+        create.return_value = make_intent()
+        self.get_secret()
+
+        self.assertEqual(self.get_secret(), 'pi_1_secret_x')
+        create.assert_called_once()
+        modify.assert_not_called()
+        retrieve.assert_not_called()
+
+    def test_changed_amount_modifies_the_intent(self, modify, create):
+        create.return_value = make_intent()
+        self.get_secret()
+        modify.return_value = make_intent()
+
+        self.assertEqual(self.get_secret(amount=3000), 'pi_1_secret_x')
+        modify.assert_called_once_with('pi_1', amount=3000, metadata={})
+        create.assert_called_once()
+        self.assertEqual(
+            self.request.session[PAYMENT_INTENT_SESSION_KEY]['amount'], 3000
+        )
+
+    def test_intents_that_cant_be_modified_are_replaced(self, modify,
+                                                        create):
+        create.return_value = make_intent()
+        self.get_secret()
+        modify.side_effect = stripe.error.InvalidRequestError(
+            'This PaymentIntent has already succeeded', 'intent'
+        )
+        create.return_value = make_intent('pi_2')
+
+        self.assertEqual(self.get_secret(amount=3000), 'pi_2_secret_x')
+
+    def test_intents_with_an_order_are_replaced(self, modify, create):
+        create.return_value = make_intent()
+        self.get_secret()
+        Order.objects.create(stripe_pid='pi_1', **ORDER_DETAILS)
+        create.return_value = make_intent('pi_2')
+
+        self.assertEqual(self.get_secret(), 'pi_2_secret_x')
+        modify.assert_not_called()
+
+
+@mock.patch('stripe.PaymentIntent.modify')
+class CacheCheckoutDataTests(CheckoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('pilot', password='secret')
+        self.user.userprofile.loyalty_points = 100
+        self.user.userprofile.save()
+        self.client.force_login(self.user)
+        session = self.client.session
+        self.fill_bag(session, self.products[:1])
+        session.save()
+
+    def post(self, loyalty_points):
+        return self.client.post(reverse('cache_checkout_data'), {
+            'client_secret': 'pi_1_secret_x',
+            'loyalty_points': loyalty_points,
+        })
+
+    def test_points_are_applied_to_the_intent(self, modify):
+        response = self.post(50)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['loyalty_points'], 50)
+        # 25 + 2.50 delivery - 5 discount
+        self.assertEqual(modify.call_args.kwargs['amount'], 2250)
+
+    def test_used_intents_are_forgotten(self, modify):
+        session = self.client.session
+        session[PAYMENT_INTENT_SESSION_KEY] = {'id': 'pi_1'}
+        session.save()
+        modify.side_effect = stripe.error.InvalidRequestError(
+            'This PaymentIntent has already succeeded', 'intent'
+        )
+
+        self.assertEqual(self.post(0).status_code, 400)
+        self.assertNotIn(PAYMENT_INTENT_SESSION_KEY, self.client.session)
+
+    def test_invalid_points_are_rejected_before_pricing(self, modify):
+        for loyalty_points in (-10, 101):
+            response = self.post(loyalty_points)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('loyalty_points', self.client.session)
+        modify.assert_not_called()
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CheckoutPricingTests(CheckoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = self.products[0]
+        session = self.client.session
+        self.fill_bag(session, [self.product])
+        session.save()
+        # A price change the catalogue cache hasn't seen
+        get_product(self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(
+            price=Decimal('40.00')
+        )
+        self.assertEqual(get_product(self.product.pk).price, Decimal('25'))
+
+    @mock.patch('checkout.views.get_checkout_client_secret')
+    def test_intent_is_priced_from_the_database(self, get_client_secret):
+        get_client_secret.return_value = 'pi_1_secret_x'
+
+        response = self.client.get(reverse('checkout'))
+
+        # 40 + 4 delivery
+        self.assertEqual(get_client_secret.call_args.args[1], 4400)
+        self.assertEqual(response.context['grand_total'], Decimal('44.00'))
+        self.assertEqual(
+            response.context['bag_items'][0]['price'], Decimal('40.00')
+        )
+
+    @mock.patch('stripe.PaymentIntent.modify')
+    def test_cached_checkout_data_is_priced_from_the_database(self, modify):
+        self.client.post(reverse('cache_checkout_data'), {
+            'client_secret': 'pi_1_secret_x', 'loyalty_points': 0,
+        })
+
+        self.assertEqual(modify.call_args.kwargs['amount'], 4400)
+
+    def test_order_is_stored_at_the_database_price(self):
+        self.client.post(reverse('checkout'), {
+            **ORDER_DETAILS, 'client_secret': 'pi_1_secret_x',
+        })
+
+        order = Order.objects.get()
+        self.assertEqual(order.grand_total, Decimal('44.00'))
+        self.assertEqual(
+            json.loads(order.original_bag)[str(self.product.pk)]['price'],
+            '40.00',
+        )
+
+
+def make_event_payload(event_id='evt_1',
+                       event_type='payment_intent.payment_failed',
+                       intent=None):
+    intent = intent or {'id': 'pi_1', 'object': 'payment_intent'}
+    return json.dumps({
+        'id': event_id,
+        'object': 'event',
+        'type': event_type,
+        'data': {'object': intent},
+    })
+
+
+def make_event(**kwargs):
+    return stripe.Event.construct_from(
+        json.loads(make_event_payload(**kwargs)), 'sk_test'
+    )
+
+
+class WebhookEndpointTests(TestCase):
+
+    def post(self):
+        return self.client.post(
+            reverse('webhook'), make_event_payload(),
+            content_type='application/json', HTTP_STRIPE_SIGNATURE='t=1,v1=x',
+        )
+
+    @mock.patch('stripe.Webhook.construct_event')
+    def test_verified_events_are_queued_once(self, construct_event):
+        construct_event.return_value = make_event()
+
+        self.assertEqual(self.post().status_code, 200)
+        self.assertEqual(self.post().status_code, 200)
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual(event.stripe_event_id, 'evt_1')
+        self.assertEqual(event.status, WebhookEvent.PENDING)
+
+    @mock.patch('stripe.Webhook.construct_event')
+    def test_unverified_events_are_rejected(self, construct_event):
+        construct_event.side_effect = stripe.error.SignatureVerificationError(
+            'Bad signature', 't=1,v1=x'
+        )
+
+        self.assertEqual(self.post().status_code, 401)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+
+@mock.patch(
+    'checkout.webhook_handler.StripeWH_Handler'
+    '.handle_payment_intent_payment_failed'
+)
+class WebhookInboxTests(TestCase):
+
+    def setUp(self):
+        self.event = WebhookEvent.objects.create(
+            stripe_event_id='evt_1',
+            event_type='payment_intent.payment_failed',
+            payload=make_event_payload(),
+        )
+
+    def test_due_events_are_processed(self, handle):
+        handle.return_value = HttpResponse(status=200)
+
+        self.assertEqual(process_due_events(), (1, 0))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.status, WebhookEvent.PROCESSED)
+        self.assertIsNotNone(self.event.processed_at)
+        self.assertEqual(process_due_events(), (0, 0))
+
+    def test_failures_are_retried_with_backoff(self, handle):
+        handle.return_value = HttpResponse('Order not found', status=500)
+
+        self.assertEqual(process_due_events(), (0, 1))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.status, WebhookEvent.PENDING)
+        self.assertEqual(self.event.attempts, 1)
+        self.assertEqual(self.event.last_error, 'Order not found')
+        self.assertGreater(self.event.next_attempt_at, timezone.now())
+        # Not due again until the backoff has passed
+        self.assertEqual(process_due_events(), (0, 0))
+
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        handle.return_value = HttpResponse(status=200)
+        self.assertEqual(process_due_events(), (1, 0))
+
+    def test_events_fail_after_the_last_attempt(self, handle):
+        handle.side_effect = RuntimeError('Stripe is down')
+        WebhookEvent.objects.update(attempts=MAX_ATTEMPTS - 1)
+
+        self.assertEqual(process_due_events(), (0, 1))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.status, WebhookEvent.FAILED)
+        self.assertEqual(self.event.last_error, 'Stripe is down')
+
+    def test_retry_delays_double_up_to_a_cap(self, handle):
+        self.assertEqual(get_retry_delay(1), timedelta(minutes=1))
+        self.assertEqual(get_retry_delay(3), timedelta(minutes=4))
+        self.assertEqual(get_retry_delay(20), timedelta(hours=6))
+
+
+@mock.patch(
+    'checkout.webhook_handler.StripeWH_Handler'
+    '.handle_payment_intent_payment_failed'
+)
+class ProcessedEventLedgerTests(TestCase):
+
+    def test_handled_events_are_recorded(self, handle):
+        handle.return_value = HttpResponse(status=200)
+
+        dispatch_event(make_event())
+
+        ledger = ProcessedStripeEvent.objects.get()
+        self.assertEqual(ledger.event_id, 'evt_1')
+        self.assertEqual(ledger.event_type, 'payment_intent.payment_failed')
+
+    def test_recorded_events_are_not_handled_again(self, handle):
+        handle.return_value = HttpResponse(status=200)
+        dispatch_event(make_event())
+        response = dispatch_event(make_event())
+
+        handle.assert_called_once()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Event already processed', response.content)
+
+    def test_failed_events_are_not_recorded(self, handle):
+        handle.return_value = HttpResponse(status=500)
+
+        response = dispatch_event(make_event())
+
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(ProcessedStripeEvent.objects.exists())
+
+
+class UpsertOrderTests(CheckoutTestCase):
+
+    def upsert(self, update=None):
+        return upsert_order(
+            'pi_1',
+            defaults={**ORDER_DETAILS, 'original_bag': '{}'},
+            bag=self.make_bag(self.products[:2]),
+            update=update,
+        )
+
+    def test_creates_the_order_and_its_lines(self):
+        order, created = self.upsert()
+
+        self.assertTrue(created)
+        self.assertEqual(order.lineitems.count(), 2)
+        self.assertEqual(order.order_total, Decimal('75.00'))
+
+    def test_updates_an_existing_order_without_new_lines(self):
+        first, _ = self.upsert()
+        order, created = self.upsert(update={'full_name': 'Ada Lovelace'})
+
+        self.assertFalse(created)
+        self.assertEqual(order.pk, first.pk)
+        self.assertEqual(order.lineitems.count(), 2)
+        self.assertEqual(
+            Order.objects.get(pk=first.pk).full_name, 'Ada Lovelace'
+        )
+
+    def test_lost_insert_race_updates_the_winning_order(self):
+        # The webhook creates the order between the checkout's lookup
+        # and its insert, so the insert hits the unique stripe_pid
+        winner, _ = self.upsert()
+        first = QuerySet.first
+        lookups = []
+
+        def miss_first_lookup(queryset):
+            lookups.append(queryset)
+            return None if len(lookups) == 1 else first(queryset)
+
+        with mock.patch.object(QuerySet, 'first', miss_first_lookup):
+            order, created = self.upsert(update={'full_name': 'Ada Lovelace'})
+
+        self.assertEqual(len(lookups), 2)
+        self.assertFalse(created)
+        self.assertEqual(order.pk, winner.pk)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(order.lineitems.count(), 2)
+        self.assertEqual(
+            Order.objects.get(pk=winner.pk).full_name, 'Ada Lovelace'
+        )
+
+    def test_missing_products_save_nothing(self):
+        with self.assertRaises(Product.DoesNotExist):
+            upsert_order(
+                'pi_1',
+                defaults={**ORDER_DETAILS, 'original_bag': '{}'},
+                bag={'999': {'quantity': 1, 'sku': 'retired-drone'}},
+            )
+        self.assertFalse(Order.objects.exists())
+
+
+class ConfirmationEmailTests(CheckoutTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.order = Order.objects.create(**ORDER_DETAILS)
+        self.order.create_line_items(
+            self.make_bag(self.products[:1], attachments=['att-camera'])
+        )
+
+    def test_confirmation_is_queued_for_sending(self):
+        queue_confirmation_email(self.order)
+
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to, [self.order.email])
+        self.assertIn(self.order.order_number, email.subject)
+        self.assertIn('Grand Total: $324.00', email.html_body)
+        self.assertIn('Grand Total: $324.00', email.body)
+
+    def test_rendering_again_is_a_cache_hit(self):
+        first = render_confirmation_email(self.order)
+        with mock.patch(
+            'checkout.emails.build_confirmation_context'
+        ) as build_context, self.assertNumQueries(0):
+            again = render_confirmation_email(self.order)
+
+        build_context.assert_not_called()
+        self.assertEqual(again, first)
+
+    def test_order_changes_render_a_new_email(self):
+        render_confirmation_email(self.order)
+        self.order.full_name = 'Ada Lovelace'
+        self.order.save()
+
+        self.assertIn(
+            'Ada Lovelace', render_confirmation_email(self.order).html_body
+        )
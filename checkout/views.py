@@ -10,30 +10,23 @@ from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_protect
 from django.contrib import messages
 from django.conf import settings
-from decimal import Decimal
 import stripe
 import json
 from .forms import OrderForm
-from .models import Order, OrderLineItem
+from .models import Order
+from products.attachments import attachment_catalogue
 from products.models import Product
 from profiles.models import UserProfile
-from products.constants import ATTACHMENTS
-from utils.mailchimp_utils import Mailchimp
-
-
-# Helper functions for attachments
-def get_attachment_name_by_sku(sku):
-    for attachment in ATTACHMENTS:
-        if attachment['sku'] == sku:
-            return attachment['name']
-    return sku
-
-
-def get_attachment_price_by_sku(sku):
-    for attachment in ATTACHMENTS:
-        if attachment['sku'] == sku:
-            return Decimal(attachment['price'])
-    return Decimal(0)
+from bag.pricing import get_stripe_amount
+from bag.resolver import get_bag_resolver
+from .orders import upsert_order
+from .payments import (
+    forget_payment_intent,
+    get_bag_metadata,
+    get_checkout_client_secret,
+    update_cached_intent_amount,
+)
+from notifications.mailchimp_sync import queue_subscriber_update
 
 
 @require_POST
@@ -42,42 +35,40 @@ def cache_checkout_data(request):
         # Extract data from the POST request
         client_secret = request.POST.get('client_secret')
         loyalty_points_used = int(request.POST.get('loyalty_points', 0))
+        resolver = get_bag_resolver(request)
+
+        # Ensure valid loyalty points before they price the bag
+        if (
+            loyalty_points_used < 0 or
+            loyalty_points_used > resolver.user_loyalty_points
+        ):
+            messages.error(
+                request,
+                "Invalid. Points must be between 0 and your available points."
+            )
+            return HttpResponse(status=400)
 
         if client_secret:
             pid = client_secret.split('_secret')[0]
             stripe.api_key = settings.STRIPE_SECRET_KEY
 
-            # Retrieve the existing payment intent
-            payment_intent = stripe.PaymentIntent.retrieve(pid)
-            original_amount = payment_intent.amount
-            discount_amount = loyalty_points_used * 10
-            new_amount = max(original_amount - discount_amount, 0)
-
-            # Condense the bag data for metadata
-            condensed_bag = {
-                item_id: {
-                    "quantity": item_data.get("quantity"),
-                    "sku": item_data.get("sku", "N/A")
-                }
-                for item_id, item_data in request.session.get(
-                    'bag', {}
-                ).items()
-            }
-
-            bag_metadata = json.dumps(condensed_bag)
-            if len(bag_metadata) > 500:
-                for item_id in list(condensed_bag):
-                    condensed_bag.pop(item_id)
-                    bag_metadata = json.dumps(condensed_bag)
-                    if len(bag_metadata) <= 500:
-                        break
+            # Price the bag from the database with the redeemed points,
+            # so the intent is charged exactly what the order will be
+            # stored at
+            request.session['loyalty_points'] = loyalty_points_used
+            contents = resolver.pricing
+            new_amount = get_stripe_amount(contents['grand_total'])
+            discount_amount = get_stripe_amount(contents['loyalty_discount'])
+            original_amount = get_stripe_amount(
+                contents['total'] + contents['delivery']
+            )
 
             # Update the payment intent with the new amount and metadata
             stripe.PaymentIntent.modify(
                 pid,
                 amount=new_amount,
                 metadata={
-                    'bag': bag_metadata,
+                    'bag': get_bag_metadata(resolver.lines),
                     'save_info': request.POST.get('save_info'),
                     'username': str(request.user),
                     'loyalty_points_used': str(loyalty_points_used),
@@ -85,8 +76,19 @@ def cache_checkout_data(request):
                     'discount_amount': str(discount_amount),
                 }
             )
+            update_cached_intent_amount(request, pid, new_amount)
 
         return HttpResponse(status=200)
+    except stripe.error.InvalidRequestError:
+        # The intent was already used or cancelled; the checkout page
+        # reloads and creates a new one
+        forget_payment_intent(request)
+        messages.error(
+            request,
+            'Your payment session expired. Please check your order and '
+            'try again.'
+        )
+        return HttpResponse(status=400)
     except Exception:
         messages.error(
             request,
@@ -98,18 +100,9 @@ def cache_checkout_data(request):
 
 def checkout(request):
     stripe_public_key = settings.STRIPE_PUBLIC_KEY
-    stripe_secret_key = settings.STRIPE_SECRET_KEY
-
-    bag = request.session.get('bag', {})
-    serialized_bag = {}
-    for item_id, item_data in bag.items():
-        serialized_item_data = {
-            "quantity": item_data.get("quantity"),
-            "price": str(item_data["price"]),
-            "attachments": item_data.get("attachments", []),
-            "sku": item_data.get("sku")
-        }
-        serialized_bag[item_id] = serialized_item_data
+
+    resolver = get_bag_resolver(request)
+    bag = resolver.lines
 
     if not bag:
         messages.error(request, "There's nothing in your bag at the moment")
@@ -155,136 +148,68 @@ def checkout(request):
         # Store applied loyalty points in session
         request.session['loyalty_points'] = loyalty_points_used
 
-        # Calculate order totals
-        order_total = Decimal('0.00')
-        for item_id, item_data in bag.items():
-            product = Product.objects.get(sku=item_data['sku'])
-            quantity = item_data.get('quantity', 1)
-            price = product.price
-
-            # Add attachment costs
-            if 'attachments' in item_data and item_data['attachments']:
-                for attachment_sku in item_data['attachments']:
-                    for attachment in ATTACHMENTS:
-                        if attachment['sku'] == attachment_sku:
-                            price += Decimal(str(attachment['price']))
-
-            order_total += price * Decimal(str(quantity))
-
-        delivery_cost = (
-            Decimal('10.00')
-            if order_total < Decimal('100.00')
-            else Decimal('0.00')
-        )
-        discount = Decimal(loyalty_points_used) * Decimal('0.1')
-        grand_total = max(
-            order_total + delivery_cost - discount,
-            Decimal('0.00')
-        )
-        stripe_total = round(grand_total * 100)
+        # Price the bag from the database with the shared pricing rules
+        contents = resolver.pricing
+        order_total = contents['total']
+        delivery_cost = contents['delivery']
+        discount = contents['loyalty_discount']
+        grand_total = contents['grand_total']
 
-        # Condense metadata to include only essential fields
-        condensed_bag = {
-            item_id: {
-                "quantity": item_data.get("quantity"),
-                "sku": item_data.get("sku", "N/A")
+        if order_form.is_valid():
+            pid = client_secret.split('_secret')[0]
+            serialized_bag = {
+                line['item_id']: {
+                    "quantity": line["quantity"],
+                    "price": str(line["unit_price"]),
+                    "attachments": line["attachments"],
+                    "sku": line["product"].sku,
+                }
+                for line in contents['lines']
             }
-            for item_id, item_data in bag.items()
-        }
-
-        # Truncate metadata to fit within Stripe's 500-character limit
-        bag_metadata = json.dumps(condensed_bag)
-        if len(bag_metadata) > 500:
-            truncated_bag = dict(
-                list(condensed_bag.items())[:max(len(condensed_bag) - 1, 0)]
-            )
-            while len(json.dumps(truncated_bag)) > 500:
-                truncated_bag.pop(next(iter(truncated_bag)))
-            bag_metadata = json.dumps(truncated_bag)
-
-        # Condense serialized_bag to include only essential fields
-        condensed_serialized_bag = {
-            item_id: {
-                "quantity": item_data.get("quantity"),
-                "sku": item_data.get("sku", "N/A")
+            order_details = {
+                field: order_form.cleaned_data[field]
+                for field in order_form.Meta.fields
             }
-            for item_id, item_data in serialized_bag.items()
-        }
 
-        # Truncate serialized_bag to fit within Stripe's 500-character limit
-        serialized_bag_metadata = json.dumps(condensed_serialized_bag)
-        if len(serialized_bag_metadata) > 500:
-            truncated_serialized_bag = dict(
-                list(condensed_serialized_bag.items())[
-                    :max(len(condensed_serialized_bag) - 1, 0)
-                ]
-            )
-            while len(json.dumps(truncated_serialized_bag)) > 500:
-                truncated_serialized_bag.pop(
-                    next(iter(truncated_serialized_bag))
+            # Create the order, or complete the one the webhook may
+            # already have created for this payment
+            try:
+                order, _ = upsert_order(
+                    pid,
+                    defaults={
+                        **order_details,
+                        'original_bag': json.dumps(serialized_bag),
+                        'order_total': order_total,
+                        'delivery_cost': delivery_cost,
+                        'discount_applied': discount,
+                        'grand_total': grand_total,
+                        'loyalty_points': contents['loyalty_points_earned'],
+                        'loyalty_points_used': loyalty_points_used,
+                    },
+                    bag=bag,
+                    update=order_details,
                 )
-            serialized_bag_metadata = json.dumps(truncated_serialized_bag)
-
-        stripe.api_key = stripe_secret_key
-        intent = stripe.PaymentIntent.create(
-            amount=stripe_total,
-            currency=settings.STRIPE_CURRENCY,
-            payment_method_types=['card'],
-            capture_method='automatic',
-            confirm=False,
-            metadata={
-                'bag': bag_metadata,
-                'save_info': request.POST.get('save_info', ''),
-                'username': (
-                    request.user.username
-                    if request.user.is_authenticated
-                    else 'AnonymousUser'
-                ),
-                'loyalty_points_used': str(loyalty_points_used),
-            }
-        )
-
-        if order_form.is_valid():
-            order = order_form.save(commit=False)
-            pid = client_secret.split('_secret')[0]
-            order.stripe_pid = pid
-            order.original_bag = json.dumps(serialized_bag)
-            order.order_total = order_total
-            order.delivery_cost = delivery_cost
-            order.discount_applied = discount
-            order.grand_total = grand_total
-            order.loyalty_points = int(grand_total // 10)
-            order.loyalty_points_used = loyalty_points_used
-            order.save()
-
-            # Create order line items
-            for item_id, item_data in bag.items():
-                try:
-                    product = Product.objects.get(sku=item_data['sku'])
-                    order_line_item = OrderLineItem(
-                        order=order,
-                        product=product,
-                        quantity=item_data['quantity'],
-                        attachments=','.join(item_data.get('attachments', [])),
-                    )
-                    order_line_item.save()
-                except Product.DoesNotExist:
-                    messages.error(
-                        request,
-                        "One of the products wasn't found in our database. "
-                        "Please call us for assistance!"
-                    )
-                    order.delete()
-                    return redirect(reverse('view_bag'))
+            except Product.DoesNotExist:
+                messages.error(
+                    request,
+                    "One of the products wasn't found in our database. "
+                    "Please call us for assistance!"
+                )
+                return redirect(reverse('view_bag'))
 
+            # Credit the profile unless the points were already applied
             if request.user.is_authenticated and profile:
-                profile.loyalty_points = max(
-                    0,
-                    profile.loyalty_points
-                    - loyalty_points_used
-                    + order.loyalty_points,
-                )
-                profile.save()
+                claimed = Order.objects.filter(
+                    pk=order.pk, loyalty_points_applied=False
+                ).update(loyalty_points_applied=True)
+                if claimed:
+                    profile.loyalty_points = max(
+                        0,
+                        profile.loyalty_points
+                        - order.loyalty_points_used
+                        + order.loyalty_points,
+                    )
+                    profile.save()
 
             # Redirect to success page
             request.session['save_info'] = 'save-info' in request.POST
@@ -299,97 +224,46 @@ def checkout(request):
             )
 
     else:
-        total = Decimal('0.00')
+        # Price the bag from the database, as the PaymentIntent's amount
+        contents = resolver.pricing
         bag_items = []
 
-        for item_id, item_data in bag.items():
-            product = get_object_or_404(Product, sku=item_data['sku'])
-            quantity = item_data.get('quantity', 1)
-            price = product.price
-
-            # Calculate price with attachments
-            if 'attachments' in item_data and item_data['attachments']:
-                for attachment_sku in item_data['attachments']:
-                    for attachment in ATTACHMENTS:
-                        if attachment['sku'] == attachment_sku:
-                            price += Decimal(str(attachment['price']))
-
-            total += price * Decimal(str(quantity))
-
+        for item in contents['lines']:
+            product = item['product']
             try:
                 image_url = (
                     product.image.url
                     if product.image
                     else f"{settings.MEDIA_URL}noimage.webp"
                 )
-                item_data.update({
-                    'name': product.name,
-                    'product': product,
-                    'image': image_url,
-                    'attachment_list': [
-                        get_attachment_name_by_sku(att)
-                        for att in item_data.get('attachments', [])
-                    ]
-                })
             except Exception:
-                item_data.update({
-                    'name': product.name,
-                    'product': product,
-                    'image': f"{settings.MEDIA_URL}noimage.webp",
-                    'attachment_list': [
-                        get_attachment_name_by_sku(att)
-                        for att in item_data.get('attachments', [])
-                    ]
-                })
-
-            bag_items.append(item_data)
-
-            delivery_cost = (
-                Decimal('10.00')
-                if total < Decimal('100.00')
-                else Decimal('0.00')
-            )
-            loyalty_points_used = int(request.session.get('loyalty_points', 0))
-            discount = Decimal(loyalty_points_used) * Decimal('0.1')
-            grand_total = max(
-                total + delivery_cost - discount,
-                Decimal('0.00')
-            )
-            stripe_total = round(grand_total * 100)
-            loyalty_points_earned = int(grand_total // 10)
-
-        # Condense serialized_bag to include only essential fields
-        condensed_serialized_bag = {
-            item_id: {
-                "quantity": item_data.get("quantity"),
-                "sku": item_data.get("sku", "N/A")
-            }
-            for item_id, item_data in serialized_bag.items()
-        }
+                image_url = f"{settings.MEDIA_URL}noimage.webp"
+
+            bag_items.append({
+                'name': product.name,
+                'product': product,
+                'image': image_url,
+                'quantity': item['quantity'],
+                'price': item['unit_price'],
+                'attachment_list': attachment_catalogue.get_names(
+                    item['attachments']
+                ),
+            })
 
-        # Truncate serialized_bag to fit within Stripe's 500-character limit
-        serialized_bag_metadata = json.dumps(condensed_serialized_bag)
-        if len(serialized_bag_metadata) > 500:
-            truncated_serialized_bag = dict(
-                list(condensed_serialized_bag.items())[:max(
-                    len(condensed_serialized_bag) - 1, 0
-                )]
-            )
-            while len(json.dumps(truncated_serialized_bag)) > 500:
-                truncated_serialized_bag.pop(
-                    next(iter(truncated_serialized_bag))
-                )
-            serialized_bag_metadata = json.dumps(truncated_serialized_bag)
-
-        stripe.api_key = stripe_secret_key
-        intent = stripe.PaymentIntent.create(
-            amount=stripe_total,
-            currency=settings.STRIPE_CURRENCY,
-            payment_method_types=['card'],
-            capture_method='automatic',
-            confirm=False,
+        total = contents['total']
+        delivery_cost = contents['delivery']
+        loyalty_points_used = int(request.session.get('loyalty_points', 0))
+        grand_total = contents['grand_total']
+        stripe_total = get_stripe_amount(grand_total)
+        loyalty_points_earned = contents['loyalty_points_earned']
+
+        # Reuse this session's PaymentIntent rather than creating a new
+        # one on every page load
+        client_secret = get_checkout_client_secret(
+            request,
+            stripe_total,
             metadata={
-                'bag': serialized_bag_metadata,
+                'bag': get_bag_metadata(bag),
                 'save_info': request.POST.get('save_info', ''),
                 'username': (
                     request.user.username
@@ -397,7 +271,7 @@ def checkout(request):
                     else 'AnonymousUser'
                 ),
                 'loyalty_points_used': str(loyalty_points_used),
-            }
+            },
         )
 
         # Prefill order form for authenticated users
@@ -434,9 +308,9 @@ def checkout(request):
             'loyalty_points_earned': loyalty_points_earned,
             'user_loyalty_points': user_loyalty_points,
             'loyalty_points_used': loyalty_points_used,
-            'product_count': sum(item['quantity'] for item in bag.values()),
+            'product_count': contents['product_count'],
             'stripe_public_key': stripe_public_key,
-            'client_secret': intent.client_secret,
+            'client_secret': client_secret,
             'MEDIA_URL': settings.MEDIA_URL,
         }
 
@@ -484,6 +358,8 @@ def checkout_success(request, order_number):
         del request.session['bag']
     if 'loyalty_points' in request.session:
         del request.session['loyalty_points']
+    request.session.pop('bag_snapshot', None)
+    forget_payment_intent(request)
 
     # Associate order with profile but do not adjust loyalty points here
     if request.user.is_authenticated:
@@ -503,25 +379,20 @@ def checkout_success(request, order_number):
                 profile.default_county = order.county
                 profile.save()
 
-            # Sync with Mailchimp
-            try:
-                mailchimp = Mailchimp()
-                address = {
+            # Queue a Mailchimp sync rather than calling the API here
+            queue_subscriber_update(
+                email=order.email,
+                first_name=order.full_name.split()[0],
+                last_name=" ".join(order.full_name.split()[1:]),
+                tags=["Purchased"],
+                address={
                     "addr1": order.street_address1,
                     "city": order.town_or_city,
                     "state": order.county or "",
                     "zip": order.postcode,
                     "country": order.country.code,
-                }
-                mailchimp.subscribe_user(
-                    email=order.email,
-                    first_name=order.full_name.split()[0],
-                    last_name=" ".join(order.full_name.split()[1:]),
-                    tags=["Purchased"],
-                    address=address,
-                )
-            except Exception:
-                pass
+                },
+            )
 
         except Exception:
             messages.error(
@@ -565,6 +436,7 @@ def update_payment_intent(request):
             pid,
             amount=new_amount
         )
+        update_cached_intent_amount(request, pid, new_amount)
 
         # Return the new client secret
         return JsonResponse({
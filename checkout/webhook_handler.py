@@ -1,16 +1,11 @@
 from django.http import HttpResponse
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
-from django.conf import settings
-from .models import Order, OrderLineItem
-from products.models import Product
-from utils.mailchimp_utils import Mailchimp
+from .models import Order
+from .emails import queue_confirmation_email
+from .orders import upsert_order
 import json
 import stripe
-import time
-from decimal import Decimal
 from django.db import transaction
-from products.constants import ATTACHMENTS
+from bag.pricing import price_bag, resolve_bag_products
 
 
 class StripeWH_Handler:
@@ -18,92 +13,8 @@ class StripeWH_Handler:
 
     def __init__(self, request):
         self.request = request
-        self.mailchimp = Mailchimp()
-
-    def _send_confirmation_email(
-        self, order, loyalty_points_earned, loyalty_points_used, discount
-    ):
-        try:
-            # Helper to map SKUs to friendly names and prices
-            def get_attachment_details(attachments_sku_list):
-                attachment_details = []
-                for sku in attachments_sku_list:
-                    for attachment in ATTACHMENTS:
-                        if attachment['sku'] == sku:
-                            attachment_details.append(
-                                f"{attachment['name']} "
-                                f"(${attachment['price']})"
-                            )
-                return ", ".join(attachment_details)
-
-            background_image_url = (
-                "https://dhitchen28963-icarus-drones.s3.us-east-1."
-                "amazonaws.com/media/homepage_background.webp"
-            )
-            facebook_icon_url = (
-                "https://dhitchen28963-icarus-drones.s3.us-east-1."
-                "amazonaws.com/media/facebook.png"
-            )
-            twitter_icon_url = (
-                "https://dhitchen28963-icarus-drones.s3.us-east-1."
-                "amazonaws.com/media/twitter.png"
-            )
-            instagram_icon_url = (
-                "https://dhitchen28963-icarus-drones.s3.us-east-1."
-                "amazonaws.com/media/instagram.png"
-            )
-            unsubscribe_url = (
-                f"{settings.SITE_URL}/profiles/"
-                f"unsubscribe/{order.email}/"
-            )
-
-            context = {
-                'order': order,
-                'contact_email': settings.DEFAULT_FROM_EMAIL,
-                'loyalty_points_earned': loyalty_points_earned,
-                'loyalty_points_used': loyalty_points_used,
-                'discount_applied': f"${discount:.2f}",
-                'background_image_url': background_image_url,
-                'facebook_icon_url': facebook_icon_url,
-                'twitter_icon_url': twitter_icon_url,
-                'instagram_icon_url': instagram_icon_url,
-                'unsubscribe_url': unsubscribe_url,
-                'lineitems': [
-                    {
-                        'product_name': item.product.name,
-                        'quantity': item.quantity,
-                        'attachments': get_attachment_details(
-                            item.attachments.split(',')
-                        ) if item.attachments else '',
-                        'lineitem_total': item.lineitem_total,
-                    }
-                    for item in order.lineitems.all()
-                ],
-            }
-
-            subject = render_to_string(
-                'checkout/confirmation_emails/confirmation_email_subject.txt',
-                {'order': order},
-            ).strip()
-            text_content = render_to_string(
-                'checkout/confirmation_emails/confirmation_email_body.txt',
-                context,
-            )
-            html_content = render_to_string(
-                'checkout/confirmation_emails/confirmation_email_body.html',
-                context,
-            )
-
-            msg = EmailMultiAlternatives(
-                subject,
-                text_content,
-                settings.DEFAULT_FROM_EMAIL,
-                [order.email],
-            )
-            msg.attach_alternative(html_content, "text/html")
-            msg.send()
-        except Exception:
-            raise
+        # The order handled by the last event, recorded in the ledger
+        self.order = None
 
     def handle_event(self, event):
         """Handle a generic/unknown/unexpected webhook event"""
@@ -118,6 +29,38 @@ class StripeWH_Handler:
         except (ValueError, TypeError):
             return 0
 
+    def _fulfil_order(self, order, intent):
+        """
+        Apply the order's loyalty points and queue its confirmation
+        e-mail. Each step is claimed with a conditional UPDATE on the
+        order's processing flags, so it happens at most once per order
+        however many events or retries arrive for it.
+        """
+        if order.user_profile:
+            with transaction.atomic():
+                claimed = Order.objects.filter(
+                    pk=order.pk, loyalty_points_applied=False
+                ).update(loyalty_points_applied=True)
+                if claimed:
+                    order.user_profile.adjust_loyalty_points(
+                        points_used=order.loyalty_points_used,
+                        points_earned=order.loyalty_points,
+                        order=order,
+                    )
+
+        if not order.email:
+            order.email = intent.charges.data[0].billing_details.email
+            order.save()
+
+        # The e-mail is queued in the same transaction as its claim, so
+        # a rendering error leaves it unclaimed for the next retry
+        with transaction.atomic():
+            claimed = Order.objects.filter(
+                pk=order.pk, confirmation_email_sent=False
+            ).update(confirmation_email_sent=True)
+            if claimed:
+                queue_confirmation_email(order)
+
     def handle_payment_intent_succeeded(self, event):
         try:
             intent = event.data.object
@@ -126,136 +69,28 @@ class StripeWH_Handler:
             loyalty_points_used = self._extract_loyalty_points(intent)
             bag = intent.metadata.get('bag', '{}')
 
-            try:
-                order = Order.objects.get(stripe_pid=pid)
-
-                if (
-                    order.user_profile
-                    and order.loyalty_points_used > 0
-                    and order.loyalty_points > 0
-                ):
-                    return HttpResponse(
-                        content=(
-                            f'Webhook received: {event["type"]} | '
-                            "Order already processed"
-                        ),
-                        status=200,
-                    )
-
-                user_profile = order.user_profile
-                if user_profile:
-                    with transaction.atomic():
-                        user_profile.adjust_loyalty_points(
-                            points_used=order.loyalty_points_used,
-                            points_earned=order.loyalty_points,
-                            order=order,
-                        )
-
-                if not order.email:
-                    order.email = intent.charges.data[0].billing_details.email
-                    order.save()
-
-                self._send_confirmation_email(
-                    order,
-                    order.loyalty_points,
-                    order.loyalty_points_used,
-                    order.discount_applied,
-                )
-
-                return HttpResponse(
-                    content=(
-                        f'Webhook received: {event["type"]} | '
-                        "SUCCESS: Order processed"
-                    ),
-                    status=200,
-                )
-
-            except Order.DoesNotExist:
-                for attempt in range(3):
-                    time.sleep(1)
-                    try:
-                        order = Order.objects.get(stripe_pid=pid)
-
-                        if (
-                            order.user_profile
-                            and order.loyalty_points_used > 0
-                            and order.loyalty_points > 0
-                        ):
-                            return HttpResponse(
-                                content=(
-                                    f'Webhook received: {event["type"]} | '
-                                    "Order already processed"
-                                ),
-                                status=200,
-                            )
-
-                        user_profile = order.user_profile
-                        if user_profile:
-                            with transaction.atomic():
-                                user_profile.adjust_loyalty_points(
-                                    points_used=order.loyalty_points_used,
-                                    points_earned=order.loyalty_points,
-                                    order=order,
-                                )
-
-                        if not order.email:
-                            order.email = (
-                                intent.charges.data[0].billing_details.email
-                            )
-                            order.save()
-
-                        self._send_confirmation_email(
-                            order,
-                            order.loyalty_points,
-                            order.loyalty_points_used,
-                            order.discount_applied,
-                        )
-
-                        return HttpResponse(
-                            content=(
-                                f'Webhook received: {event["type"]} | '
-                                "SUCCESS: Order processed"
-                            ),
-                            status=200,
-                        )
-
-                    except Order.DoesNotExist:
-                        continue
-
+            # If checkout hasn't saved the order yet, build it from the
+            # PaymentIntent; upsert_order reconciles with a concurrent
+            # checkout rather than waiting for it
+            order = Order.objects.filter(stripe_pid=pid).first()
+            if order is None:
                 bag_items = json.loads(bag)
-                order_total = Decimal('0.00')
-
-                for item_data in bag_items.values():
-                    product = Product.objects.get(sku=item_data['sku'])
-                    quantity = item_data.get('quantity', 0)
-                    item_price = product.price
-
-                    if 'attachments' in item_data and item_data['attachments']:
-                        for attachment_sku in item_data['attachments']:
-                            for attachment in ATTACHMENTS:
-                                if attachment['sku'] == attachment_sku:
-                                    item_price += Decimal(
-                                        str(attachment['price'])
-                                    )
-
-                    order_total += item_price * Decimal(str(quantity))
-
-                delivery_cost = (
-                    Decimal('10.00')
-                    if order_total < Decimal('100.00')
-                    else Decimal('0.00')
-                )
-                discount = Decimal(loyalty_points_used) * Decimal('0.1')
-                grand_total = max(
-                    order_total + delivery_cost - discount, Decimal('0.00')
+                pricing = price_bag(
+                    bag_items,
+                    resolve_bag_products(bag_items),
+                    loyalty_points_used,
                 )
-                loyalty_points_earned = int(grand_total // 10)
+                order_total = pricing['total']
+                delivery_cost = pricing['delivery']
+                discount = pricing['loyalty_discount']
+                grand_total = pricing['grand_total']
+                loyalty_points_earned = pricing['loyalty_points_earned']
 
                 charge = stripe.Charge.retrieve(intent.latest_charge)
                 billing_details = charge.billing_details
 
-                order, created = Order.objects.get_or_create(
-                    stripe_pid=pid,
+                order, _ = upsert_order(
+                    pid,
                     defaults={
                         'email': billing_details.email,
                         'full_name': billing_details.name,
@@ -273,35 +108,20 @@ class StripeWH_Handler:
                         'street_address1': billing_details.address.line1,
                         'street_address2': billing_details.address.line2,
                         'county': billing_details.address.state,
-                    }
+                    },
+                    bag=bag_items,
                 )
 
-                if created:
-                    for item_id, item_data in bag_items.items():
-                        product = Product.objects.get(sku=item_data['sku'])
-                        quantity = item_data.get('quantity', 0)
-                        attachments = ','.join(
-                            item_data.get('attachments', [])
-                        )
+            self.order = order
+            self._fulfil_order(order, intent)
 
-                        order_line_item = OrderLineItem(
-                            order=order,
-                            product=product,
-                            quantity=quantity,
-                            attachments=attachments,
-                        )
-                        order_line_item.save()
-
-                self._send_confirmation_email(
-                    order, loyalty_points_earned, loyalty_points_used, discount
-                )
-
-                return HttpResponse(
-                    content=(
-                        f'Webhook received: {event["type"]} | SUCCESS'
-                    ),
-                    status=200,
-                )
+            return HttpResponse(
+                content=(
+                    f'Webhook received: {event["type"]} | '
+                    "SUCCESS: Order processed"
+                ),
+                status=200,
+            )
 
         except Exception as e:
             return HttpResponse(content=f'Error: {str(e)}', status=500)
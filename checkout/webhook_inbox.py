@@ -0,0 +1,132 @@
+import json
+from datetime import timedelta
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from .models import ProcessedStripeEvent, WebhookEvent
+from .webhook_handler import StripeWH_Handler
+
+MAX_ATTEMPTS = 8
+# Retry delays double from one minute up to six hours
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 6 * 60 * 60
+
+
+def enqueue_event(event, payload):
+    """
+    Store a verified Stripe event for the worker. Redelivered events
+    are only stored once.
+    """
+    WebhookEvent.objects.get_or_create(
+        stripe_event_id=event['id'],
+        defaults={
+            'event_type': event['type'],
+            'payload': payload.decode('utf-8'),
+        },
+    )
+
+
+def get_retry_delay(attempts):
+    """Backoff before the next attempt, given the attempts made so far"""
+    return timedelta(
+        seconds=min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    )
+
+
+def claim_due_events(batch_size):
+    """
+    Claim a batch of due events, pushing their next attempt into the
+    future so concurrent workers don't pick up the same rows.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=WebhookEvent.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            event.next_attempt_at = now + get_retry_delay(event.attempts)
+        WebhookEvent.objects.bulk_update(
+            events, ['attempts', 'next_attempt_at']
+        )
+    return events
+
+
+def dispatch_event(event):
+    """
+    Run the Stripe handler for an event and return its response.
+    Events already in the ledger are acknowledged without handling.
+    """
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    handler = StripeWH_Handler(None)
+    event_map = {
+        'payment_intent.succeeded': handler.handle_payment_intent_succeeded,
+        'payment_intent.payment_failed': (
+            handler.handle_payment_intent_payment_failed
+        ),
+    }
+    event_handler = event_map.get(event['type'], handler.handle_event)
+
+    if ProcessedStripeEvent.objects.filter(pk=event['id']).exists():
+        return HttpResponse(
+            content=(
+                f'Webhook received: {event["type"]} | '
+                'Event already processed'
+            ),
+            status=200,
+        )
+
+    response = event_handler(event)
+    if response.status_code < 400:
+        ProcessedStripeEvent.objects.get_or_create(
+            event_id=event['id'],
+            defaults={'event_type': event['type'], 'order': handler.order},
+        )
+    return response
+
+
+def process_event(webhook_event):
+    """
+    Handle one claimed event. Failed events stay pending and are
+    retried at their next_attempt_at until MAX_ATTEMPTS is reached.
+    Returns True if the event was processed.
+    """
+    try:
+        event = stripe.Event.construct_from(
+            json.loads(webhook_event.payload), settings.STRIPE_SECRET_KEY
+        )
+        response = dispatch_event(event)
+        if response.status_code >= 400:
+            raise RuntimeError(response.content.decode('utf-8'))
+    except Exception as e:
+        webhook_event.last_error = str(e)
+        if webhook_event.attempts >= MAX_ATTEMPTS:
+            webhook_event.status = WebhookEvent.FAILED
+        webhook_event.save(update_fields=['last_error', 'status'])
+        return False
+
+    webhook_event.status = WebhookEvent.PROCESSED
+    webhook_event.processed_at = timezone.now()
+    webhook_event.last_error = ''
+    webhook_event.save(
+        update_fields=['status', 'processed_at', 'last_error']
+    )
+    return True
+
+
+def process_due_events(batch_size=20):
+    """
+    Process one batch of due events. Returns (processed, failed)
+    counts; (0, 0) means there was nothing to do.
+    """
+    processed = failed = 0
+    for webhook_event in claim_due_events(batch_size):
+        if process_event(webhook_event):
+            processed += 1
+        else:
+            failed += 1
+    return processed, failed
@@ -2,7 +2,7 @@ from django.conf import settings
 from django.http import HttpResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
-from checkout.webhook_handler import StripeWH_Handler
+from checkout.webhook_inbox import enqueue_event
 import stripe
 
 
@@ -27,15 +27,8 @@ def webhook(request):
     except Exception:
         return HttpResponse(status=400)
 
-    handler = StripeWH_Handler(request)
-    event_map = {
-        'payment_intent.succeeded': handler.handle_payment_intent_succeeded,
-        'payment_intent.payment_failed': (
-            handler.handle_payment_intent_payment_failed
-        ),
-    }
-    event_type = event['type']
-    event_handler = event_map.get(event_type, handler.handle_event)
-    response = event_handler(event)
+    # Persist the event and acknowledge it straight away; the
+    # process_webhooks worker does the actual handling
+    enqueue_event(event, payload)
 
-    return response
+    return HttpResponse(status=200)
@@ -1,30 +1,134 @@
+import functools
+import logging
+import mimetypes
+import threading
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from django.conf import settings
+from django.core import checks
 from storages.backends.s3boto3 import S3Boto3Storage
-import boto3
 
+# Connections kept open by the shared S3 client
+S3_MAX_POOL_CONNECTIONS = 20
 
-class StaticStorage(S3Boto3Storage):
+_clients = {}
+_clients_lock = threading.Lock()
+_pool = threading.local()
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Uploads above the threshold are sent as multipart uploads, streaming
+# one part per thread, so memory use is bounded by chunk size times
+# concurrency however large the file
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=getattr(
+        settings, 'AWS_S3_MULTIPART_THRESHOLD', 8 * MB
+    ),
+    multipart_chunksize=getattr(
+        settings, 'AWS_S3_MULTIPART_CHUNKSIZE', 8 * MB
+    ),
+    max_concurrency=getattr(settings, 'AWS_S3_MAX_CONCURRENCY', 4),
+    use_threads=True,
+)
+
+
+def get_s3_resource(storage):
+    """
+    Return the process-wide S3 resource for a storage backend's
+    settings. It is built once, and its client, which is thread-safe,
+    keeps its HTTP connections alive between requests.
+    """
+    key = (
+        storage.access_key, storage.region_name,
+        storage.endpoint_url, storage.use_ssl,
+    )
+    resource = _clients.get(key)
+    if resource is None:
+        with _clients_lock:
+            resource = _clients.get(key)
+            if resource is None:
+                resource = _clients[key] = storage._create_session().resource(
+                    's3',
+                    region_name=storage.region_name,
+                    use_ssl=storage.use_ssl,
+                    endpoint_url=storage.endpoint_url,
+                    config=storage.client_config.merge(Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        tcp_keepalive=True,
+                    )),
+                    verify=storage.verify,
+                )
+    return resource
+
+
+def get_s3_connection(storage):
+    """
+    Return this thread's S3 resource for a storage backend's settings.
+
+    boto3 resources aren't thread-safe, so each thread gets its own, but
+    they all wrap the one shared client, and so its connection pool.
+    """
+    base_resource = get_s3_resource(storage)
+    connections = getattr(_pool, 'connections', None)
+    if connections is None:
+        connections = _pool.connections = {}
+    connection = connections.get(id(base_resource))
+    if connection is None:
+        connection = connections[id(base_resource)] = type(base_resource)(
+            client=base_resource.meta.client
+        )
+    return connection
+
+
+class UploadProgress:
+    """
+    boto3 transfer callback that logs an upload's progress every
+    `step` percent. Parts upload on several threads, so it is locked.
+    """
+
+    def __init__(self, name, size, step=10):
+        self.name = name
+        self.size = size
+        self.step = step
+        self.uploaded = 0
+        self.reported = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_transferred):
+        with self._lock:
+            self.uploaded += bytes_transferred
+            if not self.size:
+                return
+            percent = min(100, self.uploaded * 100 // self.size)
+            if percent >= self.reported + self.step or percent == 100:
+                self.reported = percent
+                logger.info(
+                    'Uploading %s: %d%% of %d bytes',
+                    self.name, percent, self.size,
+                )
+
+
+class PooledS3Storage(S3Boto3Storage):
+    """S3 storage that draws its connection from the shared pool"""
+    transfer_config = TRANSFER_CONFIG
+
+    @property
+    def connection(self):
+        return get_s3_connection(self)
+
+
+class StaticStorage(PooledS3Storage):
     location = settings.STATICFILES_LOCATION
     default_acl = 'public-read'
     file_overwrite = False
 
 
-class MediaStorage(S3Boto3Storage):
+class MediaStorage(PooledS3Storage):
     location = settings.MEDIAFILES_LOCATION
     default_acl = 'public-read'
     file_overwrite = False
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Test S3 connection
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
-        s3.list_buckets()
-
     def _normalize_name(self, name):
         """Ensure consistent naming for media files."""
         if name.startswith(f"{settings.MEDIAFILES_LOCATION}/"):
@@ -44,26 +148,45 @@ class MediaStorage(S3Boto3Storage):
         # Ensure content is at start of file
         content.seek(0)
 
-        # Create S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME
-        )
-
-        # Upload directly to S3
-        s3_client.upload_fileobj(
+        # Upload directly to S3; upload_fileobj raises if it fails
+        extra_args = {'ACL': 'public-read'}
+        content_type = mimetypes.guess_type(name)[0]
+        if content_type:
+            extra_args['ContentType'] = content_type
+        self.connection.meta.client.upload_fileobj(
             content,
             settings.AWS_STORAGE_BUCKET_NAME,
             name,
-            ExtraArgs={'ACL': 'public-read'}
-        )
-
-        # Verify the file exists
-        s3_client.head_object(
-            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
-            Key=name
+            ExtraArgs=extra_args,
+            Config=self.transfer_config,
+            Callback=UploadProgress(name, getattr(content, 'size', None)),
         )
 
         return name
+
+
+@functools.lru_cache(maxsize=1)
+def probe_s3():
+    """
+    Check once per process that the media bucket is reachable with the
+    configured credentials. Raises the S3 error if it isn't. Run at
+    startup by ProductsConfig.ready when AWS_S3_STARTUP_PROBE is set.
+    """
+    storage = MediaStorage()
+    storage.connection.meta.client.head_bucket(Bucket=storage.bucket_name)
+
+
+def check_s3_connection(app_configs, **kwargs):
+    """System check wrapping probe_s3"""
+    try:
+        probe_s3()
+    except Exception as e:
+        return [checks.Error(
+            f'Could not reach S3 bucket: {e}', id='custom_storages.E001'
+        )]
+    return []
+
+
+# The probe costs an S3 round trip, so it only runs with
+# `check --deploy`
+checks.register(check_s3_connection, 'storage', deploy=True)
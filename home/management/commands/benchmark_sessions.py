@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a storefront visit with each session engine and report '
+        'the django_session queries made per page view'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--visits', type=int, default=5,
+            help='Number of times to replay the visit per engine',
+        )
+
+    def get_journey(self, product):
+        """(label, method, url, data) for each page view of a visit"""
+        detail_url = reverse('product_detail', args=[product.id])
+        bag_url = reverse('view_bag')
+        return [
+            ('home', 'get', reverse('home'), None),
+            ('products', 'get', reverse('products'), None),
+            ('product detail', 'get', detail_url, None),
+            ('add to bag', 'post', reverse('add_to_bag', args=[product.id]),
+             {'quantity': 1, 'redirect_url': detail_url}),
+            ('product detail', 'get', detail_url, None),
+            ('bag', 'get', bag_url, None),
+            ('products', 'get', reverse('products'), None),
+            ('bag', 'get', bag_url, None),
+        ]
+
+    def replay(self, engine, journey, visits):
+        """(views, session reads, session writes) per page view label"""
+        totals = {}
+        session_keys = set()
+        with override_settings(
+            SESSION_ENGINE=engine, ALLOWED_HOSTS=['testserver'],
+        ):
+            for _ in range(visits):
+                client = Client()
+                for label, method, url, data in journey:
+                    with CaptureQueriesContext(connection) as queries:
+                        getattr(client, method)(url, data)
+                    session_queries = [
+                        query['sql'] for query in queries.captured_queries
+                        if 'django_session' in query['sql']
+                    ]
+                    writes = sum(
+                        not sql.lstrip().upper().startswith('SELECT')
+                        for sql in session_queries
+                    )
+                    views, reads, total_writes = totals.get(label, (0, 0, 0))
+                    totals[label] = (
+                        views + 1,
+                        reads + len(session_queries) - writes,
+                        total_writes + writes,
+                    )
+                if settings.SESSION_COOKIE_NAME in client.cookies:
+                    session_keys.add(
+                        client.cookies[settings.SESSION_COOKIE_NAME].value
+                    )
+        # Don't leave the benchmark's sessions behind
+        Session.objects.filter(session_key__in=session_keys).delete()
+        return totals
+
+    def handle(self, *args, **options):
+        product = Product.objects.first()
+        if product is None:
+            raise CommandError('Add a product to benchmark the storefront.')
+        journey = self.get_journey(product)
+        engines = ['django.contrib.sessions.backends.db']
+        if settings.SESSION_ENGINE not in engines:
+            engines.append(settings.SESSION_ENGINE)
+
+        for engine in engines:
+            totals = self.replay(engine, journey, options['visits'])
+            totals['overall'] = tuple(map(sum, zip(*totals.values())))
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{engine} (write-behind interval '
+                f'{settings.SESSION_WRITE_BEHIND_INTERVAL}s)'
+                if engine == 'utils.sessions' else engine
+            ))
+            for label, (views, reads, writes) in totals.items():
+                self.stdout.write(
+                    f'  {label:<16} {reads / views:5.2f} reads '
+                    f'{writes / views:5.2f} writes per view'
+                )
@@ -1,6 +1,8 @@
 from django.shortcuts import render
+from utils.page_cache import cache_anonymous_page
 
 
+@cache_anonymous_page(params=())
 def index(request):
     can_manage_issues = (
         request.user.is_authenticated
@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'bag',
     'checkout',
     'profiles',
+    'notifications',
 
     # Other
     'crispy_forms',
@@ -57,7 +58,57 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'icarus_drones.urls'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+# A Redis cache, when configured, is shared by every process; otherwise
+# each process has its own local-memory cache
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    SESSION_CACHE = CATALOGUE_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+else:
+    if 'DEVELOPMENT' in os.environ:
+        SESSION_CACHE = {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'sessions',
+        }
+    else:
+        # Per-process caches would serve stale sessions across workers
+        SESSION_CACHE = {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
+    # Catalogue keys include version tokens every process rereads from
+    # the database each second, so a per-process copy is never more
+    # than about a second behind
+    CATALOGUE_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogue',
+        # Room for a cached entry per product, see products/catalogue.py
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+CACHES = {
+    'default': (
+        SESSION_CACHE if REDIS_URL else {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    ),
+    'sessions': SESSION_CACHE,
+    # Catalogue reads and anonymous pages, see products/catalogue.py
+    'catalogue': CATALOGUE_CACHE,
+}
+
+# Cache-fronted, dirty-checked sessions, see utils/sessions.py
+SESSION_ENGINE = 'utils.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
+# Changed sessions reach the database at most this often; write-behind
+# needs the shared Redis cache, so without it sessions write through
+SESSION_WRITE_BEHIND_INTERVAL = 60 if REDIS_URL else 0
+# Changes to these are always written through, as losing them would lose
+# a shopper's bag, points or in-flight payment
+SESSION_WRITE_THROUGH_KEYS = (
+    'bag', 'loyalty_points', 'checkout_payment_intent',
+)
 
 TEMPLATES = [
     {
@@ -77,6 +128,9 @@ TEMPLATES = [
                 'django.template.context_processors.media',
                 'bag.contexts.bag_contents',
                 'profiles.context_processors.add_can_manage_issues',
+                'profiles.context_processors.wishlist_product_ids',
+                'products.contexts.catalogue',
+                'utils.page_cache.csrf_placeholder',
             ],
             'builtins': [
                 'crispy_forms.templatetags.crispy_forms_tags',
@@ -182,6 +236,17 @@ if USE_AWS:
     AWS_DEFAULT_ACL = 'public-read'
     AWS_S3_FILE_OVERWRITE = False
     AWS_QUERYSTRING_AUTH = False
+    # Probe the bucket when the app starts, not just on check --deploy
+    AWS_S3_STARTUP_PROBE = os.getenv('AWS_S3_STARTUP_PROBE') == 'True'
+
+    # Multipart upload tuning, see custom_storages.TRANSFER_CONFIG
+    AWS_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    AWS_S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+    AWS_S3_MAX_CONCURRENCY = 4
+    # Let staff upload product images straight from the browser to S3;
+    # needs a CORS rule on the bucket allowing POST from SITE_URL
+    AWS_S3_DIRECT_UPLOADS = os.getenv('AWS_S3_DIRECT_UPLOADS') == 'True'
+    AWS_S3_DIRECT_UPLOAD_MAX_SIZE = 100 * 1024 * 1024
 
     # Storage paths
     STATICFILES_LOCATION = 'static'
@@ -198,6 +263,9 @@ else:
     STATIC_URL = '/static/'
     MEDIA_URL = '/media/'
 
+# Product listing configuration
+PRODUCTS_MAX_PER_PAGE = 100
+
 # Stripe Configuration
 FREE_DELIVERY_THRESHOLD = 200
 STANDARD_DELIVERY_PERCENTAGE = 10
@@ -227,6 +295,10 @@ else:
 MAILCHIMP_API_KEY = os.getenv('MAILCHIMP_API_KEY')
 MAILCHIMP_SERVER_PREFIX = os.getenv('MAILCHIMP_SERVER_PREFIX')
 MAILCHIMP_AUDIENCE_ID = os.getenv('MAILCHIMP_AUDIENCE_ID')
+# Point the client at a local fake Mailchimp server, e.g. in tests
+MAILCHIMP_API_URL = os.getenv('MAILCHIMP_API_URL')
+# (connect, read) timeouts in seconds for Mailchimp API calls
+MAILCHIMP_TIMEOUT = (3.05, 10)
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SITE_URL = os.getenv('SITE_URL', 'http://localhost:8000')
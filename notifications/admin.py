@@ -0,0 +1,29 @@
+from django.contrib import admin
+from .models import MailchimpUpdate, OutboundEmail
+
+
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'from_email', 'status',
+                    'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'to')
+    readonly_fields = ('subject', 'body', 'html_body', 'from_email', 'to',
+                       'created_at', 'sent_at', 'last_error')
+    ordering = ('-created_at',)
+
+
+admin.site.register(OutboundEmail, OutboundEmailAdmin)
+
+
+class MailchimpUpdateAdmin(admin.ModelAdmin):
+    list_display = ('email', 'status', 'member_status', 'attempts',
+                    'batch_id', 'created_at', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('email',)
+    readonly_fields = ('subscriber_hash', 'email', 'merge_fields', 'tags',
+                       'member_status', 'revision', 'batch_id',
+                       'created_at', 'updated_at', 'last_error')
+    ordering = ('-updated_at',)
+
+
+admin.site.register(MailchimpUpdate, MailchimpUpdateAdmin)
@@ -0,0 +1,250 @@
+from itertools import groupby
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from utils.mailchimp_utils import (
+    Mailchimp, format_address, get_subscriber_hash
+)
+from .models import MailchimpUpdate
+from .outbox import get_retry_delay
+
+MAX_ATTEMPTS = 6
+
+
+def queue_subscriber_update(email, first_name=None, last_name=None,
+                            address=None, tags=(), remove_tags=(),
+                            member_status=''):
+    """
+    Queue a change to a Mailchimp subscriber for the sync_mailchimp
+    worker. It is merged into any update already pending for the same
+    subscriber. Does nothing when Mailchimp isn't configured.
+    """
+    if not settings.MAILCHIMP_API_KEY:
+        return None
+
+    merge_fields = {}
+    if first_name is not None:
+        merge_fields['FNAME'] = first_name
+    if last_name is not None:
+        merge_fields['LNAME'] = last_name
+    if address:
+        merge_fields['ADDRESS'] = format_address(address)
+    tag_changes = {tag: 'active' for tag in tags}
+    tag_changes.update({tag: 'inactive' for tag in remove_tags})
+    subscriber_hash = get_subscriber_hash(email)
+
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                update = MailchimpUpdate.objects.select_for_update().filter(
+                    subscriber_hash=subscriber_hash,
+                    status=MailchimpUpdate.PENDING,
+                ).first()
+                if update is None:
+                    return MailchimpUpdate.objects.create(
+                        subscriber_hash=subscriber_hash,
+                        email=email,
+                        merge_fields=merge_fields,
+                        tags=tag_changes,
+                        member_status=member_status,
+                    )
+                update.email = email
+                update.merge_fields.update(merge_fields)
+                update.tags.update(tag_changes)
+                if member_status:
+                    update.member_status = member_status
+                update.revision += 1
+                update.save()
+                return update
+        except IntegrityError:
+            # Another request queued this subscriber first; merge into it
+            if attempt:
+                raise
+
+
+def claim_due_updates(batch_size):
+    """
+    Claim a batch of due updates, pushing their next attempt into the
+    future so concurrent workers don't pick up the same rows.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        updates = list(
+            MailchimpUpdate.objects.select_for_update(skip_locked=True)
+            .filter(status=MailchimpUpdate.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        for update in updates:
+            update.attempts += 1
+            update.next_attempt_at = now + get_retry_delay(update.attempts)
+        MailchimpUpdate.objects.bulk_update(
+            updates, ['attempts', 'next_attempt_at']
+        )
+    return updates
+
+
+def build_operations(client, update):
+    """Mailchimp batch operations that apply an update"""
+    member_path = client.get_member_path(update.email)
+    body = {
+        'email_address': update.email,
+        'status_if_new': update.member_status or 'subscribed',
+        'merge_fields': update.merge_fields,
+    }
+    if update.member_status:
+        body['status'] = update.member_status
+    operations = [{
+        'method': 'PUT',
+        'path': member_path,
+        'operation_id': f'{update.pk}-{update.revision}',
+        'body': body,
+    }]
+    if update.tags:
+        operations.append({
+            'method': 'POST',
+            'path': f'{member_path}/tags',
+            'operation_id': f'{update.pk}-{update.revision}-tags',
+            'body': {
+                'tags': [
+                    {'name': name, 'status': status}
+                    for name, status in update.tags.items()
+                ],
+            },
+        })
+    return operations
+
+
+def flush_subscriber_updates(batch_size=500, client=None):
+    """
+    Send one batch of due updates to Mailchimp in a single batch
+    operations request. Returns (sent, failed) counts; (0, 0) means
+    there was nothing to do.
+
+    Sent updates are marked submitted with the batch id, and are only
+    deleted once check_submitted_batches has seen the batch succeed.
+    An update changed while it was being sent stays pending, so its
+    latest state goes out with the next flush.
+    """
+    updates = claim_due_updates(batch_size)
+    if not updates:
+        return 0, 0
+
+    client = client or Mailchimp()
+    operations = []
+    for update in updates:
+        operations.extend(build_operations(client, update))
+
+    try:
+        batch = client.submit_batch(operations)
+    except Exception as e:
+        for update in updates:
+            update.last_error = str(e)
+            if update.attempts >= MAX_ATTEMPTS:
+                update.status = MailchimpUpdate.FAILED
+            update.save(update_fields=['last_error', 'status'])
+        return 0, len(updates)
+
+    updates.sort(key=lambda update: update.revision)
+    for revision, sent in groupby(updates, key=lambda u: u.revision):
+        MailchimpUpdate.objects.filter(
+            pk__in=[update.pk for update in sent],
+            revision=revision,
+            status=MailchimpUpdate.PENDING,
+        ).update(status=MailchimpUpdate.SUBMITTED, batch_id=batch['id'])
+    MailchimpUpdate.objects.filter(
+        pk__in=[update.pk for update in updates],
+        status=MailchimpUpdate.PENDING,
+    ).update(attempts=0, next_attempt_at=timezone.now())
+    return len(updates), 0
+
+
+def requeue_update(update, error):
+    """
+    Put a submitted update whose operations failed back in the queue,
+    with backoff. If newer changes to the subscriber are already
+    pending, the failed ones are merged under them instead.
+    """
+    now = timezone.now()
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                pending = MailchimpUpdate.objects.select_for_update().filter(
+                    subscriber_hash=update.subscriber_hash,
+                    status=MailchimpUpdate.PENDING,
+                ).first()
+                if pending is None or update.attempts >= MAX_ATTEMPTS:
+                    if update.attempts >= MAX_ATTEMPTS:
+                        update.status = MailchimpUpdate.FAILED
+                    else:
+                        update.status = MailchimpUpdate.PENDING
+                    update.batch_id = ''
+                    update.last_error = error
+                    update.next_attempt_at = (
+                        now + get_retry_delay(update.attempts)
+                    )
+                    update.save(update_fields=[
+                        'status', 'batch_id', 'last_error', 'next_attempt_at',
+                    ])
+                    return
+                pending.merge_fields = {
+                    **update.merge_fields, **pending.merge_fields
+                }
+                pending.tags = {**update.tags, **pending.tags}
+                pending.member_status = (
+                    pending.member_status or update.member_status
+                )
+                pending.last_error = error
+                pending.revision += 1
+                pending.save()
+                update.delete()
+                return
+        except IntegrityError:
+            # The subscriber was queued again meanwhile; merge into it
+            if attempt:
+                raise
+
+
+def check_submitted_batches(client=None):
+    """
+    Look up the batches that submitted updates are waiting on. When a
+    batch has finished, its updates are deleted, except those with a
+    failed operation, which are requeued. Returns (synced, requeued)
+    counts.
+    """
+    batch_ids = list(
+        MailchimpUpdate.objects.filter(status=MailchimpUpdate.SUBMITTED)
+        .values_list('batch_id', flat=True).distinct()
+    )
+    if not batch_ids:
+        return 0, 0
+
+    client = client or Mailchimp()
+    synced = requeued = 0
+    for batch_id in batch_ids:
+        try:
+            batch = client.get_batch(batch_id)
+            if batch['status'] != 'finished':
+                continue
+            results = (
+                client.get_batch_results(batch)
+                if batch['errored_operations'] else {}
+            )
+        except Exception:
+            # Mailchimp is unreachable; look again on the next check
+            continue
+
+        errors = {}
+        for operation_id, result in results.items():
+            if not 200 <= result['status_code'] < 300:
+                update_id = int(operation_id.split('-')[0])
+                errors[update_id] = (
+                    f"{result['status_code']} {result.get('response', '')}"
+                )
+        updates = MailchimpUpdate.objects.filter(
+            status=MailchimpUpdate.SUBMITTED, batch_id=batch_id
+        )
+        synced += updates.exclude(pk__in=errors).delete()[0]
+        for update in updates.filter(pk__in=errors):
+            requeue_update(update, errors[update.pk])
+            requeued += 1
+    return synced, requeued
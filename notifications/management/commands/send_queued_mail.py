@@ -0,0 +1,38 @@
+import time
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from notifications.outbox import send_due_emails
+
+
+class Command(BaseCommand):
+    help = (
+        'Send e-mails queued in the outbox in batches over one mail '
+        'server connection, retrying failures with exponential backoff'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Send the e-mails that are currently due, then exit',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=50,
+            help='Number of e-mails sent per connection',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help='Seconds to wait when no e-mails are due',
+        )
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        while True:
+            sent, failed = send_due_emails(
+                options['batch_size'], connection=connection
+            )
+            if sent or failed:
+                self.stdout.write(f'Sent {sent} e-mails, {failed} failed.')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
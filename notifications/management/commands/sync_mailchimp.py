@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand
+from notifications.mailchimp_sync import (
+    check_submitted_batches, flush_subscriber_updates
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Flush queued Mailchimp subscriber updates through the batch '
+        'operations endpoint, then check finished batches and retry '
+        'failed operations with exponential backoff'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Flush the updates that are currently due, then exit',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of subscriber updates sent per batch request',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=30.0,
+            help='Seconds between flushes; updates to the same subscriber '
+                 'within this window are sent once',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            synced, requeued = check_submitted_batches()
+            if synced or requeued:
+                self.stdout.write(
+                    f'Confirmed {synced} subscriber updates, '
+                    f'{requeued} requeued.'
+                )
+            sent, failed = flush_subscriber_updates(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(
+                    f'Sent {sent} subscriber updates, {failed} failed.'
+                )
+            if sent + failed >= options['batch_size']:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
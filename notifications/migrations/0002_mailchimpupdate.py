@@ -0,0 +1,36 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailchimpUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subscriber_hash', models.CharField(max_length=32)),
+                ('email', models.EmailField(max_length=254)),
+                ('merge_fields', models.JSONField(default=dict)),
+                ('tags', models.JSONField(default=dict)),
+                ('member_status', models.CharField(blank=True, default='', max_length=20)),
+                ('revision', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='mailchimpupdate_due_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('subscriber_hash',), name='mailchimpupdate_pending_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_mailchimpupdate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailchimpupdate',
+            name='batch_id',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='mailchimpupdate',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('submitted', 'Submitted'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='mailchimpupdate',
+            index=models.Index(fields=['status', 'batch_id'], name='mailchimpupdate_batch_idx'),
+        ),
+    ]
@@ -0,0 +1,102 @@
+from django.db import models
+from django.utils import timezone
+
+
+class OutboundEmail(models.Model):
+    """
+    An e-mail waiting to be delivered by the send_queued_mail worker.
+    Views and webhook handlers queue mail here instead of talking to
+    the SMTP server during the request.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True, default='')
+    from_email = models.CharField(max_length=254)
+    to = models.JSONField(default=list)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['status', 'next_attempt_at'],
+                name='outboundemail_due_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {", ".join(self.to)}'
+
+
+class MailchimpUpdate(models.Model):
+    """
+    Changes to a Mailchimp subscriber waiting to be flushed by the
+    sync_mailchimp worker. Updates for the same subscriber are merged
+    into one pending row, so only their latest state is sent. Once
+    sent, the row waits in 'submitted' until its Mailchimp batch has
+    finished and been checked for errors.
+    """
+    PENDING = 'pending'
+    SUBMITTED = 'submitted'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SUBMITTED, 'Submitted'),
+        (FAILED, 'Failed'),
+    ]
+
+    subscriber_hash = models.CharField(max_length=32)
+    email = models.EmailField(max_length=254)
+    merge_fields = models.JSONField(default=dict)
+    # Tag names mapped to 'active' or 'inactive'
+    tags = models.JSONField(default=dict)
+    # Set to change the subscriber's status, e.g. to unsubscribe them
+    member_status = models.CharField(max_length=20, blank=True, default='')
+    revision = models.PositiveIntegerField(default=0)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Id of the Mailchimp batch the update was last submitted in
+    batch_id = models.CharField(max_length=50, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['subscriber_hash'],
+                condition=models.Q(status='pending'),
+                name='mailchimpupdate_pending_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['status', 'next_attempt_at'],
+                name='mailchimpupdate_due_idx',
+            ),
+            models.Index(
+                fields=['status', 'batch_id'],
+                name='mailchimpupdate_batch_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.email} ({self.status})'
@@ -0,0 +1,116 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .models import OutboundEmail
+
+MAX_ATTEMPTS = 6
+# Retry delays double from one minute up to six hours
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 6 * 60 * 60
+
+
+def queue_mail(subject, message, recipient_list, from_email=None,
+               html_message=None):
+    """
+    Queue an e-mail for the send_queued_mail worker. Takes the same
+    arguments as django.core.mail.send_mail. The row is written in the
+    caller's transaction, so mail is only sent if that commits.
+    """
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        html_body=html_message or '',
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(recipient_list),
+    )
+
+
+def get_retry_delay(attempts):
+    """Backoff before the next attempt, given the attempts made so far"""
+    return timedelta(
+        seconds=min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    )
+
+
+def claim_due_emails(batch_size):
+    """
+    Claim a batch of due e-mails, pushing their next attempt into the
+    future so concurrent workers don't pick up the same rows.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        for email in emails:
+            email.attempts += 1
+            email.next_attempt_at = now + get_retry_delay(email.attempts)
+        OutboundEmail.objects.bulk_update(
+            emails, ['attempts', 'next_attempt_at']
+        )
+    return emails
+
+
+def build_message(email, connection):
+    """The EmailMultiAlternatives for a queued e-mail"""
+    msg = EmailMultiAlternatives(
+        email.subject,
+        email.body,
+        email.from_email,
+        email.to,
+        connection=connection,
+    )
+    if email.html_body:
+        msg.attach_alternative(email.html_body, 'text/html')
+    return msg
+
+
+def record_failure(email, error):
+    """
+    Keep a failed e-mail pending for its next attempt, or mark it
+    failed once it has used up MAX_ATTEMPTS.
+    """
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboundEmail.FAILED
+    email.save(update_fields=['last_error', 'status'])
+
+
+def send_due_emails(batch_size=50, connection=None):
+    """
+    Send one batch of due e-mails over a single mail server connection.
+    Returns (sent, failed) counts; (0, 0) means there was nothing to do.
+    """
+    emails = claim_due_emails(batch_size)
+    if not emails:
+        return 0, 0
+
+    sent = failed = 0
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        for email in emails:
+            record_failure(email, e)
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            try:
+                build_message(email, connection).send()
+            except Exception as e:
+                record_failure(email, e)
+                failed += 1
+                continue
+            email.status = OutboundEmail.SENT
+            email.sent_at = timezone.now()
+            email.last_error = ''
+            email.save(update_fields=['status', 'sent_at', 'last_error'])
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed
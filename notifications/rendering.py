@@ -0,0 +1,84 @@
+import functools
+import hashlib
+from collections import namedtuple
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.html import strip_tags
+
+EMAIL_ASSET_URL = (
+    "https://dhitchen28963-icarus-drones.s3.us-east-1.amazonaws.com/media/"
+)
+SUPPORT_EMAIL = 'support@icarusdrones.com'
+# Rendered e-mails are cached for a day; the key includes the template
+# version, so a deploy that changes a template never reuses old bodies
+RENDERED_EMAIL_TIMEOUT = 24 * 60 * 60
+
+RenderedEmail = namedtuple('RenderedEmail', ['subject', 'body', 'html_body'])
+
+
+@functools.lru_cache(maxsize=None)
+def get_base_context():
+    """
+    Context shared by every e-mail: the support address and the images
+    used by the e-mail layout. Built once per process.
+    """
+    return {
+        'contact_email': SUPPORT_EMAIL,
+        'background_image_url': f'{EMAIL_ASSET_URL}homepage_background.webp',
+        'facebook_icon_url': f'{EMAIL_ASSET_URL}facebook.png',
+        'twitter_icon_url': f'{EMAIL_ASSET_URL}twitter.png',
+        'instagram_icon_url': f'{EMAIL_ASSET_URL}instagram.png',
+    }
+
+
+def build_context(**kwargs):
+    """The base e-mail context overlaid with the given values"""
+    return {**get_base_context(), **kwargs}
+
+
+@functools.lru_cache(maxsize=None)
+def get_template_version(*template_names):
+    """Fingerprint of the source of a set of templates"""
+    digest = hashlib.sha256()
+    for name in template_names:
+        if name:
+            digest.update(get_template(name).template.source.encode())
+    return digest.hexdigest()[:12]
+
+
+def render_email(html_template, context, text_template=None,
+                 subject_template=None, cache_key=None):
+    """
+    Render an e-mail and return a RenderedEmail. The plain text body
+    comes from `text_template`, or is the HTML body with its tags
+    stripped; `subject` is None without a `subject_template`.
+
+    `context` may be a callable returning the context, so it is only
+    built when rendering is needed. Given a `cache_key` that identifies
+    everything the e-mail depends on, the rendered e-mail is cached per
+    template version and rendering the same e-mail again is a cache hit.
+    """
+    if cache_key is not None:
+        version = get_template_version(
+            html_template, text_template, subject_template
+        )
+        cache_key = f'email:{version}:{cache_key}'
+        rendered = cache.get(cache_key)
+        if rendered is not None:
+            return RenderedEmail(*rendered)
+
+    if callable(context):
+        context = context()
+    html_body = get_template(html_template).render(context)
+    if text_template:
+        body = get_template(text_template).render(context)
+    else:
+        body = strip_tags(html_body)
+    subject = None
+    if subject_template:
+        subject = get_template(subject_template).render(context).strip()
+
+    rendered = RenderedEmail(subject, body, html_body)
+    if cache_key is not None:
+        cache.set(cache_key, tuple(rendered), RENDERED_EMAIL_TIMEOUT)
+    return rendered
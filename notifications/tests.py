@@ -0,0 +1,268 @@
+import io
+import json
+import tarfile
+from unittest import mock
+from django.core import mail
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from utils.mailchimp_utils import Mailchimp, get_session
+from . import mailchimp_sync
+from .mailchimp_sync import (
+    check_submitted_batches, flush_subscriber_updates,
+    queue_subscriber_update,
+)
+from .models import MailchimpUpdate, OutboundEmail
+from .outbox import MAX_ATTEMPTS, queue_mail, send_due_emails
+
+
+class OutboxTests(TestCase):
+
+    def queue(self, number=1):
+        return [
+            queue_mail(
+                f'Order {n}', 'Thanks for your order',
+                [f'pilot{n}@example.com'],
+                html_message='<p>Thanks for your order</p>',
+            )
+            for n in range(number)
+        ]
+
+    def test_mail_is_only_queued_if_the_transaction_commits(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.queue()
+                raise RuntimeError('Checkout failed')
+
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_due_mail_is_sent_over_one_connection(self):
+        self.queue(3)
+        with mock.patch(
+            'django.core.mail.backends.locmem.EmailBackend.open'
+        ) as open_connection:
+            self.assertEqual(send_due_emails(), (3, 0))
+
+        open_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            mail.outbox[0].alternatives[0][0], '<p>Thanks for your order</p>'
+        )
+        self.assertEqual(
+            set(OutboundEmail.objects.values_list('status', flat=True)),
+            {OutboundEmail.SENT},
+        )
+        self.assertEqual(send_due_emails(), (0, 0))
+
+    def test_failed_mail_is_retried_with_backoff(self):
+        sent, failing = self.queue(2)
+        real_send = mail.EmailMultiAlternatives.send
+
+        def send(message):
+            if message.to == failing.to:
+                raise ConnectionError('Mailbox unavailable')
+            return real_send(message)
+
+        with mock.patch.object(mail.EmailMultiAlternatives, 'send', send):
+            self.assertEqual(send_due_emails(), (1, 1))
+
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, OutboundEmail.PENDING)
+        self.assertEqual(failing.attempts, 1)
+        self.assertEqual(failing.last_error, 'Mailbox unavailable')
+        self.assertGreater(failing.next_attempt_at, timezone.now())
+        self.assertEqual(send_due_emails(), (0, 0))
+
+        OutboundEmail.objects.filter(pk=failing.pk).update(
+            next_attempt_at=timezone.now()
+        )
+        self.assertEqual(send_due_emails(), (1, 0))
+
+    def test_unreachable_server_fails_the_whole_batch(self):
+        self.queue(2)
+        with mock.patch(
+            'django.core.mail.backends.locmem.EmailBackend.open',
+            side_effect=ConnectionError('Connection refused'),
+        ):
+            self.assertEqual(send_due_emails(), (0, 2))
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            set(OutboundEmail.objects.values_list('attempts', flat=True)),
+            {1},
+        )
+
+    def test_mail_fails_after_the_last_attempt(self):
+        email, = self.queue()
+        OutboundEmail.objects.update(attempts=MAX_ATTEMPTS - 1)
+        with mock.patch.object(
+            mail.EmailMultiAlternatives, 'send',
+            side_effect=ConnectionError('Mailbox unavailable'),
+        ):
+            send_due_emails()
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboundEmail.FAILED)
+
+
+def make_results_archive(results):
+    """A gzipped tarball of batch results, as Mailchimp serves them"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        content = json.dumps(results).encode()
+        member = tarfile.TarInfo('results/1.json')
+        member.size = len(content)
+        archive.addfile(member, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+@override_settings(
+    MAILCHIMP_API_KEY='key', MAILCHIMP_SERVER_PREFIX='us1',
+    MAILCHIMP_AUDIENCE_ID='audience',
+)
+class MailchimpSyncTests(TestCase):
+
+    def setUp(self):
+        self.client = mock.Mock(wraps=Mailchimp())
+        self.client.submit_batch = mock.Mock(return_value={'id': 'batch-1'})
+        self.client.get_batch_results = mock.Mock(return_value={})
+
+    def finish_batch(self, errored=0):
+        self.client.get_batch = mock.Mock(return_value={
+            'id': 'batch-1',
+            'status': 'finished',
+            'errored_operations': errored,
+            'response_body_url': 'https://example.com/results.tar.gz',
+        })
+
+    def submit(self, *emails):
+        for email in emails:
+            queue_subscriber_update(email, first_name='Ada', tags=['pilot'])
+        return flush_subscriber_updates(client=self.client)
+
+    def test_sent_updates_wait_for_their_batch(self):
+        self.assertEqual(self.submit('ada@example.com'), (1, 0))
+
+        update = MailchimpUpdate.objects.get()
+        self.assertEqual(update.status, MailchimpUpdate.SUBMITTED)
+        self.assertEqual(update.batch_id, 'batch-1')
+        self.assertEqual(flush_subscriber_updates(client=self.client), (0, 0))
+
+        self.client.get_batch = mock.Mock(return_value={
+            'id': 'batch-1', 'status': 'started', 'errored_operations': 0,
+        })
+        self.assertEqual(check_submitted_batches(self.client), (0, 0))
+        self.client.get_batch.assert_called_once_with('batch-1')
+        self.assertTrue(MailchimpUpdate.objects.exists())
+
+    def test_successful_batch_deletes_its_updates(self):
+        self.submit('ada@example.com', 'bob@example.com')
+        self.finish_batch()
+
+        self.assertEqual(check_submitted_batches(self.client), (2, 0))
+        self.client.get_batch_results.assert_not_called()
+        self.assertFalse(MailchimpUpdate.objects.exists())
+
+    def test_failed_operations_are_requeued_with_backoff(self):
+        self.submit('ada@example.com', 'bob@example.com')
+        ada, bob = MailchimpUpdate.objects.order_by('email')
+        self.finish_batch(errored=1)
+        self.client.get_batch_results.return_value = {
+            f'{ada.pk}-{ada.revision}': {
+                'status_code': 200, 'response': '{}',
+            },
+            f'{bob.pk}-{bob.revision}-tags': {
+                'status_code': 400, 'response': '{"title": "Invalid tag"}',
+            },
+        }
+
+        self.assertEqual(check_submitted_batches(self.client), (1, 1))
+
+        bob.refresh_from_db()
+        self.assertFalse(MailchimpUpdate.objects.filter(pk=ada.pk).exists())
+        self.assertEqual(bob.status, MailchimpUpdate.PENDING)
+        self.assertEqual(bob.batch_id, '')
+        self.assertEqual(bob.last_error, '400 {"title": "Invalid tag"}')
+        self.assertGreater(bob.next_attempt_at, timezone.now())
+        self.assertEqual(flush_subscriber_updates(client=self.client), (0, 0))
+
+    def test_failed_update_is_merged_into_newer_changes(self):
+        self.submit('ada@example.com')
+        failed = MailchimpUpdate.objects.get()
+        queue_subscriber_update('ada@example.com', last_name='Lovelace')
+        self.finish_batch(errored=1)
+        self.client.get_batch_results.return_value = {
+            f'{failed.pk}-{failed.revision}': {
+                'status_code': 500, 'response': '',
+            },
+        }
+
+        self.assertEqual(check_submitted_batches(self.client), (0, 1))
+
+        update = MailchimpUpdate.objects.get()
+        self.assertEqual(update.status, MailchimpUpdate.PENDING)
+        self.assertEqual(
+            update.merge_fields, {'FNAME': 'Ada', 'LNAME': 'Lovelace'}
+        )
+        self.assertEqual(update.tags, {'pilot': 'active'})
+
+    def test_update_fails_after_the_last_attempt(self):
+        self.submit('ada@example.com')
+        MailchimpUpdate.objects.update(attempts=mailchimp_sync.MAX_ATTEMPTS)
+        update = MailchimpUpdate.objects.get()
+        self.finish_batch(errored=1)
+        self.client.get_batch_results.return_value = {
+            f'{update.pk}-{update.revision}': {
+                'status_code': 400, 'response': '',
+            },
+        }
+
+        check_submitted_batches(self.client)
+
+        update.refresh_from_db()
+        self.assertEqual(update.status, MailchimpUpdate.FAILED)
+
+    def test_unreachable_batch_is_checked_again_later(self):
+        self.submit('ada@example.com')
+        self.client.get_batch = mock.Mock(
+            side_effect=ConnectionError('Connection refused')
+        )
+
+        self.assertEqual(check_submitted_batches(self.client), (0, 0))
+        self.assertEqual(
+            MailchimpUpdate.objects.get().status, MailchimpUpdate.SUBMITTED
+        )
+
+    def test_update_changed_while_sending_stays_pending(self):
+        def submit_batch(operations):
+            queue_subscriber_update('ada@example.com', last_name='Lovelace')
+            return {'id': 'batch-1'}
+
+        queue_subscriber_update('ada@example.com', first_name='Ada')
+        self.client.submit_batch = mock.Mock(side_effect=submit_batch)
+        flush_subscriber_updates(client=self.client)
+
+        update = MailchimpUpdate.objects.get()
+        self.assertEqual(update.status, MailchimpUpdate.PENDING)
+        self.assertEqual(update.attempts, 0)
+
+    def test_batch_results_are_read_from_the_archive(self):
+        results = [
+            {'operation_id': '1-0', 'status_code': 200, 'response': '{}'},
+            {'operation_id': '2-0', 'status_code': 404, 'response': '{}'},
+        ]
+        response = mock.Mock(content=make_results_archive(results))
+        with mock.patch('utils.mailchimp_utils.get_session') as get_session:
+            get_session.return_value.get.return_value = response
+            batch_results = Mailchimp().get_batch_results({
+                'response_body_url': 'https://example.com/results.tar.gz',
+            })
+
+        self.assertEqual(batch_results['2-0']['status_code'], 404)
+        self.assertEqual(set(batch_results), {'1-0', '2-0'})
+
+    def test_batch_submissions_are_not_retried_by_the_session(self):
+        retry = get_session().get_adapter('https://').max_retries
+
+        self.assertTrue(retry.is_retry('GET', 503))
+        self.assertFalse(retry.is_retry('POST', 503))
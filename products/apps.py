@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ProductsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'products'
+
+    def ready(self):
+        import products.signals  # noqa: F401
+
+        # Fail at startup, rather than on the first upload, if the
+        # media bucket can't be reached
+        if getattr(settings, 'AWS_S3_STARTUP_PROBE', False):
+            from custom_storages import probe_s3
+            probe_s3()
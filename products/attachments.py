@@ -0,0 +1,113 @@
+import threading
+from decimal import Decimal
+from .constants import ATTACHMENTS
+from .catalogue import get_attachment_version
+
+# Ids of attachments that only exist in the Attachment table start here,
+# clear of the ids declared in products.constants.ATTACHMENTS
+DB_ATTACHMENT_ID_OFFSET = 1000
+
+
+class AttachmentCatalogue:
+    """
+    SKU-keyed index of the attachments offered with custom drones.
+
+    Built on first use from products.constants.ATTACHMENTS overlaid with
+    the rows of the Attachment table, then reused until an Attachment is
+    saved or deleted, which bumps the attachment version and makes the
+    next lookup rebuild the index.
+
+    Each attachment has a small, stable integer id, which the session
+    bag stores instead of the SKU.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._by_sku = {}
+        self._by_id = {}
+
+    def _load(self):
+        from .models import Attachment
+
+        by_sku = {}
+        for attachment in ATTACHMENTS:
+            by_sku[attachment['sku']] = {
+                'id': attachment['id'],
+                'sku': attachment['sku'],
+                'name': attachment['name'],
+                'description': attachment['description'],
+                'price': Decimal(str(attachment['price'])),
+            }
+        for attachment in Attachment.objects.all():
+            # Rows overriding a built-in attachment keep its id
+            default = by_sku.get(attachment.sku)
+            by_sku[attachment.sku] = {
+                'id': (
+                    default['id'] if default
+                    else DB_ATTACHMENT_ID_OFFSET + attachment.pk
+                ),
+                'sku': attachment.sku,
+                'name': attachment.name,
+                'description': attachment.description,
+                'price': attachment.price,
+            }
+        return by_sku
+
+    def _index(self):
+        version = get_attachment_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    by_sku = self._load()
+                    self._by_id = {
+                        attachment['id']: attachment
+                        for attachment in by_sku.values()
+                    }
+                    self._by_sku = by_sku
+                    self._version = version
+        return self._by_sku
+
+    def invalidate(self):
+        """Drop the index so the next lookup reloads it"""
+        self._version = None
+
+    def all(self):
+        """Return every attachment, in catalogue order"""
+        return list(self._index().values())
+
+    def get(self, sku):
+        """Return the attachment for a SKU, or None"""
+        return self._index().get(sku)
+
+    def get_id(self, sku):
+        """Return the id of an attachment, or None if it is unknown"""
+        attachment = self.get(sku)
+        return attachment['id'] if attachment else None
+
+    def get_sku(self, attachment_id):
+        """Return the SKU of an attachment id, or None if it is unknown"""
+        self._index()
+        attachment = self._by_id.get(attachment_id)
+        return attachment['sku'] if attachment else None
+
+    def get_name(self, sku):
+        """Return the human-readable name of an attachment"""
+        attachment = self.get(sku)
+        return attachment['name'] if attachment else sku
+
+    def get_price(self, sku):
+        """Return the price of an attachment, or 0 if it is unknown"""
+        attachment = self.get(sku)
+        return attachment['price'] if attachment else Decimal(0)
+
+    def get_names(self, skus):
+        """Return the human-readable names for a list of SKUs"""
+        return [self.get_name(sku) for sku in skus]
+
+    def get_total_price(self, skus):
+        """Return the combined price of a list of attachment SKUs"""
+        return sum((self.get_price(sku) for sku in skus), Decimal(0))
+
+
+attachment_catalogue = AttachmentCatalogue()
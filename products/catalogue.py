@@ -0,0 +1,211 @@
+import hashlib
+import threading
+import time
+import uuid
+from django.core.cache import caches
+
+PRICE_VERSION_KEY = 'products:price_version'
+ATTACHMENT_VERSION_KEY = 'products:attachment_version'
+CATALOGUE_VERSION_KEY = 'products:catalogue_version'
+# Catalogue entries are cached in the 'catalogue' cache, Redis or each
+# process's local memory. They are invalidated by bumping the version,
+# so this only bounds how long stale entries take up room
+CATALOGUE_CACHE_ALIAS = 'catalogue'
+CATALOGUE_CACHE_TIMEOUT = 15 * 60
+# How often, in seconds, a process rereads the version tokens
+VERSION_CHECK_INTERVAL = 1
+
+
+class VersionTokens:
+    """
+    The current version tokens, stored in CatalogueVersion rows so that
+    every process sees the same token. Each process reads all of them
+    in one query, at most once per VERSION_CHECK_INTERVAL, and sees its
+    own bumps at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._read_at = None
+
+    def _refresh(self):
+        from .models import CatalogueVersion
+
+        now = time.monotonic()
+        if (
+            self._read_at is None
+            or now - self._read_at >= VERSION_CHECK_INTERVAL
+        ):
+            with self._lock:
+                if (
+                    self._read_at is None
+                    or now - self._read_at >= VERSION_CHECK_INTERVAL
+                ):
+                    self._tokens = dict(
+                        CatalogueVersion.objects.values_list('key', 'token')
+                    )
+                    self._read_at = now
+        return self._tokens
+
+    def get(self, key):
+        """Return the token for a version key, creating it on first use"""
+        from .models import CatalogueVersion
+
+        tokens = self._refresh()
+        token = tokens.get(key)
+        if token is None:
+            token = CatalogueVersion.objects.get_or_create(
+                key=key, defaults={'token': uuid.uuid4().hex}
+            )[0].token
+            tokens[key] = token
+        return token
+
+    def bump(self, key):
+        """Replace the token for a version key"""
+        from .models import CatalogueVersion
+
+        token = uuid.uuid4().hex
+        CatalogueVersion.objects.update_or_create(
+            key=key, defaults={'token': token}
+        )
+        self._refresh()[key] = token
+
+
+_versions = VersionTokens()
+
+
+def get_price_version():
+    """
+    Return an opaque token that changes whenever product prices may have
+    changed. Anything computed from product prices can store this token
+    and treat itself as stale once it no longer matches.
+    """
+    return _versions.get(PRICE_VERSION_KEY)
+
+
+def bump_price_version():
+    """Invalidate everything computed against the current prices"""
+    _versions.bump(PRICE_VERSION_KEY)
+
+
+def get_attachment_version():
+    """Return an opaque token that changes whenever attachments change"""
+    return _versions.get(ATTACHMENT_VERSION_KEY)
+
+
+def bump_attachment_version():
+    """Invalidate every process's attachment catalogue"""
+    _versions.bump(ATTACHMENT_VERSION_KEY)
+
+
+def get_catalogue_version():
+    """
+    Return an opaque token that changes whenever a product, category,
+    attachment or review changes. Every catalogue cache key includes it.
+    """
+    return _versions.get(CATALOGUE_VERSION_KEY)
+
+
+def bump_catalogue_version():
+    """Invalidate every cached catalogue read"""
+    _versions.bump(CATALOGUE_VERSION_KEY)
+
+
+def _catalogue_key(kind, *parts, version=None):
+    version = version or get_catalogue_version()
+    return f'catalogue:{version}:{kind}:' + ':'.join(str(p) for p in parts)
+
+
+def get_catalogue_cache():
+    """The cache catalogue reads and pages are stored in"""
+    return caches[CATALOGUE_CACHE_ALIAS]
+
+
+def _get_or_load(key, load):
+    cache = get_catalogue_cache()
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, CATALOGUE_CACHE_TIMEOUT)
+    return value
+
+
+def get_products(product_ids):
+    """
+    Return {pk: product} for the given ids, with their categories, from
+    the cache where possible and otherwise in one query. Ids that don't
+    exist are left out.
+    """
+    from .models import Product
+
+    cache = get_catalogue_cache()
+    version = get_catalogue_version()
+    keys = {
+        _catalogue_key('product', pk, version=version): pk
+        for pk in {int(pk) for pk in product_ids}
+    }
+    cached = cache.get_many(keys)
+    products = {keys[key]: product for key, product in cached.items()}
+
+    missing = [pk for key, pk in keys.items() if key not in cached]
+    if missing:
+        loaded = Product.objects.select_related('category').in_bulk(missing)
+        cache.set_many(
+            {
+                _catalogue_key('product', pk, version=version): product
+                for pk, product in loaded.items()
+            },
+            CATALOGUE_CACHE_TIMEOUT,
+        )
+        products.update(loaded)
+    return products
+
+
+def get_product(product_id):
+    """Return a product with its category, or None if it doesn't exist"""
+    return get_products([product_id]).get(int(product_id))
+
+
+def get_category_products(category_name):
+    """Products in a category, by id"""
+    from .models import Product
+
+    return _get_or_load(
+        _catalogue_key('category', category_name),
+        lambda: list(
+            Product.objects.select_related('category')
+            .filter(category__name=category_name).order_by('id')
+        ),
+    )
+
+
+def get_categories(names):
+    """Categories with any of the given names, in database order"""
+    from .models import Category
+
+    categories = _get_or_load(
+        _catalogue_key('categories'),
+        lambda: list(Category.objects.order_by('id')),
+    )
+    return [category for category in categories if category.name in names]
+
+
+def get_listing_ids(queryset, *params):
+    """
+    Return the ordered product ids of a listing query, cached under the
+    request parameters that produced it.
+    """
+    digest = hashlib.sha256(repr(params).encode()).hexdigest()
+    return _get_or_load(
+        _catalogue_key('listing', digest),
+        lambda: list(queryset.values_list('id', flat=True)),
+    )
+
+
+def get_review_page(product, reviews, stars, number):
+    """The reviews shown on one page of a product's reviews"""
+    return _get_or_load(
+        _catalogue_key('reviews', product.pk, stars, number),
+        lambda: list(reviews),
+    )
@@ -0,0 +1,84 @@
+import threading
+from .catalogue import get_catalogue_version
+
+CUSTOM_DRONE_CATEGORY = 'custom_drones'
+
+
+def get_base_model(sku):
+    """
+    The drone model a custom drone SKU belongs to, e.g. 'falcon-x' for
+    'falcon-x-10001-black', or None without a SKU.
+    """
+    if not sku:
+        return None
+    return sku[:15].rstrip('0123456789-') or None
+
+
+class DroneConfigurator:
+    """
+    Index of the custom drones offered on the configurator page.
+
+    Maps each (base model, colour) pair to its product, with the price
+    and image, and lists the models in catalogue order. Built in one
+    query on first use and reused until the catalogue version changes,
+    so rendering the page and adding a custom drone to the bag are
+    dictionary lookups.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = ([], {})
+
+    def _load(self):
+        from .models import Product
+
+        drones = Product.objects.filter(
+            category__name=CUSTOM_DRONE_CATEGORY
+        ).order_by('id').values('id', 'sku', 'name', 'color', 'price', 'image')
+
+        models = {}
+        by_option = {}
+        for drone in drones:
+            base_model = get_base_model(drone['sku'])
+            if not base_model:
+                continue
+            model = models.setdefault(base_model, {
+                'name': drone['name'].split(' - ')[0],
+                'value': base_model,
+                'colors': [],
+            })
+            option = {
+                'product_id': drone['id'],
+                'sku': drone['sku'],
+                'drone_type': model['name'],
+                'color': drone['color'],
+                'price': drone['price'],
+                'image': drone['image'],
+            }
+            model['colors'].append(option)
+            # The first product wins if a model repeats a colour
+            by_option.setdefault(
+                (base_model, (drone['color'] or '').lower()), option
+            )
+        return list(models.values()), by_option
+
+    def _index(self):
+        version = get_catalogue_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._data = self._load()
+                    self._version = version
+        return self._data
+
+    def models(self):
+        """Drone models with their colour options, in catalogue order"""
+        return self._index()[0]
+
+    def get(self, base_model, color):
+        """Return the option for a model and colour, or None"""
+        return self._index()[1].get((base_model, (color or '').lower()))
+
+
+drone_configurator = DroneConfigurator()
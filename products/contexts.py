@@ -0,0 +1,12 @@
+from .catalogue import CATALOGUE_CACHE_TIMEOUT, get_catalogue_version
+
+
+def catalogue(request):
+    """
+    Expose the catalogue version for template fragment cache keys. It
+    is only looked up on pages that render a cached fragment.
+    """
+    return {
+        'catalogue_version': get_catalogue_version,
+        'catalogue_cache_timeout': CATALOGUE_CACHE_TIMEOUT,
+    }
@@ -0,0 +1,91 @@
+import posixpath
+from io import BytesIO
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+# Widths, in pixels, of the resized copies made of each product image
+DERIVATIVE_WIDTHS = (320, 640, 1024)
+# (extension, Pillow format, MIME type, save options), best first. AVIF
+# copies are only made if Pillow can write AVIF, which the pinned 10.4
+# can't without the pillow-avif-plugin package
+DERIVATIVE_FORMATS = (
+    ('avif', 'AVIF', 'image/avif', {'quality': 55}),
+    ('webp', 'WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+)
+
+
+def get_derivative_formats():
+    """
+    The derivative formats this Pillow build can write. AVIF is skipped
+    when Pillow has no AVIF encoder.
+    """
+    Image.init()
+    return [
+        derivative_format for derivative_format in DERIVATIVE_FORMATS
+        if derivative_format[1] in Image.SAVE
+    ]
+
+
+def get_derivative_widths(image_width):
+    """Derivative widths for an image, never wider than the original"""
+    return sorted({min(width, image_width) for width in DERIVATIVE_WIDTHS})
+
+
+def generate_image_derivatives(storage, name, fileobj):
+    """
+    Store resized copies of an uploaded image next to it in `storage`.
+
+    Returns a dict mapping each format's extension to a dict of width to
+    stored name, as kept in Product.image_derivatives.
+    """
+    fileobj.seek(0)
+    with Image.open(fileobj) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = (
+                'A' in image.getbands() or 'transparency' in image.info
+            )
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        stem = posixpath.splitext(name)[0]
+        derivatives = {}
+        for width in get_derivative_widths(image.width):
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+            for extension, image_format, _, options in (
+                get_derivative_formats()
+            ):
+                buffer = BytesIO()
+                resized.save(buffer, image_format, **options)
+                derivatives.setdefault(extension, {})[str(width)] = (
+                    storage.save(
+                        f'{stem}-{width}w.{extension}',
+                        ContentFile(buffer.getvalue()),
+                    )
+                )
+    return derivatives
+
+
+def store_product_image(storage, image):
+    """
+    Save an uploaded product image and its resized copies in `storage`.
+    Returns (name, derivatives). If the copies can't be made, the saved
+    image is deleted again and the error raised.
+    """
+    name = storage.save(image.name, image)
+    try:
+        derivatives = generate_image_derivatives(storage, name, image)
+    except Exception:
+        storage.delete(name)
+        raise
+    return name, derivatives
+
+
+def delete_image_derivatives(storage, derivatives):
+    """Delete stored derivatives, ignoring any that are already gone"""
+    for names in (derivatives or {}).values():
+        for name in names.values():
+            try:
+                storage.delete(name)
+            except Exception:
+                pass
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from products.catalogue import bump_catalogue_version
+from products.images import (
+    delete_image_derivatives, generate_image_derivatives
+)
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the resized WebP copies of product images, plus AVIF '
+        'copies if Pillow can write AVIF, e.g. for images uploaded before '
+        'derivatives existed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate derivatives for products that already have them',
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(
+            image__in=['', 'noimage.webp']
+        ).exclude(image=None)
+        if not options['force']:
+            products = products.filter(image_derivatives={})
+
+        count = failed = 0
+        for product in products.iterator():
+            storage = product.image.storage
+            try:
+                with product.image.open('rb') as image:
+                    derivatives = generate_image_derivatives(
+                        storage, product.image.name, image
+                    )
+            except Exception as e:
+                self.stderr.write(f'{product.name}: {e}')
+                failed += 1
+                continue
+            delete_image_derivatives(storage, product.image_derivatives)
+            Product.objects.filter(pk=product.pk).update(
+                image_derivatives=derivatives
+            )
+            count += 1
+        if count:
+            # The updates bypass Product.save and its signals
+            bump_catalogue_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {count} products, {failed} failed.'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from products.models import Product
+from products.search import index_product
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the SQLite product search index, e.g. after loading '
+        'fixtures, which bypasses Product.save'
+    )
+
+    def handle(self, *args, **options):
+        count = 0
+        for product in Product.objects.iterator():
+            index_product(product)
+            count += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {count} products.')
+        )
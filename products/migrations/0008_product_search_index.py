@@ -0,0 +1,65 @@
+from django.db import migrations
+
+from products.search import (
+    SEARCH_FIELDS,
+    SEARCH_VECTOR_COLUMN,
+    SQLITE_FTS_TABLE,
+    postgres_search_vector_sql,
+)
+
+
+def create_search_index(apps, schema_editor):
+    """
+    PostgreSQL: a generated, weighted tsvector column with a GIN index.
+    SQLite: an FTS5 table keyed by product id, populated here and kept
+    current by Product.save.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f'ALTER TABLE products_product ADD COLUMN {SEARCH_VECTOR_COLUMN} '
+            f'tsvector GENERATED ALWAYS AS ({postgres_search_vector_sql()}) '
+            f'STORED'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX products_product_search_gin '
+            f'ON products_product USING GIN ({SEARCH_VECTOR_COLUMN})'
+        )
+    elif vendor == 'sqlite':
+        columns = ', '.join(SEARCH_FIELDS)
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} '
+            f'USING fts5({columns}, tokenize="porter unicode61", '
+            f'prefix="2 3")'
+        )
+        schema_editor.execute(
+            f'INSERT INTO {SQLITE_FTS_TABLE} (rowid, {columns}) '
+            f'SELECT id, '
+            + ', '.join(f"coalesce({field}, '')" for field in SEARCH_FIELDS)
+            + ' FROM products_product'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS products_product_search_gin'
+        )
+        schema_editor.execute(
+            f'ALTER TABLE products_product '
+            f'DROP COLUMN IF EXISTS {SEARCH_VECTOR_COLUMN}'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_alter_product_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.1.1 on 2026-10-18 07:39
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_review_aggregates(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductReview = apps.get_model('products', 'ProductReview')
+    rows = ProductReview.objects.values('product_id', 'rating').annotate(
+        n=Count('id')
+    )
+    histograms = {}
+    for row in rows:
+        histogram = histograms.setdefault(row['product_id'], {})
+        histogram[row['rating']] = row['n']
+    for product_id, histogram in histograms.items():
+        count = sum(histogram.values())
+        total = sum(rating * n for rating, n in histogram.items())
+        Product.objects.filter(pk=product_id).update(
+            review_count=count,
+            review_total=total,
+            review_average=round(total / count, 2),
+            **{
+                f'review_count_{rating}': n
+                for rating, n in histogram.items()
+            },
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_product_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='review_average',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=3, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'review_average', 'id'], name='product_category_reviews_idx'),
+        ),
+        migrations.RunPython(
+            backfill_review_aggregates, migrations.RunPython.noop
+        ),
+    ]
@@ -1,13 +1,23 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 from custom_storages import MediaStorage
+from .images import DERIVATIVE_FORMATS
+from .search import index_product
+
+# Kept current by single UPDATE statements in reviews.py
+REVIEW_AGGREGATE_FIELDS = (
+    'review_average', 'review_count', 'review_total', 'review_count_1',
+    'review_count_2', 'review_count_3', 'review_count_4', 'review_count_5',
+)
 
 
 class Category(models.Model):
     class Meta:
         verbose_name_plural = 'Categories'
 
-    name = models.CharField(max_length=254)
+    name = models.CharField(max_length=254, db_index=True)
     friendly_name = models.CharField(
         max_length=254, null=True, blank=True
     )
@@ -20,6 +30,28 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    class Meta:
+        # Back the listing's category filter combined with each sort,
+        # with the id tiebreaker used for stable pagination
+        indexes = [
+            models.Index(
+                fields=['category', 'price', 'id'],
+                name='product_category_price_idx',
+            ),
+            models.Index(
+                fields=['category', 'rating', 'id'],
+                name='product_category_rating_idx',
+            ),
+            models.Index(
+                F('category'), Lower('name'), F('id'),
+                name='product_category_lname_idx',
+            ),
+            models.Index(
+                fields=['category', 'review_average', 'id'],
+                name='product_category_reviews_idx',
+            ),
+        ]
+
     category = models.ForeignKey(
         'Category', null=True, blank=True,
         on_delete=models.SET_NULL
@@ -39,6 +71,10 @@ class Product(models.Model):
         blank=True,
         storage=MediaStorage(),
     )
+    # Resized copies of the image by format and width, see images.py
+    image_derivatives = models.JSONField(
+        default=dict, blank=True, editable=False
+    )
     color = models.CharField(max_length=50, null=True, blank=True)
     rotors = models.IntegerField(null=True, blank=True)
     speed = models.CharField(max_length=50, null=True, blank=True)
@@ -97,8 +133,68 @@ class Product(models.Model):
     )
     accessories_included = models.TextField(null=True, blank=True)
 
+    # Review aggregates, kept current by the ProductReview signals
+    review_average = models.DecimalField(
+        max_digits=3, decimal_places=2,
+        null=True, blank=True, editable=False
+    )
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    review_total = models.PositiveIntegerField(default=0, editable=False)
+    review_count_1 = models.PositiveIntegerField(default=0, editable=False)
+    review_count_2 = models.PositiveIntegerField(default=0, editable=False)
+    review_count_3 = models.PositiveIntegerField(default=0, editable=False)
+    review_count_4 = models.PositiveIntegerField(default=0, editable=False)
+    review_count_5 = models.PositiveIntegerField(default=0, editable=False)
+
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
+        index_product(self)
+
+    def get_review_count(self, stars=None):
+        """Number of reviews, optionally only those with `stars`"""
+        if stars is None:
+            return self.review_count
+        return getattr(self, f'review_count_{stars}')
+
+    def get_image_sources(self):
+        """
+        A <source> type and srcset for each format the image has
+        resized copies in, best format first.
+        """
+        storage = self._meta.get_field('image').storage
+        sources = []
+        for extension, _, mime_type, _ in DERIVATIVE_FORMATS:
+            widths = self.image_derivatives.get(extension)
+            if widths:
+                sources.append({
+                    'type': mime_type,
+                    'srcset': ', '.join(
+                        f'{storage.url(name)} {width}w'
+                        for width, name in sorted(
+                            widths.items(), key=lambda item: int(item[0])
+                        )
+                    ),
+                })
+        return sources
+
+    def get_review_histogram(self):
+        """Review counts per star rating, highest rating first"""
+        return [
+            {'stars': stars, 'count': self.get_review_count(stars)}
+            for stars in range(5, 0, -1)
+        ]
+
+
+class CatalogueVersion(models.Model):
+    """
+    Current token of a catalogue version, see catalogue.py. Kept in the
+    database so that every process agrees on it.
+    """
+    key = models.CharField(max_length=50, primary_key=True)
+    token = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f'{self.key}: {self.token}'
 
 
 class Attachment(models.Model):
@@ -0,0 +1,170 @@
+import json
+from decimal import Decimal
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+# Sort keys the product listing can seek on, besides the id tiebreaker
+KEYSET_SORT_FIELDS = (
+    'id', 'lower_name', 'price', 'rating', 'review_average', 'category__name',
+    'search_rank',
+)
+CURSOR_SALT = 'products.pagination.cursor'
+
+
+def clamp_per_page(per_page, default=20):
+    """
+    Parse a per_page query value and cap it at PRODUCTS_MAX_PER_PAGE.
+    The legacy `all` value is treated as the cap.
+    """
+    maximum = settings.PRODUCTS_MAX_PER_PAGE
+    if per_page == 'all':
+        return maximum
+    try:
+        per_page = int(per_page)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(per_page, maximum))
+
+
+def approximate_count(queryset):
+    """
+    Estimate the number of rows in a queryset. On PostgreSQL this reads
+    the planner's row estimate instead of running COUNT(*); elsewhere it
+    falls back to an exact count.
+    """
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPage:
+    """A page of results plus the cursor that continues after it"""
+
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor, is_first, paginator):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+        self.paginator = paginator
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or not self.is_first
+
+
+class KeysetPaginator:
+    """
+    Seek (keyset) pagination over a queryset ordered by one sort field
+    with the primary key as a tiebreaker.
+
+    Each page filters past the last row of the previous page instead of
+    using OFFSET, so every page costs the same as the first, and no
+    COUNT(*) is issued unless the template asks for `count`. Cursors are
+    signed and bound to the sort they were issued for. NULL sort values
+    are treated as smaller than every other value.
+    """
+
+    def __init__(self, queryset, sort_field='id', descending=False,
+                 per_page=20):
+        if sort_field not in KEYSET_SORT_FIELDS:
+            sort_field = 'id'
+        self.queryset = queryset
+        self.sort_field = sort_field
+        self.descending = descending
+        self.per_page = per_page
+
+    @cached_property
+    def count(self):
+        return approximate_count(self.queryset)
+
+    def _ordering(self):
+        field = F(self.sort_field)
+        if self.descending:
+            return [field.desc(nulls_last=True), F('id').desc()]
+        return [field.asc(nulls_first=True), F('id').asc()]
+
+    def _seek(self, value, last_id):
+        field = self.sort_field
+        if field == 'id':
+            return Q(id__lt=last_id) if self.descending else Q(id__gt=last_id)
+
+        if self.descending:
+            if value is None:
+                return Q(**{f'{field}__isnull': True, 'id__lt': last_id})
+            return (
+                Q(**{f'{field}__lt': value}) |
+                Q(**{field: value, 'id__lt': last_id}) |
+                Q(**{f'{field}__isnull': True})
+            )
+
+        if value is None:
+            return (
+                Q(**{f'{field}__isnull': True, 'id__gt': last_id}) |
+                Q(**{f'{field}__isnull': False})
+            )
+        return (
+            Q(**{f'{field}__gt': value}) |
+            Q(**{field: value, 'id__gt': last_id})
+        )
+
+    def _encode_cursor(self, value, last_id):
+        if isinstance(value, Decimal):
+            value = str(value)
+        return signing.dumps(
+            {
+                'f': self.sort_field,
+                'd': self.descending,
+                'v': value,
+                'id': last_id,
+            },
+            salt=CURSOR_SALT,
+        )
+
+    def _decode_cursor(self, cursor):
+        """Return (value, last_id), or None for the first page"""
+        if not cursor:
+            return None
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if data.get('f') != self.sort_field or \
+                data.get('d') != self.descending:
+            return None
+        return data.get('v'), data.get('id')
+
+    def page(self, cursor=None):
+        """Return the page that follows `cursor`"""
+        queryset = self.queryset.annotate(
+            keyset_value=F(self.sort_field)
+        ).order_by(*self._ordering())
+
+        position = self._decode_cursor(cursor)
+        if position is not None:
+            queryset = queryset.filter(self._seek(*position))
+
+        rows = list(queryset[:self.per_page + 1])
+        object_list = rows[:self.per_page]
+        next_cursor = None
+        if len(rows) > self.per_page:
+            last = object_list[-1]
+            next_cursor = self._encode_cursor(last.keyset_value, last.pk)
+        return KeysetPage(object_list, next_cursor, position is None, self)
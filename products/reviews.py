@@ -0,0 +1,57 @@
+from django.db.models import (
+    Avg, Count, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Sum,
+)
+from django.db.models.functions import Coalesce, NullIf
+from .models import Product, ProductReview
+
+
+def adjust_review_aggregates(product_id, rating, delta):
+    """
+    Add (delta=1) or remove (delta=-1) one review with `rating` stars
+    from a product's review aggregates.
+
+    This is a single UPDATE built from F() expressions, so concurrent
+    reviews can't overwrite each other's counts. The right-hand sides
+    read the row's values from before the update, so the new average
+    is computed from the adjusted total and count.
+    """
+    star_field = f'review_count_{rating}'
+    total = F('review_total') + rating * delta
+    count = F('review_count') + delta
+    Product.objects.filter(pk=product_id).update(**{
+        'review_total': total,
+        'review_count': count,
+        star_field: F(star_field) + delta,
+        'review_average': ExpressionWrapper(
+            total * 1.0 / NullIf(count, 0), output_field=FloatField()
+        ),
+    })
+
+
+def recount_review_aggregates(product_id):
+    """
+    Recompute a product's review aggregates from its reviews, in a
+    single UPDATE with a subquery per column.
+
+    Used after a full save of a product, which writes back whatever
+    aggregates the instance was loaded with.
+    """
+    reviews = ProductReview.objects.filter(
+        product=OuterRef('pk')
+    ).order_by().values('product')
+
+    def aggregate(expression):
+        return Subquery(reviews.annotate(value=expression).values('value'))
+
+    stars = {
+        f'review_count_{rating}': Coalesce(
+            aggregate(Count('pk', filter=Q(rating=rating))), 0
+        )
+        for rating in range(1, 6)
+    }
+    Product.objects.filter(pk=product_id).update(
+        review_count=Coalesce(aggregate(Count('pk')), 0),
+        review_total=Coalesce(aggregate(Sum('rating')), 0),
+        review_average=aggregate(Avg('rating', output_field=FloatField())),
+        **stars,
+    )
@@ -0,0 +1,148 @@
+import re
+from django.db import connection, transaction
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Product fields covered by the search index, most significant first
+SEARCH_FIELDS = (
+    'name', 'drone_model', 'camera_quality', 'compatibility', 'description',
+)
+# PostgreSQL weight class and SQLite bm25 weight for each field
+SEARCH_WEIGHTS = {
+    'name': ('A', 10.0),
+    'drone_model': ('B', 5.0),
+    'camera_quality': ('C', 2.0),
+    'compatibility': ('C', 2.0),
+    'description': ('D', 1.0),
+}
+SEARCH_VECTOR_COLUMN = 'search_vector'
+SQLITE_FTS_TABLE = 'products_product_fts'
+
+_sqlite_fts_available = False
+
+
+def _search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def postgres_search_vector_sql():
+    """SQL expression for the weighted tsvector stored on each product"""
+    parts = [
+        f"setweight(to_tsvector('english'::regconfig, "
+        f"coalesce({field}, '')), '{SEARCH_WEIGHTS[field][0]}')"
+        for field in SEARCH_FIELDS
+    ]
+    return ' || '.join(parts)
+
+
+def sqlite_fts_available():
+    """Whether the SQLite FTS5 index table exists in this database"""
+    global _sqlite_fts_available
+    if not _sqlite_fts_available:
+        _sqlite_fts_available = (
+            SQLITE_FTS_TABLE in connection.introspection.table_names()
+        )
+    return _sqlite_fts_available
+
+
+def index_product(product):
+    """
+    Refresh a product's entry in the SQLite full-text index. PostgreSQL
+    keeps its generated search vector current on its own.
+    """
+    if connection.vendor != 'sqlite' or not sqlite_fts_available():
+        return
+    columns = ', '.join(SEARCH_FIELDS)
+    placeholders = ', '.join(['%s'] * len(SEARCH_FIELDS))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = %s', [product.pk]
+        )
+        cursor.execute(
+            f'INSERT INTO {SQLITE_FTS_TABLE} (rowid, {columns}) '
+            f'VALUES (%s, {placeholders})',
+            [product.pk] + [
+                getattr(product, field) or '' for field in SEARCH_FIELDS
+            ],
+        )
+
+
+def unindex_product(product_id):
+    """Remove a deleted product from the SQLite full-text index"""
+    if connection.vendor != 'sqlite' or not sqlite_fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = %s', [product_id]
+        )
+
+
+def _search_postgres(queryset, terms):
+    table = queryset.model._meta.db_table
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    return queryset.filter(
+        RawSQL(
+            f"{table}.{SEARCH_VECTOR_COLUMN} @@ "
+            f"to_tsquery('english', %s)",
+            (tsquery,),
+            output_field=BooleanField(),
+        )
+    ).annotate(
+        search_rank=RawSQL(
+            f"ts_rank({table}.{SEARCH_VECTOR_COLUMN}, "
+            f"to_tsquery('english', %s))",
+            (tsquery,),
+            output_field=FloatField(),
+        )
+    )
+
+
+def _search_sqlite(queryset, terms):
+    model_table = queryset.model._meta.db_table
+    pk_column = queryset.model._meta.pk.column
+    match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+    weights = ', '.join(str(SEARCH_WEIGHTS[f][1]) for f in SEARCH_FIELDS)
+    # bm25 scores are lower-is-better, search_rank is higher-is-better
+    return queryset.filter(
+        pk__in=RawSQL(
+            f'SELECT rowid FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s',
+            (match,),
+        )
+    ).annotate(
+        search_rank=RawSQL(
+            f'SELECT -bm25({SQLITE_FTS_TABLE}, {weights}) '
+            f'FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s '
+            f'AND rowid = {model_table}.{pk_column}',
+            (match,),
+            output_field=FloatField(),
+        )
+    )
+
+
+def _search_fallback(queryset, query):
+    queries = (
+        Q(name__icontains=query) |
+        Q(description__icontains=query)
+    )
+    return queryset.filter(queries).annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    )
+
+
+def search_products(queryset, query):
+    """
+    Filter a product queryset to those matching a free-text query.
+
+    Every word in the query must match, as a prefix, one of the indexed
+    fields. Matching products are annotated with `search_rank` (higher
+    is better) so callers can order by relevance.
+    """
+    terms = _search_terms(query)
+    if terms:
+        if connection.vendor == 'postgresql':
+            return _search_postgres(queryset, terms)
+        if connection.vendor == 'sqlite' and sqlite_fts_available():
+            return _search_sqlite(queryset, terms)
+    return _search_fallback(queryset, query)
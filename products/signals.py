@@ -0,0 +1,100 @@
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+from .models import (
+    Product, Attachment, Category, ProductReview, REVIEW_AGGREGATE_FIELDS
+)
+from .catalogue import (
+    bump_attachment_version, bump_catalogue_version, bump_price_version
+)
+from .search import unindex_product
+from .reviews import adjust_review_aggregates, recount_review_aggregates
+
+
+@receiver(post_save, sender=Product)
+def invalidate_prices_on_save(sender, instance, created, update_fields,
+                              **kwargs):
+    """
+    Invalidate computed bag snapshots and cached catalogue reads when a
+    product is added or edited.
+
+    An edit that saved the review aggregates wrote back the values the
+    product was loaded with, so recount them from the reviews.
+    """
+    if not created and (
+        update_fields is None
+        or not update_fields.isdisjoint(REVIEW_AGGREGATE_FIELDS)
+    ):
+        recount_review_aggregates(instance.pk)
+    bump_price_version()
+    bump_catalogue_version()
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_prices_on_delete(sender, instance, **kwargs):
+    """
+    Invalidate computed bag snapshots and cached catalogue reads when a
+    product is removed, and drop it from the search index.
+    """
+    bump_price_version()
+    bump_catalogue_version()
+    unindex_product(instance.pk)
+
+
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def invalidate_attachments(sender, instance, **kwargs):
+    """
+    Reload the attachment catalogue, and the bag snapshots priced
+    against it, when an attachment is changed in the admin.
+    """
+    bump_attachment_version()
+    bump_price_version()
+    bump_catalogue_version()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_categories(sender, instance, **kwargs):
+    """Drop cached catalogue reads when a category changes"""
+    bump_catalogue_version()
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_previous_review(sender, instance, **kwargs):
+    """
+    Record what an edited review counted towards before the change, so
+    the aggregates can move it to its new product or rating.
+    """
+    instance._previous_review = None
+    if instance.pk:
+        instance._previous_review = ProductReview.objects.filter(
+            pk=instance.pk
+        ).values('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=ProductReview)
+def add_review_to_aggregates(sender, instance, created, **kwargs):
+    """
+    Count a new or edited review in its product's aggregates, and drop
+    cached review pages and products, whose aggregates are updated
+    without Product.save.
+    """
+    previous = getattr(instance, '_previous_review', None)
+    if previous and not created:
+        if previous == {
+            'product_id': instance.product_id, 'rating': instance.rating
+        }:
+            bump_catalogue_version()
+            return
+        adjust_review_aggregates(
+            previous['product_id'], previous['rating'], -1
+        )
+    adjust_review_aggregates(instance.product_id, instance.rating, 1)
+    bump_catalogue_version()
+
+
+@receiver(post_delete, sender=ProductReview)
+def remove_review_from_aggregates(sender, instance, **kwargs):
+    """Drop a deleted review from its product's aggregates"""
+    adjust_review_aggregates(instance.product_id, instance.rating, -1)
+    bump_catalogue_version()
@@ -0,0 +1,761 @@
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
+from django.apps import apps
+from botocore.exceptions import ClientError
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+from custom_storages import MediaStorage, get_s3_connection
+from .attachments import DB_ATTACHMENT_ID_OFFSET, attachment_catalogue
+from .catalogue import VersionTokens, get_catalogue_version, get_product
+from .configurator import (
+    CUSTOM_DRONE_CATEGORY, drone_configurator, get_base_model,
+)
+from .images import get_derivative_formats
+from .models import Attachment, Category, Product, ProductReview
+from .pagination import KeysetPaginator, clamp_per_page
+from .search import SQLITE_FTS_TABLE, search_products
+from .uploads import DIRECT_UPLOAD_SALT
+
+# Local-memory caches for every alias, so tests of caching don't depend
+# on whether the environment configures Redis or DEVELOPMENT
+LOCAL_CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': alias,
+    }
+    for alias in ('default', 'sessions', 'catalogue')
+}
+
+
+def create_product(category, name, **fields):
+    fields.setdefault('description', 'A drone')
+    fields.setdefault('price', Decimal('100.00'))
+    return Product.objects.create(category=category, name=name, **fields)
+
+
+class CatalogueTestCase(TestCase):
+    """Starts each test with empty caches and no version tokens read"""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        patcher = mock.patch('products.catalogue._versions', VersionTokens())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class AttachmentCatalogueTests(CatalogueTestCase):
+
+    def test_lookups_use_the_built_in_attachments(self):
+        self.assertEqual(attachment_catalogue.get_id('att-camera'), 1)
+        self.assertEqual(attachment_catalogue.get_sku(1), 'att-camera')
+        self.assertEqual(
+            attachment_catalogue.get_name('att-camera'), 'Advanced Camera'
+        )
+        self.assertEqual(
+            attachment_catalogue.get_total_price(
+                ['att-camera', 'att-carry-case']
+            ),
+            Decimal('348'),
+        )
+
+    def test_unknown_attachments(self):
+        self.assertIsNone(attachment_catalogue.get('att-unknown'))
+        self.assertIsNone(attachment_catalogue.get_id('att-unknown'))
+        self.assertIsNone(attachment_catalogue.get_sku(999))
+        self.assertEqual(
+            attachment_catalogue.get_name('att-unknown'), 'att-unknown'
+        )
+        self.assertEqual(
+            attachment_catalogue.get_price('att-unknown'), Decimal(0)
+        )
+
+    def test_index_is_reused_between_lookups(self):
+        attachment_catalogue.get('att-camera')
+        with self.assertNumQueries(0):
+            for attachment in attachment_catalogue.all():
+                attachment_catalogue.get_price(attachment['sku'])
+
+    def test_saving_an_attachment_rebuilds_the_index(self):
+        attachment_catalogue.get('att-camera')
+        Attachment.objects.create(
+            name='Pro Camera', description='Overrides the built-in one',
+            price=Decimal('349.00'), sku='att-camera',
+        )
+        added = Attachment.objects.create(
+            name='Floodlight', description='Only in the database',
+            price=Decimal('59.00'), sku='att-floodlight',
+        )
+
+        self.assertEqual(
+            attachment_catalogue.get_price('att-camera'), Decimal('349.00')
+        )
+        # Overrides keep the built-in id, other rows are offset
+        self.assertEqual(attachment_catalogue.get_id('att-camera'), 1)
+        self.assertEqual(
+            attachment_catalogue.get_id('att-floodlight'),
+            DB_ATTACHMENT_ID_OFFSET + added.pk,
+        )
+        self.assertEqual(
+            attachment_catalogue.get_sku(DB_ATTACHMENT_ID_OFFSET + added.pk),
+            'att-floodlight',
+        )
+
+
+class SearchTests(CatalogueTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='drones')
+        cls.falcon = create_product(
+            category, 'Falcon Racer', description='A fast racing drone'
+        )
+        cls.hawk = create_product(
+            category, 'Hawk Explorer',
+            description='Follows the falcon racer in a chase',
+        )
+        cls.owl = create_product(
+            category, 'Owl Night', description='Flies in the dark'
+        )
+
+    def search(self, query):
+        return list(
+            search_products(Product.objects.all(), query)
+            .order_by('-search_rank', 'id')
+        )
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('falcon'), [self.falcon, self.hawk])
+
+    def test_every_term_must_match_as_a_prefix(self):
+        self.assertEqual(self.search('rac fal'), [self.falcon, self.hawk])
+        self.assertEqual(self.search('falcon dark'), [])
+
+    def test_search_runs_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search('falcon')
+
+        self.assertEqual(len(queries.captured_queries), 1)
+        if connection.vendor == 'sqlite':
+            self.assertIn(
+                SQLITE_FTS_TABLE, queries.captured_queries[0]['sql']
+            )
+
+    def test_index_follows_edits_and_deletes(self):
+        self.owl.name = 'Falcon Night'
+        self.owl.save()
+        self.assertEqual(
+            self.search('falcon'), [self.falcon, self.owl, self.hawk]
+        )
+
+        self.falcon.delete()
+        self.assertEqual(self.search('falcon'), [self.owl, self.hawk])
+
+    def test_listing_pages_through_ranked_results(self):
+        response = self.client.get(
+            reverse('products'), {'q': 'falcon', 'cursor': '', 'per_page': 1}
+        )
+        self.assertEqual(list(response.context['products']), [self.falcon])
+
+        response = self.client.get(
+            reverse('products') + response.context['next_page_url']
+        )
+        self.assertEqual(list(response.context['products']), [self.hawk])
+
+    def test_queries_without_words_fall_back_to_substring_search(self):
+        self.assertEqual(self.search('!!!'), [])
+
+
+class KeysetPaginationTests(CatalogueTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='drones')
+        # Repeated prices and missing ratings exercise the tiebreaker
+        # and NULL handling
+        ratings = [None, Decimal('4.5'), None, Decimal('3.0'), Decimal('4.5')]
+        prices = ['20.00', '10.00', '20.00', '30.00', '10.00']
+        cls.products = [
+            create_product(
+                category, f'Drone {number}',
+                price=Decimal(price), rating=rating,
+            )
+            for number, (price, rating) in enumerate(zip(prices, ratings))
+        ]
+
+    def walk(self, paginator):
+        """Follow the cursors from the first page to the last"""
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return pages
+
+    def assert_walk_matches(self, sort_field, descending, ordering):
+        queryset = Product.objects.all()
+        pages = self.walk(
+            KeysetPaginator(queryset, sort_field, descending, per_page=2)
+        )
+        self.assertEqual(
+            [product for page in pages for product in page],
+            list(queryset.order_by(*ordering)),
+        )
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertTrue(pages[0].is_first)
+        self.assertFalse(pages[-1].has_next())
+
+    def test_pages_cover_every_row_once(self):
+        self.assert_walk_matches('price', False, ['price', 'id'])
+        self.assert_walk_matches('price', True, ['-price', '-id'])
+        self.assert_walk_matches('id', True, ['-id'])
+
+    def test_null_values_sort_first(self):
+        self.assert_walk_matches(
+            'rating', False, [F('rating').asc(nulls_first=True), 'id']
+        )
+        self.assert_walk_matches(
+            'rating', True, [F('rating').desc(nulls_last=True), '-id']
+        )
+
+    def test_pages_do_not_count_rows(self):
+        paginator = KeysetPaginator(Product.objects.all(), 'price', per_page=2)
+        with CaptureQueriesContext(connection) as queries:
+            paginator.page(paginator.page().next_cursor)
+
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in queries.captured_queries
+        ))
+        self.assertFalse(any(
+            'OFFSET' in query['sql'] for query in queries.captured_queries
+        ))
+
+    def test_bad_cursors_restart_from_the_first_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), 'price', per_page=2)
+        first_page = list(paginator.page())
+        cursor = paginator.page().next_cursor
+
+        self.assertEqual(list(paginator.page('not-a-cursor')), first_page)
+        self.assertEqual(list(paginator.page(cursor + 'x')), first_page)
+        # A cursor is only valid for the sort it was issued for
+        descending = KeysetPaginator(
+            Product.objects.all(), 'price', descending=True, per_page=2
+        )
+        self.assertEqual(
+            list(descending.page(cursor)), list(descending.page())
+        )
+
+    def test_unknown_sort_fields_fall_back_to_id(self):
+        paginator = KeysetPaginator(Product.objects.all(), 'description')
+        self.assertEqual(paginator.sort_field, 'id')
+
+    @override_settings(PRODUCTS_MAX_PER_PAGE=50)
+    def test_per_page_is_clamped(self):
+        self.assertEqual(clamp_per_page('10'), 10)
+        self.assertEqual(clamp_per_page('500'), 50)
+        self.assertEqual(clamp_per_page('all'), 50)
+        self.assertEqual(clamp_per_page('0'), 1)
+        self.assertEqual(clamp_per_page('lots'), 20)
+
+
+class ListingSortTests(CatalogueTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        drones = Category.objects.create(name='drones')
+        parts = Category.objects.create(name='parts')
+        cls.alpha = create_product(drones, 'alpha', price=Decimal('30.00'))
+        cls.bravo = create_product(drones, 'Bravo', price=Decimal('10.00'))
+        cls.charlie = create_product(parts, 'charlie', price=Decimal('30.00'))
+        cls.delta = create_product(drones, 'Delta', price=Decimal('20.00'))
+
+    def listing(self, **params):
+        response = self.client.get(reverse('products'), params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['products'])
+
+    def test_names_sort_case_insensitively(self):
+        self.assertEqual(
+            self.listing(sort='name', direction='asc'),
+            [self.alpha, self.bravo, self.charlie, self.delta],
+        )
+        self.assertEqual(
+            self.listing(sort='name', direction='desc'),
+            [self.delta, self.charlie, self.bravo, self.alpha],
+        )
+
+    def test_ties_are_broken_by_id_in_the_sort_direction(self):
+        self.assertEqual(
+            self.listing(sort='price', direction='desc'),
+            [self.charlie, self.alpha, self.delta, self.bravo],
+        )
+        self.assertEqual(
+            self.listing(sort='price', direction='asc'),
+            [self.bravo, self.delta, self.alpha, self.charlie],
+        )
+
+    def test_rating_sorts_by_the_customer_review_average(self):
+        # The rating set in the admin is ignored
+        Product.objects.filter(pk=self.alpha.pk).update(rating=5)
+        for number, (product, rating) in enumerate(
+            ((self.bravo, 5), (self.charlie, 2), (self.delta, 4))
+        ):
+            ProductReview.objects.create(
+                product=product, rating=rating, comment='Good',
+                user=User.objects.create_user(f'pilot{number}'),
+            )
+
+        self.assertEqual(
+            self.listing(sort='rating', direction='desc'),
+            [self.bravo, self.delta, self.charlie, self.alpha],
+        )
+
+    def test_category_filter_keeps_the_sort(self):
+        self.assertEqual(
+            self.listing(category='drones', sort='price', direction='asc'),
+            [self.bravo, self.delta, self.alpha],
+        )
+
+    def test_later_pages_keep_the_sort(self):
+        response = self.client.get(
+            reverse('products'),
+            {'sort': 'price', 'direction': 'asc', 'per_page': 2, 'page': 2},
+        )
+
+        self.assertEqual(
+            list(response.context['products']), [self.alpha, self.charlie]
+        )
+        self.assertContains(response, 'sort=price&direction=asc&page=1')
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.listing(sort='name', direction='asc')
+
+        self.assertEqual(
+            len([
+                query for query in queries.captured_queries
+                if '"products_product"' in query['sql']
+            ]),
+            2,
+        )
+
+
+class ReviewAggregateTests(CatalogueTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='drones')
+        cls.product = create_product(category, 'Falcon')
+        cls.users = [
+            User.objects.create_user(f'pilot{number}') for number in range(3)
+        ]
+
+    def review(self, user, rating):
+        return ProductReview.objects.create(
+            product=self.product, user=user, rating=rating, comment='Good'
+        )
+
+    def assert_aggregates(self, count, average, histogram):
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual(product.review_count, count)
+        self.assertEqual(product.review_average, average)
+        self.assertEqual(
+            [row['count'] for row in product.get_review_histogram()],
+            histogram,
+        )
+
+    def test_reviews_update_the_aggregates(self):
+        first = self.review(self.users[0], 5)
+        self.review(self.users[1], 2)
+        self.assert_aggregates(2, Decimal('3.50'), [1, 0, 0, 1, 0])
+
+        first.rating = 4
+        first.save()
+        self.assert_aggregates(2, Decimal('3.00'), [0, 1, 0, 1, 0])
+
+        first.delete()
+        self.assert_aggregates(1, Decimal('2.00'), [0, 0, 0, 1, 0])
+
+    def test_editing_a_product_keeps_reviews_posted_meanwhile(self):
+        # The edit form loads the product, a review is posted, then the
+        # stale instance is saved
+        product = Product.objects.get(pk=self.product.pk)
+        self.review(self.users[0], 4)
+        product.name = 'Falcon Mk II'
+        product.save()
+
+        self.assert_aggregates(1, Decimal('4.00'), [0, 1, 0, 0, 0])
+        self.assertEqual(
+            Product.objects.get(pk=self.product.pk).name, 'Falcon Mk II'
+        )
+
+    def test_detail_page_counts_reviews_from_the_aggregates(self):
+        for user, rating in zip(self.users, (5, 5, 3)):
+            self.review(user, rating)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('product_detail', args=[self.product.pk]),
+                {'stars': 5},
+            )
+
+        self.assertEqual(len(response.context['reviews']), 2)
+        self.assertEqual(response.context['reviews'].paginator.count, 2)
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in queries.captured_queries
+        ))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CatalogueCacheTests(CatalogueTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = create_product(
+            Category.objects.create(name='drones'), 'Falcon'
+        )
+        # Read the version tokens, so only product queries are counted
+        get_product(self.product.pk)
+
+    def test_products_are_cached_in_the_catalogue_cache(self):
+        with self.assertNumQueries(0):
+            get_product(self.product.pk)
+
+    @override_settings(CACHES={
+        **LOCAL_CACHES,
+        'catalogue': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        },
+    })
+    def test_products_are_read_from_the_database_without_it(self):
+        with self.assertNumQueries(1):
+            get_product(self.product.pk)
+        with self.assertNumQueries(1):
+            get_product(self.product.pk)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ProductCardCacheTests(CatalogueTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_product(
+            Category.objects.create(name='drones'), 'Falcon'
+        )
+        cls.admin = User.objects.create_superuser('admin', password='secret')
+
+    def test_cached_card_is_a_complete_element(self):
+        self.client.get(reverse('products'))
+
+        fragment = caches['catalogue'].get(make_template_fragment_key(
+            'product_card', [get_catalogue_version(), self.product.pk]
+        ))
+        self.assertIn('Falcon', fragment)
+        self.assertEqual(fragment.count('<div'), fragment.count('</div>'))
+        self.assertTrue(fragment.strip().startswith('<div class="card'))
+
+    def test_per_user_parts_are_not_cached(self):
+        self.client.get(reverse('products'))
+        self.client.force_login(self.admin)
+        self.admin.userprofile.wishlist.products.add(self.product)
+
+        response = self.client.get(reverse('products'))
+
+        self.assertContains(response, 'wishlist-icon wishlist-active')
+        self.assertContains(
+            response, reverse('edit_product', args=[self.product.pk])
+        )
+
+
+class StorageConnectionTests(TestCase):
+
+    def test_threads_share_one_client(self):
+        connection = get_s3_connection(MediaStorage())
+        other_threads = []
+        thread = threading.Thread(
+            target=lambda: other_threads.append(
+                get_s3_connection(MediaStorage())
+            )
+        )
+        thread.start()
+        thread.join()
+
+        self.assertIs(get_s3_connection(MediaStorage()), connection)
+        self.assertIsNot(other_threads[0], connection)
+        self.assertIs(other_threads[0].meta.client, connection.meta.client)
+
+    def test_bucket_is_probed_at_startup_when_enabled(self):
+        config = apps.get_app_config('products')
+        with mock.patch('custom_storages.probe_s3') as probe_s3:
+            with override_settings(AWS_S3_STARTUP_PROBE=False):
+                config.ready()
+            probe_s3.assert_not_called()
+
+            with override_settings(AWS_S3_STARTUP_PROBE=True):
+                config.ready()
+            probe_s3.assert_called_once_with()
+
+
+class LocalBucketStorage(FileSystemStorage):
+    """Stands in for MediaStorage, with a mock S3 client"""
+    bucket_name = 'test-bucket'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.connection = mock.Mock()
+        self.head_object = self.connection.meta.client.head_object
+
+
+def make_image_upload(name='drone.png', size=(800, 600)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'navy').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), 'image/png')
+
+
+class ProductImageTests(CatalogueTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='drones')
+        cls.product = create_product(
+            cls.category, 'Falcon', image='noimage.webp'
+        )
+        cls.staff = User.objects.create_user(
+            'staff', password='secret', is_staff=True
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.staff)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.storage = LocalBucketStorage(location=self.media_root)
+        patcher = mock.patch(
+            'products.views.MediaStorage', return_value=self.storage
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def edit(self, **data):
+        if not data:
+            data['image'] = make_image_upload()
+        return self.client.post(
+            reverse('edit_product', args=[self.product.pk]),
+            {
+                'category': self.category.pk,
+                'name': 'Falcon',
+                'description': 'A drone',
+                'price': '100.00',
+                **data,
+            },
+        )
+
+    def upload_directly(self, key, content_type='image/png'):
+        """Put an image in the bucket as a direct upload would"""
+        self.storage.save(key, make_image_upload())
+        self.storage.head_object.return_value = {
+            'ContentType': content_type,
+        }
+        return signing.dumps(key, salt=DIRECT_UPLOAD_SALT)
+
+    def assert_upload_rejected(self, response):
+        self.assertRedirects(
+            response, reverse('edit_product', args=[self.product.pk]),
+            fetch_redirect_response=False,
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image.name, 'noimage.webp')
+
+    def stored_files(self):
+        return sorted(
+            FileSystemStorage(location=self.media_root).listdir('')[1]
+        )
+
+    def test_new_image_gets_resized_copies(self):
+        response = self.edit()
+
+        self.assertRedirects(
+            response, reverse('product_detail', args=[self.product.pk]),
+            fetch_redirect_response=False,
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image.name, 'drone.png')
+        self.assertEqual(
+            set(self.product.image_derivatives['webp']),
+            {'320', '640', '800'},
+        )
+        self.assertIn('drone-320w.webp', self.stored_files())
+
+    def test_failed_resize_keeps_the_old_image(self):
+        with mock.patch(
+            'products.images.generate_image_derivatives',
+            side_effect=OSError('cannot write mode P as WEBP'),
+        ):
+            response = self.edit()
+
+        self.assert_upload_rejected(response)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_avif_is_skipped_without_an_encoder(self):
+        Image.init()
+        with mock.patch.dict(Image.SAVE):
+            Image.SAVE.pop('AVIF', None)
+            formats = get_derivative_formats()
+
+        self.assertEqual([format[0] for format in formats], ['webp'])
+
+    @override_settings(AWS_S3_DIRECT_UPLOADS=True)
+    def test_only_raster_images_can_be_presigned(self):
+        url = reverse('presign_product_image')
+        with mock.patch(
+            'products.views.create_presigned_post', return_value={}
+        ) as create_presigned_post:
+            svg = self.client.post(url, {
+                'filename': 'drone.svg', 'content_type': 'image/svg+xml',
+            }, content_type='application/json')
+            png = self.client.post(url, {
+                'filename': 'drone.png', 'content_type': 'image/png',
+            }, content_type='application/json')
+
+        self.assertEqual(svg.status_code, 400)
+        self.assertEqual(png.status_code, 200)
+        create_presigned_post.assert_called_once_with(
+            self.storage, 'drone.png', 'image/png'
+        )
+
+    def test_direct_upload_is_checked_and_resized(self):
+        token = self.upload_directly('media/drone.png')
+
+        self.edit(image_token=token)
+
+        self.storage.head_object.assert_called_once_with(
+            Bucket='test-bucket', Key='media/drone.png'
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image.name, 'media/drone.png')
+        self.assertEqual(
+            self.product.image_derivatives['webp']['320'],
+            'media/drone-320w.webp',
+        )
+
+    def test_direct_upload_outside_the_media_location_is_rejected(self):
+        token = self.upload_directly('static/drone.png')
+
+        self.assert_upload_rejected(self.edit(image_token=token))
+        self.storage.head_object.assert_not_called()
+
+    def test_missing_direct_upload_is_rejected(self):
+        token = signing.dumps('media/drone.png', salt=DIRECT_UPLOAD_SALT)
+        self.storage.head_object.side_effect = ClientError(
+            {'Error': {'Code': '404'}}, 'HeadObject'
+        )
+
+        self.assert_upload_rejected(self.edit(image_token=token))
+
+    def test_direct_upload_of_another_type_is_deleted(self):
+        token = self.upload_directly('media/drone.png', 'image/svg+xml')
+
+        self.assert_upload_rejected(self.edit(image_token=token))
+        self.assertFalse(self.storage.exists('media/drone.png'))
+
+
+class DroneConfiguratorTests(CatalogueTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name=CUSTOM_DRONE_CATEGORY)
+        cls.falcon_black, cls.falcon_red, cls.hawk_blue, _ = [
+            create_product(category, name, sku=sku, color=color)
+            for name, sku, color in (
+                ('Falcon X - Black', 'falcon-x-10001-black', 'Black'),
+                ('Falcon X - Red', 'falcon-x-10002-red', 'Red'),
+                ('Hawk Pro - Blue', 'hawk-pro-10003-blue', 'Blue'),
+                ('Falcon X - Black', 'falcon-x-10004-black', 'black'),
+            )
+        ]
+        create_product(category, 'Prototype')
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(drone_configurator, '_version', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_base_model_is_read_from_the_sku(self):
+        self.assertEqual(get_base_model('falcon-x-10001-black'), 'falcon-x')
+        self.assertIsNone(get_base_model(None))
+
+    def test_models_list_their_colours_in_catalogue_order(self):
+        models = drone_configurator.models()
+
+        self.assertEqual(
+            [(model['value'], model['name']) for model in models],
+            [('falcon-x', 'Falcon X'), ('hawk-pro', 'Hawk Pro')],
+        )
+        self.assertEqual(
+            [option['color'] for option in models[0]['colors']],
+            ['Black', 'Red', 'black'],
+        )
+
+    def test_options_are_found_by_model_and_any_case_colour(self):
+        option = drone_configurator.get('falcon-x', 'BLACK')
+
+        # The first product wins when a model repeats a colour
+        self.assertEqual(option['product_id'], self.falcon_black.pk)
+        self.assertEqual(option['price'], Decimal('100.00'))
+        self.assertIsNone(drone_configurator.get('falcon-x', 'Blue'))
+        self.assertIsNone(drone_configurator.get('eagle', 'Black'))
+
+    def test_index_is_reused_until_the_catalogue_changes(self):
+        drone_configurator.models()
+        with self.assertNumQueries(0):
+            drone_configurator.get('hawk-pro', 'blue')
+
+        self.hawk_blue.price = Decimal('120.00')
+        self.hawk_blue.save()
+
+        self.assertEqual(
+            drone_configurator.get('hawk-pro', 'blue')['price'],
+            Decimal('120.00'),
+        )
+
+    def test_custom_drone_is_added_to_the_bag(self):
+        drone_configurator.models()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('add_custom_drone_to_bag'), {
+                'drone_type': 'falcon-x',
+                'color': 'red',
+                'quantity': 2,
+                'attachments': ['att-camera', 'att-unknown'],
+            })
+
+        self.assertFalse(any(
+            '"products_product"' in query['sql']
+            for query in queries.captured_queries
+        ))
+        item_id = f'{self.falcon_red.pk}-1'
+        self.assertEqual(
+            self.client.session['bag']['items'], {item_id: 2}
+        )
+
+    def test_unknown_custom_drone_is_not_added(self):
+        response = self.client.post(reverse('add_custom_drone_to_bag'), {
+            'drone_type': 'eagle', 'color': 'red',
+        })
+
+        self.assertRedirects(
+            response, reverse('view_bag'), fetch_redirect_response=False
+        )
+        self.assertNotIn('bag', self.client.session)
@@ -0,0 +1,99 @@
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core import signing
+from django.utils.text import get_valid_filename
+from .images import generate_image_derivatives
+
+DIRECT_UPLOAD_SALT = 'products.uploads.key'
+# Seconds a presigned POST, and the token for its key, stay valid
+PRESIGNED_POST_EXPIRY = 10 * 60
+UPLOAD_TOKEN_MAX_AGE = 60 * 60
+# Image types the browser may upload directly; notably not SVG, which
+# could carry script and is served from the bucket as is
+DIRECT_UPLOAD_CONTENT_TYPES = ('image/jpeg', 'image/png', 'image/webp')
+
+
+class InvalidUpload(Exception):
+    """A direct upload that can't be used as a product image"""
+
+
+def direct_uploads_enabled():
+    """Whether product images may be uploaded straight to S3"""
+    return getattr(settings, 'AWS_S3_DIRECT_UPLOADS', False)
+
+
+def create_presigned_post(storage, filename, content_type):
+    """
+    Presign a POST that lets the browser upload an image straight to
+    a new key in the media bucket.
+
+    Returns the URL and form fields for the upload, plus a signed token
+    for the key. The product form sends the token back instead of the
+    file, so the Django worker only records the key.
+    """
+    # Keep the uploaded file name, as the custom drone configurator
+    # derives image URLs from it, picking a free one like storage.save
+    key = storage._normalize_name(
+        storage.get_available_name(get_valid_filename(filename))
+    )
+    post = storage.connection.meta.client.generate_presigned_post(
+        Bucket=storage.bucket_name,
+        Key=key,
+        Fields={'acl': 'public-read', 'Content-Type': content_type},
+        Conditions=[
+            {'acl': 'public-read'},
+            {'Content-Type': content_type},
+            [
+                'content-length-range', 1,
+                settings.AWS_S3_DIRECT_UPLOAD_MAX_SIZE,
+            ],
+        ],
+        ExpiresIn=PRESIGNED_POST_EXPIRY,
+    )
+    return {
+        'url': post['url'],
+        'fields': post['fields'],
+        'token': signing.dumps(key, salt=DIRECT_UPLOAD_SALT),
+    }
+
+
+def get_uploaded_key(token):
+    """
+    The media key a direct upload token was issued for. Raises
+    signing.BadSignature if the token is invalid or has expired.
+    """
+    return signing.loads(
+        token, salt=DIRECT_UPLOAD_SALT, max_age=UPLOAD_TOKEN_MAX_AGE
+    )
+
+
+def complete_direct_upload(storage, token):
+    """
+    Check the object a direct upload token was issued for, and store
+    its resized copies. Returns (key, derivatives).
+
+    Raises signing.BadSignature if the token is invalid, and
+    InvalidUpload if the key is outside the media location, wasn't
+    uploaded, or isn't an image of an allowed type. Objects that were
+    uploaded but can't be used are deleted.
+    """
+    key = get_uploaded_key(token)
+    if not key.startswith(f'{settings.MEDIAFILES_LOCATION}/'):
+        raise InvalidUpload(f'{key} is outside the media location')
+    try:
+        head = storage.connection.meta.client.head_object(
+            Bucket=storage.bucket_name, Key=key
+        )
+    except ClientError as e:
+        raise InvalidUpload(f'{key} was not uploaded') from e
+
+    if head.get('ContentType') not in DIRECT_UPLOAD_CONTENT_TYPES:
+        storage.delete(key)
+        raise InvalidUpload(f'{key} is not a JPEG, PNG or WebP image')
+    try:
+        with storage.open(key, 'rb') as image:
+            derivatives = generate_image_derivatives(storage, key, image)
+    except Exception as e:
+        storage.delete(key)
+        raise InvalidUpload(f'{key} could not be resized: {e}') from e
+    return key, derivatives
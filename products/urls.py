@@ -6,6 +6,11 @@ urlpatterns = [
     path('<product_id>', views.product_detail, name='product_detail'),
     path('customize/', views.custom_product, name='custom_product'),
     path('add/', views.add_product, name='add_product'),
+    path(
+        'uploads/presign/',
+        views.presign_product_image,
+        name='presign_product_image'
+    ),
     path(
         'edit/<int:product_id>/',
         views.edit_product,
@@ -1,15 +1,30 @@
 from django.conf import settings
-from django.http import JsonResponse
+from django.core import signing
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, redirect, reverse, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.db.models import Q
-from django.db.models.functions import Lower, Substr
+from django.db.models.functions import Lower
+from django.views.decorators.http import require_POST
 from custom_storages import MediaStorage
-from products.constants import ATTACHMENTS
+from products.attachments import attachment_catalogue
+from .catalogue import (
+    get_categories, get_category_products, get_listing_ids, get_product,
+    get_products, get_review_page,
+)
+from .configurator import drone_configurator
+from .images import delete_image_derivatives, store_product_image
+from .uploads import (
+    DIRECT_UPLOAD_CONTENT_TYPES, InvalidUpload, complete_direct_upload,
+    create_presigned_post, direct_uploads_enabled,
+)
 from .models import Product, Category
+from .search import search_products
+from .pagination import KeysetPaginator, clamp_per_page
 from .forms import ProductForm, ProductReviewForm
 from profiles.models import Wishlist, UserProfile
+from profiles.wishlist import get_wishlist_product_ids
+from utils.page_cache import cache_anonymous_page
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from decimal import Decimal, InvalidOperation
 import json
@@ -21,14 +36,17 @@ def is_staff_or_superuser(user):
 
 
 # View to show all products, including sorting and search queries
+@cache_anonymous_page
 def all_products(request):
     """ A view to show all products, including sorting and search queries """
-    products = Product.objects.all()
+    products = Product.objects.select_related('category')
     query = None
     categories = None
     sort = None
     direction = None
-    per_page = request.GET.get('per_page', '20')
+    sort_field = 'id'
+    descending = False
+    per_page = clamp_per_page(request.GET.get('per_page', '20'))
 
     if request.GET:
         if 'sort' in request.GET:
@@ -39,17 +57,25 @@ def all_products(request):
                 products = products.annotate(lower_name=Lower('name'))
             if sortkey == 'category':
                 sortkey = 'category__name'
+            if sortkey == 'rating':
+                # Customers' average, not the rating set in the admin
+                sortkey = 'review_average'
+            sort_field = sortkey
 
             if 'direction' in request.GET:
                 direction = request.GET['direction']
                 if direction == 'desc':
+                    descending = True
                     sortkey = f'-{sortkey}'
-            products = products.order_by(sortkey)
+            # Break ties on id so pages don't overlap or skip products
+            tiebreaker = '-id' if descending else 'id'
+            products = products.order_by(sortkey, tiebreaker)
 
         if 'category' in request.GET:
             categories = request.GET['category'].split(',')
-            products = products.filter(category__name__in=categories)
-            categories = Category.objects.filter(name__in=categories)
+            categories = get_categories(categories)
+            # Filter on category_id so the composite indexes apply
+            products = products.filter(category__in=categories)
 
         if 'q' in request.GET:
             query = request.GET['q']
@@ -60,30 +86,45 @@ def all_products(request):
                 )
                 return redirect(reverse('products'))
 
-            queries = (
-                Q(name__icontains=query) |
-                Q(description__icontains=query)
-            )
-            products = products.filter(queries)
-
-    # Ensure default ordering for consistent pagination
-    products = products.order_by('id')
+            products = search_products(products, query)
 
-    # Get the user's wishlist if authenticated
-    wishlist_products = []
-    if request.user.is_authenticated:
-        wishlist_products = (
-            request.user.userprofile.wishlist.products
-            .values_list('id', flat=True)
+    # Without an explicit sort, list the most relevant search results
+    # first, or fall back to a stable ordering for pagination
+    if not sort:
+        if query:
+            products = products.order_by('-search_rank', 'id')
+        else:
+            products = products.order_by('id')
+
+    # Get the user's wishlist as a set for O(1) membership checks
+    wishlist_product_ids = get_wishlist_product_ids(request)
+
+    # Pagination logic. A `cursor` parameter switches to keyset
+    # pagination, which seeks past the previous page instead of counting
+    # and skipping rows, so deep pages and infinite scroll stay cheap.
+    next_page_url = None
+    first_page_url = None
+    if 'cursor' in request.GET:
+        if query and not sort:
+            sort_field, descending = 'search_rank', True
+        paginator = KeysetPaginator(
+            products, sort_field, descending, per_page
         )
-
-    # Pagination logic
-    if per_page != 'all':
-        try:
-            per_page = int(per_page)
-        except ValueError:
-            per_page = 20
-        paginator = Paginator(products, per_page)
+        products = paginator.page(request.GET['cursor'])
+
+        params = request.GET.copy()
+        params['cursor'] = ''
+        first_page_url = f'?{params.urlencode()}'
+        if products.has_next():
+            params['cursor'] = products.next_cursor
+            next_page_url = f'?{params.urlencode()}'
+    else:
+        # Page through the listing's cached ids and load that page's
+        # products from the catalogue cache
+        product_ids = get_listing_ids(
+            products, sort, direction, request.GET.get('category'), query
+        )
+        paginator = Paginator(product_ids, per_page)
         page = request.GET.get('page')
         try:
             products = paginator.page(page)
@@ -91,6 +132,11 @@ def all_products(request):
             products = paginator.page(1)
         except EmptyPage:
             products = paginator.page(paginator.num_pages)
+        products_by_id = get_products(products.object_list)
+        products.object_list = [
+            products_by_id[pk] for pk in products.object_list
+            if pk in products_by_id
+        ]
     current_sorting = f'{sort}_{direction}'
 
     context = {
@@ -98,37 +144,44 @@ def all_products(request):
         'search_term': query,
         'current_categories': categories,
         'current_sorting': current_sorting,
-        'wishlist_products': wishlist_products,
+        'wishlist_product_ids': wishlist_product_ids,
+        'next_page_url': next_page_url,
+        'first_page_url': first_page_url,
     }
 
     return render(request, 'products/products.html', context)
 
 
+@cache_anonymous_page(params=('stars', 'page'))
 def product_detail(request, product_id):
     """ View to show individual product details with filtering """
-    product = get_object_or_404(Product, pk=product_id)
+    product = get_product(product_id)
+    if product is None:
+        raise Http404('No Product matches the given query.')
 
     # Check if the product is in the user's wishlist
-    is_in_wishlist = (
-        request.user.is_authenticated and
-        request.user.userprofile.wishlist.products.filter(
-            pk=product.pk
-        ).exists()
-    )
+    wishlist_product_ids = get_wishlist_product_ids(request)
+    is_in_wishlist = product.pk in wishlist_product_ids
 
     # Get filter for reviews based on stars
     star_filter = request.GET.get('stars')
-    reviews = product.reviews.all()
+    reviews = product.reviews.select_related('user').only(
+        'rating', 'comment', 'created_at', 'user__username'
+    )
 
     # Ensure consistent ordering for pagination
     reviews = reviews.order_by('-created_at')
 
     # Handle specific star filter, excluding 'all'
-    if star_filter and star_filter != 'all':
-        reviews = reviews.filter(rating=star_filter)
+    stars = None
+    if star_filter in ('1', '2', '3', '4', '5'):
+        stars = int(star_filter)
+        reviews = reviews.filter(rating=stars)
 
-    # Paginate reviews
+    # Paginate reviews, taking the count from the product's review
+    # aggregates rather than a COUNT query
     paginator = Paginator(reviews, 5)
+    paginator.count = product.get_review_count(stars)
     page = request.GET.get('page')
 
     try:
@@ -137,13 +190,18 @@ def product_detail(request, product_id):
         reviews = paginator.page(1)
     except EmptyPage:
         reviews = paginator.page(paginator.num_pages)
+    reviews.object_list = get_review_page(
+        product, reviews.object_list, stars, reviews.number
+    )
 
     context = {
         'product': product,
         'reviews': reviews,
         'star_filter': star_filter,
         'is_in_wishlist': is_in_wishlist,
+        'wishlist_product_ids': wishlist_product_ids,
         'range': range(1, 6),
+        'review_histogram': product.get_review_histogram(),
     }
 
     return render(request, 'products/product_detail.html', context)
@@ -152,34 +210,9 @@ def product_detail(request, product_id):
 def custom_product(request):
     """ A view to render the custom product page with customizable options """
 
-    # Fetch all products categorized as 'Custom Drones'
-    custom_drones = Product.objects.filter(
-        category__name="custom_drones"
-    ).annotate(base_model=Substr('sku', 1, 15))
-
-    unique_drones = {}
-    for drone in custom_drones:
-        base_model = drone.base_model
-
-        # Ensure all trailing digits and hyphens are removed
-        if base_model:
-            base_model = base_model.rstrip("0123456789-")
-
-            # Store unique drone models only once by their cleaned base name
-            if base_model not in unique_drones:
-                unique_drones[base_model] = {
-                    'name': drone.name.split(' - ')[0],
-                    'value': base_model,
-                    'colors': [],
-                }
-
-            # Add color options for each drone type
-            unique_drones[base_model]['colors'].append({
-                'color': drone.color,
-                'image': drone.image,
-            })
-
-    drone_options = list(unique_drones.values())
+    # Drone models and their colour options, from the prebuilt index
+    drone_options = drone_configurator.models()
+    first_option = drone_options[0]['colors'][0] if drone_options else None
 
     colors = [
         ('black', 'Black'), ('white', 'White'), ('blue', 'Blue'),
@@ -188,10 +221,12 @@ def custom_product(request):
     ]
 
     context = {
-        'product': custom_drones.first() if custom_drones.exists() else None,
+        'product': (
+            get_product(first_option['product_id']) if first_option else None
+        ),
         'drones': drone_options,
         'colors': colors,
-        'ATTACHMENTS': ATTACHMENTS,
+        'ATTACHMENTS': attachment_catalogue.all(),
         'MEDIA_URL': settings.MEDIA_URL,
     }
 
@@ -215,15 +250,29 @@ def add_product(request):
                 image = request.FILES['image']
 
                 try:
-                    storage = MediaStorage()  # Use MediaStorage directly
-                    file_name = storage.save(image.name, image)
-                    product.image = file_name
+                    product.image, product.image_derivatives = (
+                        store_product_image(MediaStorage(), image)
+                    )
                 except Exception:
                     messages.error(
                         request,
                         "Error uploading image. Please try again."
                     )
                     return redirect('add_product')
+            elif request.POST.get('image_token'):
+                # Uploaded straight to S3; check it and resize it there
+                try:
+                    product.image, product.image_derivatives = (
+                        complete_direct_upload(
+                            MediaStorage(), request.POST['image_token']
+                        )
+                    )
+                except (signing.BadSignature, InvalidUpload):
+                    messages.error(
+                        request,
+                        "Error uploading image. Please try again."
+                    )
+                    return redirect('add_product')
             else:
                 product.image = 'noimage.webp'
 
@@ -248,6 +297,7 @@ def add_product(request):
     context = {
         'form': form,
         'categories': categories,
+        'direct_uploads': direct_uploads_enabled(),
     }
     return render(request, 'products/add_product.html', context)
 
@@ -258,6 +308,7 @@ def edit_product(request, product_id):
     """Edit a product in the store"""
     product = get_object_or_404(Product, pk=product_id)
     old_image = product.image
+    old_derivatives = product.image_derivatives
 
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES, instance=product)
@@ -267,8 +318,16 @@ def edit_product(request, product_id):
                 # Upload new image to S3
                 image = request.FILES['image']
                 storage = MediaStorage()
-                file_name = storage.save(image.name, image)
-                product.image = file_name
+                try:
+                    product.image, product.image_derivatives = (
+                        store_product_image(storage, image)
+                    )
+                except Exception:
+                    messages.error(
+                        request,
+                        "Error uploading image. Please try again."
+                    )
+                    return redirect('edit_product', product_id=product.id)
 
                 # Delete the old image
                 if old_image and old_image != 'noimage.webp':
@@ -276,6 +335,30 @@ def edit_product(request, product_id):
                         storage.delete(old_image.name)
                     except Exception:
                         pass
+                delete_image_derivatives(storage, old_derivatives)
+
+            elif request.POST.get('image_token'):
+                # Uploaded straight to S3; check it and resize it there
+                storage = MediaStorage()
+                try:
+                    product.image, product.image_derivatives = (
+                        complete_direct_upload(
+                            storage, request.POST['image_token']
+                        )
+                    )
+                except (signing.BadSignature, InvalidUpload):
+                    messages.error(
+                        request,
+                        "Error uploading image. Please try again."
+                    )
+                    return redirect('edit_product', product_id=product.id)
+
+                if old_image and old_image != 'noimage.webp':
+                    try:
+                        storage.delete(old_image.name)
+                    except Exception:
+                        pass
+                delete_image_derivatives(storage, old_derivatives)
 
             elif 'image-clear' in request.POST:
                 # Clear the image
@@ -285,7 +368,9 @@ def edit_product(request, product_id):
                         storage.delete(old_image.name)
                     except Exception:
                         pass
+                delete_image_derivatives(MediaStorage(), old_derivatives)
                 product.image = 'noimage.webp'
+                product.image_derivatives = {}
 
             form.save()
             messages.success(request, 'Successfully updated product!')
@@ -301,10 +386,35 @@ def edit_product(request, product_id):
     context = {
         'form': form,
         'product': product,
+        'direct_uploads': direct_uploads_enabled(),
     }
     return render(request, 'products/edit_product.html', context)
 
 
+@require_POST
+@user_passes_test(is_staff_or_superuser)
+@login_required
+def presign_product_image(request):
+    """Presign a browser upload of a product image straight to S3"""
+    if not direct_uploads_enabled():
+        raise Http404
+    try:
+        data = json.loads(request.body)
+        filename = data['filename']
+        content_type = data['content_type']
+    except (ValueError, KeyError):
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    if content_type not in DIRECT_UPLOAD_CONTENT_TYPES:
+        return JsonResponse(
+            {'error': 'Only JPEG, PNG and WebP images can be uploaded'},
+            status=400,
+        )
+
+    return JsonResponse(
+        create_presigned_post(MediaStorage(), filename, content_type)
+    )
+
+
 @user_passes_test(is_staff_or_superuser)
 @login_required
 def delete_product(request, product_id):
@@ -329,6 +439,7 @@ def delete_custom_product(request, product_id):
     return redirect(reverse('products'))
 
 
+@cache_anonymous_page(params=('compare_drone',))
 def compare_products(request, product_id):
     """
     View to compare a selected drone against others.
@@ -360,14 +471,16 @@ def compare_products(request, product_id):
         except (ValueError, TypeError, InvalidOperation):
             return "Not Available"
 
-    selected_drone = get_object_or_404(Product, pk=product_id)
-    drones = Product.objects.filter(category__name="drones")
+    selected_drone = get_product(product_id)
+    drones = get_category_products("drones")
     compare_drone_id = request.GET.get('compare_drone')
     compare_drone = (
-        get_object_or_404(Product, pk=compare_drone_id)
+        get_product(compare_drone_id)
         if compare_drone_id
-        else drones.first()
+        else (drones[0] if drones else None)
     )
+    if selected_drone is None or compare_drone is None:
+        raise Http404('No Product matches the given query.')
 
     specifications = [
         ('Price', selected_drone.price, compare_drone.price, False),
@@ -490,7 +603,7 @@ def toggle_wishlist(request):
             wishlist, created = Wishlist.objects.get_or_create(
                 user_profile=user_profile)
 
-            if product in wishlist.products.all():
+            if wishlist.products.filter(pk=product.pk).exists():
                 wishlist.products.remove(product)
                 return JsonResponse(
                     {
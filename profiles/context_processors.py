@@ -1,3 +1,6 @@
+from .wishlist import get_wishlist_product_ids
+
+
 def add_can_manage_issues(request):
     """
     Context processor to add `can_manage_issues` variable globally.
@@ -13,3 +16,13 @@ def add_can_manage_issues(request):
     return {
         'can_manage_issues': can_manage_issues,
     }
+
+
+def wishlist_product_ids(request):
+    """
+    Context processor to expose the user's wishlist as a set of product
+    ids. Resolved lazily so pages without wishlist hearts skip the query.
+    """
+    return {
+        'wishlist_product_ids': lambda: get_wishlist_product_ids(request),
+    }
@@ -0,0 +1,70 @@
+from decimal import Decimal
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from products.models import Category, Product
+from .wishlist import get_wishlist_product_ids
+
+
+class WishlistProductIdsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='drones')
+        cls.products = [
+            Product.objects.create(
+                category=category,
+                sku=f'drone-{number}',
+                name=f'Drone {number}',
+                description='A drone',
+                price=Decimal('100.00'),
+            )
+            for number in range(5)
+        ]
+        cls.user = User.objects.create_user('pilot', password='secret')
+        cls.user.userprofile.wishlist.products.add(*cls.products[:2])
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def make_request(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return request
+
+    def test_ids_are_loaded_once_per_request(self):
+        request = self.make_request(self.user)
+        with self.assertNumQueries(1):
+            product_ids = get_wishlist_product_ids(request)
+            get_wishlist_product_ids(request)
+
+        self.assertEqual(
+            product_ids, {product.pk for product in self.products[:2]}
+        )
+
+    def test_anonymous_users_have_no_wishlist(self):
+        with self.assertNumQueries(0):
+            product_ids = get_wishlist_product_ids(
+                self.make_request(AnonymousUser())
+            )
+
+        self.assertEqual(product_ids, frozenset())
+
+    def test_listing_checks_the_wishlist_in_one_query(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('products'))
+
+        self.assertEqual(response.status_code, 200)
+        wishlist_queries = [
+            query for query in queries.captured_queries
+            if 'profiles_wishlist_products' in query['sql']
+        ]
+        self.assertEqual(len(wishlist_queries), 1)
+        self.assertContains(
+            response, 'wishlist-icon wishlist-active', count=2
+        )
@@ -12,15 +12,14 @@ from .forms import (
 )
 from checkout.models import Order
 from products.models import Product
-from django.core.mail import send_mail
+from notifications.mailchimp_sync import queue_subscriber_update
+from notifications.outbox import queue_mail
+from notifications.rendering import build_context, render_email
 from .decorators import superuser_or_staff_required, superuser_required
-from utils.mailchimp_utils import Mailchimp
 from django.contrib.auth.models import User
 from django.http import JsonResponse, Http404
 import json
 import re
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
 from django.views.decorators.http import require_POST
 
 
@@ -44,17 +43,13 @@ def profile(request):
         if form.is_valid():
             form.save()
 
-            # Sync with Mailchimp
-            try:
-                mailchimp = Mailchimp()
-                mailchimp.subscribe_user(
-                    email=request.user.email,
-                    first_name=request.user.first_name,
-                    last_name=request.user.last_name,
-                    tags=["Profile Updated"]
-                )
-            except Exception:
-                pass
+            # Queue a Mailchimp sync rather than calling the API here
+            queue_subscriber_update(
+                email=request.user.email,
+                first_name=request.user.first_name,
+                last_name=request.user.last_name,
+                tags=["Profile Updated"]
+            )
             messages.success(request, 'Profile updated successfully')
         else:
             messages.error(
@@ -110,30 +105,6 @@ def order_history(request, order_number):
     return render(request, template, context)
 
 
-def get_email_context(request, **kwargs):
-    """Helper function to create consistent email context"""
-    base_context = {
-        'contact_email': 'support@icarusdrones.com',
-        'background_image_url': (
-            "https://dhitchen28963-icarus-drones.s3.us-east-1.amazonaws.com/"
-            "media/homepage_background.webp"
-        ),
-        'facebook_icon_url': (
-            "https://dhitchen28963-icarus-drones.s3.us-east-1.amazonaws.com/"
-            "media/facebook.png"
-        ),
-        'twitter_icon_url': (
-            "https://dhitchen28963-icarus-drones.s3.us-east-1.amazonaws.com/"
-            "media/twitter.png"
-        ),
-        'instagram_icon_url': (
-            "https://dhitchen28963-icarus-drones.s3.us-east-1.amazonaws.com/"
-            "media/instagram.png"
-        ),
-    }
-    return {**base_context, **kwargs}
-
-
 @login_required
 @require_POST
 def toggle_status(request, item_type, item_id):
@@ -240,7 +211,7 @@ def report_order_issue(request, order_number):
             issue.save()
 
             # Notify admin/support via email
-            send_mail(
+            queue_mail(
                 subject=f"Order Issue Reported: {order_number}",
                 message=(
                     f"User {request.user.username} reported an issue with "
@@ -366,8 +337,7 @@ def respond_to_issue(request, issue_id):
 
             try:
                 recipient_email = issue.user.email
-                context = get_email_context(
-                    request,
+                context = build_context(
                     user=issue.user,
                     order=issue.order,
                     original_message=issue.description,
@@ -377,18 +347,18 @@ def respond_to_issue(request, issue_id):
                     unsubscribe_url=f'/unsubscribe/{recipient_email}/'
                 )
 
-                html_message = render_to_string(
+                email = render_email(
                     'profiles/confirmation_emails/order_issue_email.html',
                     context
                 )
 
-                send_mail(
+                queue_mail(
                     subject=(
                         f"Response to your order issue: "
                         f"{issue.order.order_number}"
                     ),
-                    message=strip_tags(html_message),
-                    html_message=html_message,
+                    message=email.body,
+                    html_message=email.html_body,
                     from_email='support@icarusdrones.com',
                     recipient_list=[recipient_email],
                 )
@@ -518,8 +488,7 @@ def respond_to_message(request, message_id):
 
             try:
                 recipient_email = original_message.user.email
-                context = get_email_context(
-                    request,
+                context = build_context(
                     user=original_message.user,
                     original_message=original_message.content,
                     response_message=response_content,
@@ -527,15 +496,15 @@ def respond_to_message(request, message_id):
                     unsubscribe_url=f'/unsubscribe/{recipient_email}/'
                 )
 
-                html_message = render_to_string(
+                email = render_email(
                     'profiles/confirmation_emails/message_response_email.html',
                     context
                 )
 
-                send_mail(
+                queue_mail(
                     subject="Response to your message",
-                    message=strip_tags(html_message),
-                    html_message=html_message,
+                    message=email.body,
+                    html_message=email.html_body,
                     from_email='support@icarusdrones.com',
                     recipient_list=[recipient_email],
                 )
@@ -608,7 +577,7 @@ def toggle_wishlist(request):
                 user_profile=user_profile
             )
 
-            if product in wishlist.products.all():
+            if wishlist.products.filter(pk=product.pk).exists():
                 wishlist.products.remove(product)
                 return JsonResponse({
                     'status': 'removed',
@@ -733,8 +702,7 @@ def respond_to_repair_request(request, request_id):
             )
 
             # Prepare email context
-            context = get_email_context(
-                request,
+            context = build_context(
                 user=repair_request.user,
                 name=(
                     repair_request.user.username
@@ -749,16 +717,16 @@ def respond_to_repair_request(request, request_id):
                 unsubscribe_url=f'/unsubscribe/{repair_request.email}/',
             )
 
-            html_message = render_to_string(
+            email = render_email(
                 'profiles/confirmation_emails/repair_request_email.html',
                 context
             )
 
             # Send email
-            send_mail(
+            queue_mail(
                 subject="Repair Request Update",
-                message=strip_tags(html_message),
-                html_message=html_message,
+                message=email.body,
+                html_message=email.html_body,
                 from_email='support@icarusdrones.com',
                 recipient_list=[repair_request.email],
             )
@@ -810,8 +778,7 @@ def respond_to_contact_message(request, message_id):
             )
 
             # Prepare email context
-            context = get_email_context(
-                request,
+            context = build_context(
                 user=contact_message.user,
                 name=contact_message.name,
                 original_message=contact_message.message,
@@ -821,16 +788,16 @@ def respond_to_contact_message(request, message_id):
                 unsubscribe_url=f'/unsubscribe/{contact_message.email}/'
             )
 
-            html_message = render_to_string(
+            email = render_email(
                 'profiles/confirmation_emails/contact_response_email.html',
                 context
             )
 
             # Send email
-            send_mail(
+            queue_mail(
                 subject="Response to your inquiry",
-                message=strip_tags(html_message),
-                html_message=html_message,
+                message=email.body,
+                html_message=email.html_body,
                 from_email='support@icarusdrones.com',
                 recipient_list=[contact_message.email],
             )
@@ -856,8 +823,7 @@ def unsubscribe(request, email):
     """Handle user unsubscribe requests."""
     try:
         # Unsubscribe the user from the newsletter
-        mailchimp = Mailchimp()
-        mailchimp.unsubscribe_user(email)
+        queue_subscriber_update(email, member_status='unsubscribed')
 
         # Optionally, update subscription status in the database
         profile = UserProfile.objects.filter(user__email=email).first()
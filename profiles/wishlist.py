@@ -0,0 +1,23 @@
+from .models import Wishlist
+
+
+def get_wishlist_product_ids(request):
+    """
+    Return the set of product ids in the current user's wishlist.
+
+    The set is loaded with a single query the first time it is needed
+    and reused for the rest of the request, so templates can test
+    membership per product card without touching the database.
+    """
+    if not request.user.is_authenticated:
+        return frozenset()
+
+    product_ids = getattr(request, '_wishlist_product_ids', None)
+    if product_ids is None:
+        product_ids = frozenset(
+            Wishlist.products.through.objects.filter(
+                wishlist__user_profile__user=request.user
+            ).values_list('product_id', flat=True)
+        )
+        request._wishlist_product_ids = product_ids
+    return product_ids
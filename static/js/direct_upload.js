@@ -0,0 +1,94 @@
+/*
+    Upload product images straight to S3 through a presigned POST.
+
+    When a file is chosen, the upload runs in the background with a
+    progress bar. On success the file input is cleared and the signed
+    key is posted with the form instead, so the web server never handles
+    the file. If anything fails the file is left in place and the form
+    falls back to a normal upload.
+*/
+document.addEventListener('DOMContentLoaded', function() {
+    const input = document.querySelector('input[type="file"][data-presign-url]');
+    if (!input) {
+        return;
+    }
+    const form = input.form;
+    const tokenInput = document.getElementById('id_image_token');
+    const progress = document.getElementById('image-upload-progress');
+    const submitButtons = form.querySelectorAll('[type="submit"]');
+    const csrfToken = form.querySelector('input[name="csrfmiddlewaretoken"]').value;
+
+    function setUploading(uploading) {
+        submitButtons.forEach(function(button) {
+            button.disabled = uploading;
+        });
+        progress.hidden = !uploading;
+    }
+
+    function uploadToS3(presigned, file) {
+        return new Promise(function(resolve, reject) {
+            const data = new FormData();
+            Object.entries(presigned.fields).forEach(function([name, value]) {
+                data.append(name, value);
+            });
+            data.append('file', file);
+
+            const xhr = new XMLHttpRequest();
+            xhr.open('POST', presigned.url);
+            xhr.upload.addEventListener('progress', function(event) {
+                if (event.lengthComputable) {
+                    progress.value = (event.loaded / event.total) * 100;
+                }
+            });
+            xhr.addEventListener('load', function() {
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(presigned.token);
+                } else {
+                    reject(new Error('Upload failed with status ' + xhr.status));
+                }
+            });
+            xhr.addEventListener('error', function() {
+                reject(new Error('Upload failed'));
+            });
+            xhr.send(data);
+        });
+    }
+
+    input.addEventListener('change', function() {
+        const file = input.files[0];
+        tokenInput.value = '';
+        if (!file) {
+            return;
+        }
+
+        progress.value = 0;
+        setUploading(true);
+        fetch(input.dataset.presignUrl, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrfToken,
+            },
+            body: JSON.stringify({filename: file.name, content_type: file.type}),
+        })
+            .then(function(response) {
+                if (!response.ok) {
+                    throw new Error('Could not presign upload');
+                }
+                return response.json();
+            })
+            .then(function(presigned) {
+                return uploadToS3(presigned, file);
+            })
+            .then(function(token) {
+                tokenInput.value = token;
+                input.value = '';
+            })
+            .catch(function(error) {
+                console.error(error);
+            })
+            .finally(function() {
+                setUploading(false);
+            });
+    });
+});
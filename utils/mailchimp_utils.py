@@ -1,6 +1,58 @@
+import hashlib
+import io
+import json
+import tarfile
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
 
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    Return the process-wide requests session used for Mailchimp calls.
+    Connections are kept alive and pooled, and idempotent requests that
+    fail to connect or get a 429/5xx response are retried with backoff.
+    POSTs aren't retried here: a batch Mailchimp accepted before timing
+    out would be submitted twice. The sync queue retries those instead.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=3,
+                    backoff_factor=0.5,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                )
+                session = requests.Session()
+                session.mount(
+                    'https://', HTTPAdapter(pool_maxsize=10, max_retries=retry)
+                )
+                session.mount(
+                    'http://', HTTPAdapter(pool_maxsize=10, max_retries=retry)
+                )
+                _session = session
+    return _session
+
+
+def get_subscriber_hash(email):
+    """
+    Generate the MD5 hash of the user's email address as required
+    by Mailchimp API.
+
+    Args:
+        email (str): The user's email address.
+
+    Returns:
+        str: MD5 hash of the email address.
+    """
+    return hashlib.md5(email.lower().encode()).hexdigest()
+
 
 class Mailchimp:
     """Utility class for interacting with the Mailchimp API"""
@@ -9,12 +61,33 @@ class Mailchimp:
         self.api_key = settings.MAILCHIMP_API_KEY
         self.server_prefix = settings.MAILCHIMP_SERVER_PREFIX
         self.audience_id = settings.MAILCHIMP_AUDIENCE_ID
-        self.base_url = f"https://{self.server_prefix}.api.mailchimp.com/3.0"
+        self.base_url = (
+            settings.MAILCHIMP_API_URL
+            or f"https://{self.server_prefix}.api.mailchimp.com/3.0"
+        ).rstrip('/')
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
 
+    def _request(self, method, path, expected=(200,), **kwargs):
+        response = get_session().request(
+            method,
+            f"{self.base_url}{path}",
+            headers=self.headers,
+            timeout=settings.MAILCHIMP_TIMEOUT,
+            **kwargs,
+        )
+        if response.status_code not in expected:
+            raise Exception(
+                f"Mailchimp API error: {response.status_code} {response.text}")
+        return response.json() if response.content else {}
+
+    def get_member_path(self, email):
+        """API path of a subscriber in the audience"""
+        return (f"/lists/{self.audience_id}/members/"
+                f"{get_subscriber_hash(email)}")
+
     def subscribe_user(self, email, first_name='', last_name='',
                        tags=None, address=None):
         """
@@ -30,33 +103,20 @@ class Mailchimp:
                             {'addr1': '123 Street Name', 'city': 'City',
                             'state': 'State', 'zip': '12345', 'country': 'US'}
         """
-        url = f"{self.base_url}/lists/{self.audience_id}/members"
-        subscriber_hash = self._get_subscriber_hash(email)
+        merge_fields = {"FNAME": first_name, "LNAME": last_name}
+        if address:
+            merge_fields["ADDRESS"] = format_address(address)
         data = {
             "email_address": email,
             "status_if_new": "subscribed",
-            "merge_fields": {
-                "FNAME": first_name,
-                "LNAME": last_name,
-                "ADDRESS": {
-                    "addr1": address.get("addr1", ""),
-                    "city": address.get("city", ""),
-                    "state": address.get("state", ""),
-                    "zip": address.get("zip", ""),
-                    "country": address.get("country", ""),
-                },
-            },
+            "merge_fields": merge_fields,
         }
 
         if tags:
             data["tags"] = tags
 
-        response = requests.put(f"{url}/{subscriber_hash}", json=data,
-                                headers=self.headers)
-        if response.status_code not in (200, 204):
-            raise Exception(
-                f"Mailchimp API error: {response.status_code} {response.text}")
-        return response.json()
+        return self._request('PUT', self.get_member_path(email),
+                             expected=(200, 204), json=data)
 
     def add_tags_to_user(self, email, tags):
         """
@@ -69,17 +129,11 @@ class Mailchimp:
         Returns:
             dict: API response from Mailchimp.
         """
-        url = (f"{self.base_url}/lists/{self.audience_id}/members/"
-               f"{self._get_subscriber_hash(email)}/tags")
         data = {
             "tags": [{"name": tag, "status": "active"} for tag in tags]
         }
-
-        response = requests.post(url, json=data, headers=self.headers)
-        if response.status_code != 200:
-            raise Exception(
-                f"Mailchimp API error: {response.status_code} {response.text}")
-        return response.json()
+        return self._request('POST', f"{self.get_member_path(email)}/tags",
+                             expected=(200, 204), json=data)
 
     def remove_tags_from_user(self, email, tags):
         """
@@ -92,28 +146,70 @@ class Mailchimp:
         Returns:
             dict: API response from Mailchimp.
         """
-        url = (f"{self.base_url}/lists/{self.audience_id}/members/"
-               f"{self._get_subscriber_hash(email)}/tags")
         data = {
             "tags": [{"name": tag, "status": "inactive"} for tag in tags]
         }
+        return self._request('POST', f"{self.get_member_path(email)}/tags",
+                             expected=(200, 204), json=data)
 
-        response = requests.post(url, json=data, headers=self.headers)
-        if response.status_code != 200:
-            raise Exception(
-                f"Mailchimp API error: {response.status_code} {response.text}")
-        return response.json()
+    def submit_batch(self, operations):
+        """
+        Submit operations to Mailchimp's batch endpoint. Mailchimp runs
+        them asynchronously; the results can be looked up by batch id.
 
-    def _get_subscriber_hash(self, email):
+        Args:
+            operations (list): Dicts with method, path and body keys.
+
+        Returns:
+            dict: The batch, including its id and status.
         """
-        Generate the MD5 hash of the user's email address as required
-        by Mailchimp API.
+        return self._request('POST', '/batches',
+                             json={"operations": operations})
+
+    def get_batch(self, batch_id):
+        """
+        Look up the status of a batch.
 
         Args:
-            email (str): The user's email address.
+            batch_id (str): The id returned by submit_batch.
+
+        Returns:
+            dict: The batch, including its status and error count.
+        """
+        return self._request('GET', f"/batches/{batch_id}")
+
+    def get_batch_results(self, batch):
+        """
+        Download the results of a finished batch.
+
+        Args:
+            batch (dict): The batch returned by get_batch.
 
         Returns:
-            str: MD5 hash of the email address.
+            dict: The result of each operation by operation_id, with
+                its status_code and response body.
         """
-        import hashlib
-        return hashlib.md5(email.lower().encode()).hexdigest()
+        response = get_session().get(
+            batch['response_body_url'], timeout=settings.MAILCHIMP_TIMEOUT
+        )
+        response.raise_for_status()
+        results = {}
+        with tarfile.open(fileobj=io.BytesIO(response.content),
+                          mode='r:gz') as archive:
+            for member in archive.getmembers():
+                if not member.isfile():
+                    continue
+                for result in json.load(archive.extractfile(member)):
+                    results[result['operation_id']] = result
+        return results
+
+
+def format_address(address):
+    """Mailchimp ADDRESS merge field from an address dict"""
+    return {
+        "addr1": address.get("addr1", ""),
+        "city": address.get("city", ""),
+        "state": address.get("state", ""),
+        "zip": address.get("zip", ""),
+        "country": address.get("country", ""),
+    }
@@ -0,0 +1,185 @@
+"""
+Whole-page caching for storefront pages seen by anonymous visitors.
+
+An anonymous visitor with an empty bag and no pending messages sees the
+same page as every other such visitor, apart from the CSRF token. Those
+pages are rendered once per URL and catalogue version, with a
+placeholder in place of the token, and later visitors get the cached
+copy with their own token filled in.
+
+Only the query parameters a page is known to read are part of its cache
+key, and the page is rendered with just those, so tracking or
+cache-busting parameters can't fill the cache with copies of a page.
+
+Cached pages carry an ETag and Last-Modified, so browsers and CDNs can
+revalidate them with a conditional request and get a 304. Everyone else
+gets a normally rendered page.
+"""
+import hashlib
+import time
+from functools import wraps
+from django.conf import settings
+from django.contrib import messages
+from django.http import HttpResponse, QueryDict
+from django.middleware.csrf import get_token
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from bag.encoding import get_session_bag
+from products.catalogue import (
+    CATALOGUE_CACHE_TIMEOUT, get_catalogue_cache, get_catalogue_version,
+)
+
+CSRF_PLACEHOLDER = '__page_cache_csrf_token__'
+# Query parameters the storefront listings read; any others are dropped
+# from cached requests
+PAGE_CACHE_PARAMS = (
+    'q', 'category', 'sort', 'direction', 'page', 'cursor', 'per_page',
+)
+
+
+def csrf_placeholder(request):
+    """
+    Context processor that renders a placeholder instead of the CSRF
+    token while a page is being rendered for the page cache. It must be
+    listed after the built-in csrf processor, which it overrides.
+    """
+    if getattr(request, '_page_cache_render', False):
+        return {'csrf_token': CSRF_PLACEHOLDER}
+    return {}
+
+
+def is_shared_page_request(request):
+    """Whether the request would see the same page as any anonymous one"""
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not get_session_bag(request.session)
+        and not len(messages.get_messages(request))
+    )
+
+
+def get_page_query(query, params):
+    """A copy of a QueryDict with only the given parameters"""
+    page_query = QueryDict(mutable=True)
+    for param in params:
+        if param in query:
+            page_query.setlist(param, query.getlist(param))
+    page_query._mutable = False
+    return page_query
+
+
+def get_page_cache_key(request):
+    """
+    Cache key for a page, by URL, sorted query and catalogue version.
+    Call it once the request's query is reduced by get_page_query.
+    """
+    url = repr((
+        request.scheme,
+        request.get_host(),
+        request.path,
+        sorted(request.GET.lists()),
+    ))
+    digest = hashlib.sha256(url.encode()).hexdigest()
+    return f'page:{get_catalogue_version()}:{digest}'
+
+
+def get_page_etag(key, request):
+    """
+    ETag of a cached page for this visitor. It includes their CSRF
+    cookie, so a page revalidated after the cookie changes is resent
+    with a token that matches the new cookie.
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    return quote_etag(
+        hashlib.sha256(f'{key}:{csrf_cookie}'.encode()).hexdigest()[:32]
+    )
+
+
+def render_page_entry(view, request, *args, **kwargs):
+    """
+    Render a view for the page cache. Returns (response, entry), where
+    entry is None when the response can't be shared.
+    """
+    request._page_cache_render = True
+    try:
+        response = view(request, *args, **kwargs)
+    finally:
+        request._page_cache_render = False
+
+    if response.streaming:
+        return response, None
+    if hasattr(response, 'render') and callable(response.render):
+        response.render()
+    if (
+        response.status_code != 200
+        or response.cookies
+        or request.session.modified
+        or len(messages.get_messages(request))
+    ):
+        return response, None
+    return response, {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'rendered_at': int(time.time()),
+    }
+
+
+def fill_csrf_token(request, content):
+    """Put this visitor's CSRF token in place of the placeholder"""
+    placeholder = CSRF_PLACEHOLDER.encode()
+    if placeholder not in content:
+        return content
+    return content.replace(placeholder, get_token(request).encode())
+
+
+def cache_anonymous_page(view=None, params=PAGE_CACHE_PARAMS):
+    """
+    Serve a view from the page cache when the visitor is anonymous,
+    with an empty bag and no pending messages. `params` are the query
+    parameters the view reads, and may be passed to decorate views
+    that read others, e.g. @cache_anonymous_page(params=('stars',)).
+    """
+    if view is None:
+        return lambda view: cache_anonymous_page(view, params)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_shared_page_request(request):
+            return view(request, *args, **kwargs)
+
+        request.GET = get_page_query(request.GET, params)
+        cache = get_catalogue_cache()
+        key = get_page_cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response, entry = render_page_entry(
+                view, request, *args, **kwargs
+            )
+            if entry is None:
+                if not response.streaming:
+                    response.content = fill_csrf_token(
+                        request, response.content
+                    )
+                return response
+            cache.set(key, entry, CATALOGUE_CACHE_TIMEOUT)
+
+        etag = get_page_etag(key, request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=entry['rendered_at']
+        )
+        if response is None:
+            response = HttpResponse(
+                fill_csrf_token(request, entry['content']),
+                content_type=entry['content_type'],
+            )
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(entry['rendered_at'])
+        # Shared caches must revalidate, and must not reuse the page for
+        # visitors with a different session or CSRF cookie
+        patch_cache_control(response, max_age=0, must_revalidate=True)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    return wrapper
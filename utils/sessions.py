@@ -0,0 +1,100 @@
+"""
+Session engine with a cache in front of the database.
+
+Reads come from the cache and fall back to the django_session table.
+Writes are dirty-checked, so a request that assigns the same bag back
+to the session writes nothing. Changed sessions are written to the
+cache at once and written behind to the database at most once every
+SESSION_WRITE_BEHIND_INTERVAL seconds; until then the cache holds the
+newer copy. With an interval of 0 every change is written through.
+
+Changes to the keys in SESSION_WRITE_THROUGH_KEYS, such as the bag, are
+always written through, so they are never lost if the cache drops the
+newer copy before the session is saved again.
+
+Write-behind relies on a cache shared by every process, such as Redis.
+"""
+import hashlib
+import time
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import (
+    SessionStore as CachedDBStore
+)
+
+KEY_PREFIX = 'utils.sessions'
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        # Digests of the data as loaded, all of it and just the keys
+        # that are written through, and when it last reached the DB
+        self._loaded_digest = None
+        self._loaded_write_through_digest = None
+        self._db_saved_at = None
+
+    def _get_digest(self, data):
+        return hashlib.sha256(self.serializer().dumps(data)).hexdigest()
+
+    def _get_write_through_digest(self, data):
+        keys = getattr(settings, 'SESSION_WRITE_THROUGH_KEYS', ())
+        return self._get_digest({key: data.get(key) for key in keys})
+
+    def load(self):
+        try:
+            entry = self._cache.get(self.cache_key)
+        except Exception:
+            # If the cache is unavailable, fall back to the database
+            entry = None
+
+        if entry is not None:
+            data = entry['data']
+            self._db_saved_at = entry['db_saved_at']
+        else:
+            s = self._get_session_from_db()
+            if s:
+                data = self.decode(s.session_data)
+                self._db_saved_at = time.time()
+                self._cache.set(
+                    self.cache_key,
+                    {'data': data, 'db_saved_at': self._db_saved_at},
+                    self.get_expiry_age(expiry=s.expire_date),
+                )
+            else:
+                data = {}
+        self._loaded_digest = self._get_digest(data)
+        self._loaded_write_through_digest = (
+            self._get_write_through_digest(data)
+        )
+        return data
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+        digest = self._get_digest(data)
+        if not must_create and digest == self._loaded_digest:
+            return
+
+        now = time.time()
+        interval = getattr(settings, 'SESSION_WRITE_BEHIND_INTERVAL', 0)
+        write_through_digest = self._get_write_through_digest(data)
+        if (
+            must_create
+            or self._db_saved_at is None
+            or now - self._db_saved_at >= interval
+            or write_through_digest != self._loaded_write_through_digest
+        ):
+            # Skip CachedDBStore.save, which would also cache the raw data
+            super(CachedDBStore, self).save(must_create=must_create)
+            self._db_saved_at = now
+        self._cache.set(
+            self.cache_key,
+            {'data': data, 'db_saved_at': self._db_saved_at},
+            self.get_expiry_age(),
+        )
+        self._loaded_digest = digest
+        self._loaded_write_through_digest = write_through_digest
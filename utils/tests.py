@@ -0,0 +1,134 @@
+from decimal import Decimal
+from unittest import mock
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from products.catalogue import VersionTokens
+from products.models import Category, Product, ProductReview
+from products.tests import LOCAL_CACHES
+from .page_cache import cache_anonymous_page
+from .sessions import SessionStore
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    SESSION_WRITE_BEHIND_INTERVAL=60,
+    SESSION_WRITE_THROUGH_KEYS=('bag',),
+)
+class SessionStoreTests(TestCase):
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        session = SessionStore()
+        session['bag'] = {'1': 1}
+        session['save_info'] = True
+        session.create()
+        self.session_key = session.session_key
+
+    def load(self):
+        session = SessionStore(self.session_key)
+        session.load()
+        return session
+
+    def stored_data(self):
+        return Session.objects.get(pk=self.session_key).get_decoded()
+
+    def test_unchanged_session_is_not_written(self):
+        session = self.load()
+        session['bag'] = {'1': 1}
+        with self.assertNumQueries(0):
+            session.save()
+
+    def test_changes_are_written_behind(self):
+        session = self.load()
+        session['save_info'] = False
+        with self.assertNumQueries(0):
+            session.save()
+
+        self.assertIs(self.stored_data()['save_info'], True)
+        self.assertIs(self.load()['save_info'], False)
+
+    def test_write_through_keys_reach_the_database_at_once(self):
+        session = self.load()
+        session['bag'] = {'1': 2}
+        session['save_info'] = False
+        session.save()
+
+        self.assertEqual(
+            self.stored_data(), {'bag': {'1': 2}, 'save_info': False}
+        )
+
+    def test_write_through_survives_losing_the_cache(self):
+        session = self.load()
+        session['bag'] = {'1': 3}
+        session.save()
+        caches['sessions'].clear()
+
+        self.assertEqual(self.load()['bag'], {'1': 3})
+
+    @override_settings(SESSION_WRITE_BEHIND_INTERVAL=0)
+    def test_every_change_is_written_through_without_an_interval(self):
+        session = self.load()
+        session['save_info'] = False
+        session.save()
+
+        self.assertIs(self.stored_data()['save_info'], False)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class PageCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(
+            category=Category.objects.create(name='drones'),
+            name='Falcon', description='A drone', price=Decimal('100.00'),
+        )
+        for rating, comment in ((5, 'Flies beautifully'), (1, 'Crashed')):
+            ProductReview.objects.create(
+                product=cls.product, rating=rating, comment=comment,
+                user=User.objects.create_user(f'pilot{rating}'),
+            )
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        patcher = mock.patch('products.catalogue._versions', VersionTokens())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def render(self, view, query):
+        request = RequestFactory().get('/products/', query)
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        return cache_anonymous_page(view)(request)
+
+    def test_unknown_parameters_share_the_cached_page(self):
+        seen = []
+
+        def view(request):
+            seen.append(request.GET.dict())
+            return HttpResponse('Products')
+
+        self.render(view, {'sort': 'price', 'utm_source': 'newsletter'})
+        self.render(view, {'sort': 'price', 'utm_source': 'social'})
+        self.render(view, {'sort': 'price', 'page': '2'})
+
+        self.assertEqual(
+            seen, [{'sort': 'price'}, {'sort': 'price', 'page': '2'}]
+        )
+
+    def test_views_can_declare_their_parameters(self):
+        url = reverse('product_detail', args=[self.product.pk])
+
+        self.assertContains(self.client.get(url), 'Crashed')
+        filtered = self.client.get(url, {'stars': 5, 'utm_source': 'ad'})
+
+        self.assertContains(filtered, 'Flies beautifully')
+        self.assertNotContains(filtered, 'Crashed')
+        # Served from the cache, without rendering a template
+        self.assertIsNone(self.client.get(url, {'stars': 5}).context)